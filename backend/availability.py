@@ -0,0 +1,124 @@
+"""
+Наличие мест рейса в tour_availability (migrations/0009_tour_availability.sql).
+
+segment_seats[k] — битовое множество мест, свободных на сегменте k
+(нумерация сегментов как в segments.py): бит (n - 1) установлен, если
+место n не заблокировано и сегмент k в его seat.available свободен.
+Число мест на участке first..last — число единиц в AND элементов
+first..last; представление available считает его функцией pair_seats.
+
+Обработчики, меняющие seat.available или seat.blocked, в той же транзакции
+передают сюда итоговое состояние изменённых мест (update_seats). Строка
+рейса обновляется после строк мест, поэтому порядок блокировок у всех
+обработчиков один и тот же.
+"""
+from fastapi import HTTPException
+
+WORD = (1 << 64) - 1
+
+# Состояние мест рейса: masks — маски свободных сегментов (0 у заблокированных)
+UPDATE_SEATS_QUERY = """
+    UPDATE tour_availability
+    SET segment_seats = set_seat_segments(segment_seats, %(seat_nums)s::int[], %(masks)s::bigint[])
+    WHERE tour_id = %(tour_id)s
+    RETURNING segment_seats
+"""
+
+# Состояние места, которое не удалось занять условным UPDATE (refuse_seat)
+SEAT_STATE_QUERY = """
+    SELECT id, blocked, held & %(mask)s::bigint <> 0
+    FROM seat
+    WHERE tour_id = %(tour_id)s AND seat_num = %(seat_num)s
+"""
+
+# Новые рейсы: свободны все сегменты у всех активных мест
+INSERT_TOURS_QUERY = """
+    INSERT INTO tour_availability (tour_id, segment_seats)
+    SELECT t.id, array_fill(%(free)s::bigint, ARRAY[%(segments)s])
+    FROM unnest(%(tour_ids)s::int[]) AS t(id)
+"""
+
+# Пересчёт строк рейсов по seat (seed_data.py, сверка в stress_booking.py)
+REBUILD_TOURS_QUERY = """
+    INSERT INTO tour_availability (tour_id, segment_seats)
+    SELECT t.id, ARRAY(
+        SELECT coalesce(bit_or(1::bigint << (s.seat_num - 1))
+                        FILTER (WHERE NOT s.blocked AND (s.available >> (k - 1)) & 1 = 1), 0)
+        FROM generate_series(1, (SELECT count(*)::int - 1 FROM routestop rs WHERE rs.route_id = t.route_id)) k
+        LEFT JOIN seat s ON s.tour_id = t.id
+        GROUP BY k
+        ORDER BY k
+    )
+    FROM tour t
+    WHERE t.id = ANY(%(tour_ids)s::int[])
+    ON CONFLICT (tour_id) DO UPDATE SET segment_seats = EXCLUDED.segment_seats
+"""
+
+
+def seat_set(seat_nums):
+    """Битовое множество мест seat_nums."""
+    result = 0
+    for seat_num in seat_nums:
+        result |= 1 << (seat_num - 1)
+    return result
+
+
+def insert_tours(cur, tour_ids, num_segments, active_seats):
+    cur.execute(INSERT_TOURS_QUERY, {
+        "tour_ids": tour_ids,
+        "segments": num_segments,
+        "free": seat_set(active_seats),
+    })
+
+
+def update_seats(cur, tour_id, seats):
+    """
+    Записывает состояние мест [(seat_num, available, blocked, held), ...].
+    Возвращает новый segment_seats рейса (None, если мест нет).
+    """
+    if not seats:
+        return None
+    cur.execute(UPDATE_SEATS_QUERY, {
+        "tour_id": tour_id,
+        "seat_nums": [seat[0] for seat in seats],
+        "masks": [0 if seat[2] else seat[1] for seat in seats],
+    })
+    row = cur.fetchone()
+    return row[0] if row else None
+
+
+def refuse_seat(cur, params):
+    """
+    Отказ, если место не удалось занять (продажа, удержание): нет места,
+    заблокировано, удержано или продано. params — tour_id, seat_num и mask
+    условного UPDATE.
+    """
+    cur.execute(SEAT_STATE_QUERY, params)
+    seat_state = cur.fetchone()
+    if not seat_state:
+        raise HTTPException(status_code=404, detail="Seat not found")
+    if seat_state[1]:
+        raise HTTPException(status_code=400, detail="Seat is blocked")
+    if seat_state[2]:
+        raise HTTPException(status_code=409, detail="Seat is held by another customer")
+    raise HTTPException(status_code=409, detail="Seat already booked for selected segments")
+
+
+def pair_seats(segment_seats, first, last):
+    """Число мест, свободных на всех сегментах first..last (как pair_seats в БД)."""
+    free = WORD
+    for k in range(first - 1, last):
+        free &= segment_seats[k] if k < len(segment_seats) else 0
+    return (free & WORD).bit_count()
+
+
+def pair_counts(route, segment_seats, pairs):
+    """{(dep, arr): число свободных мест} для пар маршрута route."""
+    return {pair: pair_seats(segment_seats, *route.spans[pair]) for pair in pairs}
+
+
+def sold_out(route, segment_seats, pairs):
+    """Пары из pairs, на которых не осталось свободных мест."""
+    if segment_seats is None:
+        return []
+    return [pair for pair, seats in pair_counts(route, segment_seats, pairs).items() if seats == 0]
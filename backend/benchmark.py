@@ -0,0 +1,267 @@
+"""
+Замер времени ответа API по основным сценариям и сравнение с эталоном.
+
+Каждый сценарий выполняет --requests запросов со случайными параметрами,
+взятыми из данных БД (рейсы, участки маршрутов, даты), и считает p50, p95,
+p99 и среднее время ответа. Данные удобно готовить через seed_data.py,
+чтобы замеры между запусками были сопоставимы.
+
+Запуск (из каталога backend):
+    python benchmark.py                            # обработчики в процессе
+    python benchmark.py --url http://127.0.0.1:8000
+    python benchmark.py --save bench-baseline.json # записать эталон
+    python benchmark.py --baseline bench-baseline.json
+
+При сравнении с эталоном сценарий считается замедлившимся, если его p95
+вырос больше чем в --threshold раз (и больше чем на --min-delta мс,
+чтобы не реагировать на шум быстрых запросов). Код возврата 1, если
+есть замедлившиеся сценарии.
+
+Сценарии tickets_create и tickets_batch продают места (при конфликте
+ответ 409 тоже считается замером); --no-writes отключает их.
+"""
+import argparse
+import json
+import random
+import statistics
+import sys
+import time
+from datetime import datetime, timedelta
+
+from database import get_connection
+
+SAMPLE_TOURS = 500
+
+SAMPLE_QUERY = """
+    SELECT t.id, t.route_id, t.pricelist_id, t.date, t.seats,
+           array_agg(rs.stop_id ORDER BY rs."order")
+    FROM tour t
+    JOIN routestop rs ON rs.route_id = t.route_id
+    GROUP BY t.id
+    HAVING count(*) >= 2
+    ORDER BY random()
+    LIMIT %s
+"""
+
+
+def load_sample(seed):
+    """Случайная выборка рейсов с остановками их маршрутов."""
+    conn = get_connection()
+    cur = conn.cursor()
+    try:
+        cur.execute("SELECT setseed(%s);", ((seed % 1000) / 1000,))
+        cur.execute(SAMPLE_QUERY, (SAMPLE_TOURS,))
+        return [
+            {"id": r[0], "route_id": r[1], "pricelist_id": r[2], "date": r[3], "seats": r[4], "stops": r[5]}
+            for r in cur.fetchall()
+        ]
+    finally:
+        conn.rollback()
+        cur.close()
+        conn.close()
+
+
+def scenarios(tours, rnd, writes=True):
+    """{название: функция, возвращающая (метод, путь, параметры, тело)}."""
+    def tour_pair():
+        tour = rnd.choice(tours)
+        i = rnd.randrange(len(tour["stops"]) - 1)
+        j = rnd.randrange(i + 1, len(tour["stops"]))
+        return tour, tour["stops"][i], tour["stops"][j]
+
+    def seat_map():
+        tour, dep, arr = tour_pair()
+        return "GET", "/seat/", {"tour_id": tour["id"], "departure_stop_id": dep, "arrival_stop_id": arr}, None
+
+    def search_departures():
+        return "GET", "/search/departures", None, None
+
+    def search_arrivals():
+        _, dep, _ = tour_pair()
+        return "GET", "/search/arrivals", {"departure_stop_id": dep}, None
+
+    def search_dates():
+        _, dep, arr = tour_pair()
+        return "GET", "/search/dates", {"departure_stop_id": dep, "arrival_stop_id": arr}, None
+
+    def tours_search():
+        tour, dep, arr = tour_pair()
+        return "GET", "/tours/search", {
+            "departure_stop_id": dep, "arrival_stop_id": arr, "date": tour["date"].isoformat()
+        }, None
+
+    def available_by_tour():
+        return "GET", "/available/", {"tour_id": rnd.choice(tours)["id"]}, None
+
+    def route_stops():
+        return "GET", f"/routes/{rnd.choice(tours)['route_id']}/stops", None, None
+
+    def prices_by_pricelist():
+        return "GET", "/prices/", {"pricelist_id": rnd.choice(tours)["pricelist_id"]}, None
+
+    def month_filters():
+        start = rnd.choice(tours)["date"].replace(day=1)
+        end = (start + timedelta(days=31)).replace(day=1) - timedelta(days=1)
+        filters = {"start_date": start.isoformat(), "end_date": end.isoformat()}
+        if rnd.random() < 0.5:
+            filters["route_id"] = rnd.choice(tours)["route_id"]
+        return filters
+
+    def report_summary():
+        return "POST", "/report/summary", None, month_filters()
+
+    def report_tickets():
+        return "POST", "/report/tickets", {"limit": 50}, month_filters()
+
+    def tickets_create():
+        tour, dep, arr = tour_pair()
+        return "POST", "/tickets/", None, {
+            "tour_id": tour["id"],
+            "seat_num": rnd.randint(1, tour["seats"]),
+            "passenger_name": "Benchmark passenger",
+            "departure_stop_id": dep,
+            "arrival_stop_id": arr,
+        }
+
+    def tickets_batch():
+        tour, dep, arr = tour_pair()
+        first = rnd.randint(1, tour["seats"] - 2)
+        return "POST", "/tickets/batch", None, {
+            "tour_id": tour["id"],
+            "departure_stop_id": dep,
+            "arrival_stop_id": arr,
+            "tickets": [
+                {"seat_num": n, "passenger_name": "Benchmark passenger"} for n in range(first, first + 3)
+            ],
+        }
+
+    result = {
+        "seat_map": seat_map,
+        "search_departures": search_departures,
+        "search_arrivals": search_arrivals,
+        "search_dates": search_dates,
+        "tours_search": tours_search,
+        "available_by_tour": available_by_tour,
+        "route_stops": route_stops,
+        "prices_by_pricelist": prices_by_pricelist,
+        "report_summary": report_summary,
+        "report_tickets": report_tickets,
+    }
+    if writes:
+        result["tickets_create"] = tickets_create
+        result["tickets_batch"] = tickets_batch
+    return result
+
+
+def measure(client, make_request, count, warmup):
+    """Времена ответов (мс) и коды ответов для count запросов после warmup прогревочных."""
+    timings = []
+    statuses = {}
+    for n in range(warmup + count):
+        method, path, params, body = make_request()
+        started = time.perf_counter()
+        response = client.request(method, path, params=params, json=body)
+        elapsed = (time.perf_counter() - started) * 1000
+        if n < warmup:
+            continue
+        timings.append(elapsed)
+        statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+    return timings, statuses
+
+
+def summarize(timings, statuses):
+    q = statistics.quantiles(timings, n=100, method="inclusive")
+    return {
+        "n": len(timings),
+        "p50": round(q[49], 3),
+        "p95": round(q[94], 3),
+        "p99": round(q[98], 3),
+        "mean": round(statistics.fmean(timings), 3),
+        "statuses": {str(code): count for code, count in sorted(statuses.items())},
+    }
+
+
+def compare(results, baseline, threshold, min_delta):
+    """[(сценарий, p95 эталона, p95 сейчас), ...] для замедлившихся сценариев."""
+    regressions = []
+    for name, current in results.items():
+        base = baseline.get(name)
+        if base is None:
+            continue
+        if current["p95"] > base["p95"] * threshold and current["p95"] - base["p95"] > min_delta:
+            regressions.append((name, base["p95"], current["p95"]))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", help="адрес запущенного API; по умолчанию обработчики вызываются в процессе")
+    parser.add_argument("--requests", type=int, default=200, help="число замеров на сценарий")
+    parser.add_argument("--warmup", type=int, default=20, help="прогревочные запросы на сценарий")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--only", nargs="+", metavar="SCENARIO", help="выполнить только эти сценарии")
+    parser.add_argument("--no-writes", action="store_true", help="не выполнять сценарии, изменяющие данные")
+    parser.add_argument("--save", metavar="FILE", help="записать результаты в JSON (эталон)")
+    parser.add_argument("--baseline", metavar="FILE", help="сравнить с результатами из JSON")
+    parser.add_argument("--threshold", type=float, default=1.25, help="допустимый рост p95, раз")
+    parser.add_argument("--min-delta", type=float, default=1.0, help="допустимый рост p95, мс")
+    args = parser.parse_args()
+    if args.requests < 2:
+        parser.error("--requests must be at least 2")
+
+    tours = load_sample(args.seed)
+    if not tours:
+        print("no tours in the database: run seed_data.py first")
+        return 1
+    rnd = random.Random(args.seed)
+    selected = scenarios(tours, rnd, writes=not args.no_writes)
+    if args.only:
+        unknown = set(args.only) - set(selected)
+        if unknown:
+            parser.error(f"unknown scenarios: {', '.join(sorted(unknown))}")
+        selected = {name: selected[name] for name in args.only}
+
+    if args.url:
+        import httpx
+        client_cm = httpx.Client(base_url=args.url, timeout=60)
+    else:
+        from fastapi.testclient import TestClient
+        from main import app
+        client_cm = TestClient(app)
+
+    results = {}
+    print(f"{'scenario':22} {'n':>5} {'p50':>9} {'p95':>9} {'p99':>9} {'mean':>9}  statuses")
+    with client_cm as client:
+        for name, make_request in selected.items():
+            results[name] = summarize(*measure(client, make_request, args.requests, args.warmup))
+            r = results[name]
+            statuses = " ".join(f"{code}:{count}" for code, count in r["statuses"].items())
+            print(f"{name:22} {r['n']:5} {r['p50']:8.2f}ms {r['p95']:8.2f}ms {r['p99']:8.2f}ms "
+                  f"{r['mean']:8.2f}ms  {statuses}")
+
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump({
+                "created": datetime.now().isoformat(timespec="seconds"),
+                "url": args.url,
+                "requests": args.requests,
+                "seed": args.seed,
+                "results": results,
+            }, f, indent=2)
+        print(f"results saved to {args.save}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)["results"]
+        regressions = compare(results, baseline, args.threshold, args.min_delta)
+        if regressions:
+            print(f"p95 regressions (> x{args.threshold} and > {args.min_delta}ms):")
+            for name, before, after in regressions:
+                print(f"  {name}: {before:.2f}ms -> {after:.2f}ms (x{after / before:.2f})")
+            return 1
+        print(f"no p95 regressions against {args.baseline}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,157 @@
+"""
+Сравнение движков продажи билета (BOOKING_ENGINE в routers/ticket.py):
+python — запросы из create_ticket, sql — один вызов функции book_ticket.
+
+Для каждого движка и каждого числа параллельных покупателей (--workers)
+создаются тестовые рейсы (как в stress_booking.py) и продаются --bookings
+билетов без конфликтов: каждое место продаётся по одному сегменту, так что
+замеряется сама продажа, а не отказы. Печатаются пропускная способность,
+p50/p95/p99 времени продажи и число обращений к БД на продажу.
+
+Сеть между приложением и БД моделирует --rtt-ms: задержка перед каждым
+запросом курсора, commit и rollback. Локальная БД отвечает за доли
+миллисекунды, поэтому без задержки разница движков почти не видна.
+
+Запуск (из каталога backend, миграции применены):
+    python benchmark_booking.py
+    python benchmark_booking.py --rtt-ms 1 --workers 1 8 32
+"""
+import argparse
+import itertools
+import math
+import statistics
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import psycopg2
+from fastapi import HTTPException
+from psycopg2 import extensions
+
+import routers.ticket as ticket_router
+from database import DATABASE_URL, ConnectionPool
+from stress_booking import create_fixture, drop_fixture
+
+
+class _Network:
+    """Задержка и счётчик обращений к БД."""
+    rtt = 0.0
+    round_trips = itertools.count()
+
+    @classmethod
+    def trip(cls):
+        next(cls.round_trips)
+        if cls.rtt:
+            time.sleep(cls.rtt)
+
+
+class _RemoteCursor(extensions.cursor):
+    def execute(self, query, vars=None):
+        _Network.trip()
+        return super().execute(query, vars)
+
+
+class _RemoteConnection(extensions.connection):
+    def commit(self):
+        _Network.trip()
+        return super().commit()
+
+    def rollback(self):
+        _Network.trip()
+        return super().rollback()
+
+
+class _RemotePool(ConnectionPool):
+    def _connect(self):
+        conn = psycopg2.connect(self.dsn, connection_factory=_RemoteConnection, cursor_factory=_RemoteCursor)
+        with self._cond:
+            self.connects += 1
+        return conn
+
+
+def make_requests(fixtures, count):
+    """count продаж без пересечений: место × сегмент, по кругу между рейсами."""
+    per_tour = []
+    for fixture in fixtures:
+        stops = fixture["stop_ids"]
+        per_tour.append([
+            {
+                "tour_id": fixture["tour_id"],
+                "seat_num": seat_num,
+                "passenger_name": f"bench passenger {seat_num}-{i}",
+                "departure_stop_id": stops[i],
+                "arrival_stop_id": stops[i + 1],
+            }
+            for i in range(len(stops) - 1)
+            for seat_num in range(1, fixture["seats"] + 1)
+        ])
+    requests = [r for group in itertools.zip_longest(*per_tour) for r in group if r is not None]
+    return requests[:count]
+
+
+def run(pool, requests, workers):
+    """(статусы, времена продаж в мс, общее время в с)."""
+    def book(body):
+        with pool.connection() as conn:
+            started = time.perf_counter()
+            try:
+                ticket_router.create_ticket(ticket_router.TicketCreate(**body), conn)
+                status = 200
+            except HTTPException as e:
+                status = e.status_code
+            return status, (time.perf_counter() - started) * 1000
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        results = list(executor.map(book, requests))
+    elapsed = time.perf_counter() - started
+    return [r[0] for r in results], [r[1] for r in results], elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--bookings", type=int, default=2000, help="число продаж на замер")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 8, 32], help="числа параллельных покупателей")
+    parser.add_argument("--engines", nargs="+", choices=("python", "sql"), default=["python", "sql"])
+    parser.add_argument("--stops", type=int, default=20, help="число остановок тестового маршрута")
+    parser.add_argument("--rtt-ms", type=float, default=0.0, help="задержка сети на обращение к БД, мс")
+    args = parser.parse_args()
+
+    _Network.rtt = args.rtt_ms / 1000
+    pool = _RemotePool(DATABASE_URL, min_size=1, max_size=max(args.workers))
+    capacity = 46 * (args.stops - 1)
+    print(f"{'engine':<8}{'workers':>8}{'sold':>7}{'other':>7}{'req/s':>9}"
+          f"{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'trips':>7}")
+    try:
+        for workers in args.workers:
+            for engine in args.engines:
+                ticket_router.BOOKING_ENGINE = engine
+                with pool.connection() as conn:
+                    if engine == "sql":
+                        cur = conn.cursor()
+                        installed = ticket_router.book_ticket_installed(cur)
+                        cur.close()
+                        conn.rollback()
+                        if not installed:
+                            print("book_ticket() is missing: apply migrations (python migrate.py)")
+                            return 1
+                    fixtures = [create_fixture(conn, args.stops, 46)
+                                for _ in range(math.ceil(args.bookings / capacity))]
+                requests = make_requests(fixtures, args.bookings)
+                trips_before = next(_Network.round_trips)
+                statuses, timings, elapsed = run(pool, requests, workers)
+                trips = next(_Network.round_trips) - trips_before - 1
+                q = statistics.quantiles(timings, n=100, method="inclusive")
+                ok = statuses.count(200)
+                print(f"{engine:<8}{workers:>8}{ok:>7}{len(statuses) - ok:>7}{len(statuses) / elapsed:>9.0f}"
+                      f"{q[49]:>9.2f}{q[94]:>9.2f}{q[98]:>9.2f}{trips / len(statuses):>7.1f}")
+                with pool.connection() as conn:
+                    for fixture in fixtures:
+                        drop_fixture(conn, fixture)
+    finally:
+        pool.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,107 @@
+"""
+Ограниченный по размеру кэш с TTL для результатов чтения.
+
+Значение, вычисленное до инвалидации, в кэш не попадает: перед запросом
+к БД читатель запоминает поколение кэша (generation) и передаёт его в set.
+Любая инвалидация увеличивает поколение, поэтому результат, прочитанный
+до коммита конкурентной записи, будет отброшен.
+"""
+import os
+import threading
+import time
+from collections import OrderedDict
+
+SEARCH_CACHE_SIZE = int(os.getenv("SEARCH_CACHE_SIZE", "4096"))
+SEARCH_CACHE_TTL = float(os.getenv("SEARCH_CACHE_TTL", "300"))
+REPORT_CACHE_SIZE = int(os.getenv("REPORT_CACHE_SIZE", "256"))
+REPORT_CACHE_TTL = float(os.getenv("REPORT_CACHE_TTL", "60"))
+
+_MISSING = object()
+
+
+class TTLCache:
+    def __init__(self, maxsize, ttl):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()  # key -> (expires_at, value)
+        self._lock = threading.Lock()
+        self.generation = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self.evictions = 0
+
+    def get(self, key, default=None):
+        with self._lock:
+            item = self._data.get(key, _MISSING)
+            if item is not _MISSING:
+                expires_at, value = item
+                if expires_at > time.monotonic():
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._data[key]
+            self.misses += 1
+            return default
+
+    def set(self, key, value, generation=None):
+        """Сохраняет значение, если с момента generation не было инвалидаций."""
+        with self._lock:
+            if generation is not None and generation != self.generation:
+                return
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, *keys):
+        with self._lock:
+            self.generation += 1
+            for key in keys:
+                if self._data.pop(key, None) is not None:
+                    self.invalidations += 1
+
+    def clear(self):
+        with self._lock:
+            self.generation += 1
+            self.invalidations += len(self._data)
+            self._data.clear()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "size": len(self._data),
+                "maxsize": self.maxsize,
+                "hits": self.hits,
+                "misses": self.misses,
+                "invalidations": self.invalidations,
+                "evictions": self.evictions,
+            }
+
+
+# Кэш воронки поиска (/search/departures, /search/arrivals, /search/dates).
+# Ключи: ("departures",), ("arrivals", dep), ("dates", dep, arr).
+search_cache = TTLCache(SEARCH_CACHE_SIZE, SEARCH_CACHE_TTL)
+
+
+def invalidate_search(pairs):
+    """
+    Сбрасывает результаты поиска, зависящие от наличия мест на участках
+    pairs = [(departure_stop_id, arrival_stop_id), ...].
+    """
+    keys = {("departures",)}
+    for dep, arr in pairs:
+        keys.add(("arrivals", dep))
+        keys.add(("dates", dep, arr))
+    search_cache.invalidate(*keys)
+
+
+# Кэш сводки отчёта (POST /report/summary). Ключ — значения фильтров.
+report_cache = TTLCache(REPORT_CACHE_SIZE, REPORT_CACHE_TTL)
+
+
+def invalidate_reports():
+    """Сбрасывает сводки отчёта: изменились проданные билеты или цены."""
+    report_cache.clear()
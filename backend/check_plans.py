@@ -0,0 +1,281 @@
+"""
+Проверка планов горячих запросов API на наличие последовательного
+сканирования (Seq Scan).
+
+Запросы берутся из кода (те же константы, что выполняют обработчики)
+и разбираются через EXPLAIN в локальной БД с enable_seqscan = off:
+при таком режиме Postgres выбирает Seq Scan, только если для условия
+нет подходящего индекса.
+
+Чтобы планы соответствовали рабочим объёмам, а не почти пустой базе,
+перед проверкой в той же транзакции создаётся набор данных (маршрут,
+прайс, рейсы с местами, наличием мест и билетами); планировщик оценивает
+число строк по фактическому размеру таблиц. В конце транзакция
+откатывается, база не меняется.
+
+Кроме того, для запросов к наличию мест (EXPECTED_ACCESS) проверяется,
+что tour_availability и остановки маршрута (routestop, из которого
+строится представление route_pair) читаются по своим индексам.
+
+Те же проверки выполняет тест tests/test_query_plans.py (python -m pytest
+из каталога backend; без БД тест пропускается).
+
+Запуск (из каталога backend):
+    python check_plans.py
+    python check_plans.py --tours 1000   # объём тестовых данных
+    python check_plans.py --no-seed      # проверить на данных из БД
+    python check_plans.py -v             # печатать планы целиком
+
+Код возврата 1, если хотя бы один запрос читает таблицу целиком или
+читает наличие мест не по ожидаемому индексу.
+"""
+import argparse
+import json
+import sys
+
+from availability import REBUILD_TOURS_QUERY, SEAT_STATE_QUERY, UPDATE_SEATS_QUERY
+from database import get_connection
+from fares import PRICELIST_FARES_QUERY
+from price_matrix import EXPORT_QUERY as PRICES_EXPORT_QUERY
+from inventory import LOAD_SEATS_QUERY, LOAD_TOUR_QUERY
+from journeys import (
+    DAY_TOURS_QUERY, LEG_SEATS_QUERY, ROUTE_TIMES_QUERY, TOUR_PAIRS_QUERY, TOUR_SEATS_QUERY, TOURS_QUERY,
+)
+from rollup import RECORD_SALE_QUERY, refresh_tours
+from routers.hold import RELEASE_EXPIRED_WHERE, RELEASE_QUERY, RELEASE_TOKEN_WHERE
+from routers.report import DETAILS_QUERY, ROLLUP_COLUMNS, SUMMARY_QUERY, ReportFilters, _report_where
+from routers.search import ARRIVALS_QUERY, DATES_QUERY, DEPARTURES_QUERY
+from routers.ticket import BOOK_SEAT_QUERY, BOOK_SEATS_QUERY, TAKE_HOLDS_QUERY
+from routers.tour import SEARCH_TOURS_QUERY, _insert_tour_inventory
+from topology import ROUTE_STOPS_QUERY, TOUR_ROUTE_QUERY, RouteTopology
+from versions import VERSIONS_QUERY
+
+SEED_STOPS = 10
+SEED_SEATS = 46
+
+SAMPLE_QUERY = """
+    SELECT t.id, t.route_id, t.date, rs1.stop_id, rs2.stop_id, t.pricelist_id
+    FROM tour t
+    JOIN routestop rs1 ON rs1.route_id = t.route_id
+    JOIN routestop rs2 ON rs2.route_id = t.route_id AND rs2."order" > rs1."order"
+    ORDER BY t.id DESC, rs1."order", rs2."order"
+    LIMIT 1
+"""
+
+
+def seed(cur, tours):
+    """
+    Маршрут из SEED_STOPS остановок с полным прайсом и tours рейсов
+    (по одному в день) с местами, наличием мест, проданными
+    билетами на каждом месте и агрегатами продаж.
+    """
+    cur.execute("""
+        INSERT INTO stop (stop_name)
+        SELECT 'plan-check ' || g FROM generate_series(1, %s) AS g
+        RETURNING id;
+    """, (SEED_STOPS,))
+    stops = sorted(row[0] for row in cur.fetchall())
+    cur.execute("INSERT INTO route (name) VALUES ('plan-check') RETURNING id;")
+    route_id = cur.fetchone()[0]
+    cur.execute("""
+        INSERT INTO routestop (route_id, stop_id, "order")
+        SELECT %s, stop_id, ord FROM unnest(%s::int[]) WITH ORDINALITY AS s(stop_id, ord);
+    """, (route_id, stops))
+    cur.execute("INSERT INTO pricelist (name) VALUES ('plan-check') RETURNING id;")
+    pricelist_id = cur.fetchone()[0]
+    route = RouteTopology(route_id, stops)
+    pairs = route.pairs()
+    cur.execute("""
+        INSERT INTO prices (pricelist_id, departure_stop_id, arrival_stop_id, price)
+        SELECT %s, dep, arr, 10 FROM unnest(%s::int[], %s::int[]) AS p(dep, arr);
+    """, (pricelist_id, [p[0] for p in pairs], [p[1] for p in pairs]))
+    cur.execute("""
+        INSERT INTO tour (route_id, pricelist_id, date, seats, layout_variant)
+        SELECT %s, %s, current_date + g, %s, 1 FROM generate_series(1, %s) AS g
+        RETURNING id;
+    """, (route_id, pricelist_id, SEED_SEATS, tours))
+    tour_ids = [row[0] for row in cur.fetchall()]
+    _insert_tour_inventory(cur, tour_ids, route, pricelist_id, SEED_SEATS, range(1, SEED_SEATS + 1))
+    # Билет на первом сегменте каждого места
+    cur.execute("""
+        INSERT INTO ticket (tour_id, seat_id, passenger_id, departure_stop_id, arrival_stop_id)
+        SELECT s.tour_id, s.id, NULL, %s, %s FROM seat s WHERE s.tour_id = ANY(%s);
+    """, (stops[0], stops[1], tour_ids))
+    refresh_tours(cur, tour_ids)
+
+
+# Наличие мест (migrations/0009): строка рейса tour_availability — только
+# по первичному ключу, остановки маршрута для route_pair — по индексам
+# routestop, а не перебором всех рейсов или всех остановок.
+# {запрос: {таблица: допустимые индексы}}; таблица должна быть в плане.
+AVAILABILITY_ACCESS = {"tour_availability": {"tour_availability_pkey"}}
+ROUTE_PAIR_ACCESS = {"routestop": {"routestop_route_order_idx", "routestop_stop_idx"}}
+EXPECTED_ACCESS = {
+    "tickets: update availability": AVAILABILITY_ACCESS,
+    "tours: rebuild availability": {**ROUTE_PAIR_ACCESS, "seat": {"seat_tour_seat_num_idx"}},
+    "tours: search": {**AVAILABILITY_ACCESS, **ROUTE_PAIR_ACCESS},
+    "search: departures": {**AVAILABILITY_ACCESS, **ROUTE_PAIR_ACCESS},
+    "search: arrivals": {**AVAILABILITY_ACCESS, **ROUTE_PAIR_ACCESS},
+    "search: dates": {**AVAILABILITY_ACCESS, **ROUTE_PAIR_ACCESS},
+    "available: by tour": {**AVAILABILITY_ACCESS, **ROUTE_PAIR_ACCESS},
+    "journeys: tour pairs": {**AVAILABILITY_ACCESS, **ROUTE_PAIR_ACCESS},
+    "journeys: leg seats": {**AVAILABILITY_ACCESS, **ROUTE_PAIR_ACCESS},
+}
+
+
+def hot_queries(sample):
+    """[(название, запрос, параметры), ...] с параметрами из sample."""
+    tour_id, route_id, tour_date, dep, arr, pricelist_id = sample
+    seat = {"tour_id": tour_id, "seat_num": 1, "mask": 1}
+    report_where, report_params = _report_where(ReportFilters(), after=(tour_date, 0))
+    details_page = DETAILS_QUERY.format(where_clause=report_where) + " LIMIT 51"
+    summary_where, summary_params = _report_where(
+        ReportFilters(start_date=str(tour_date), end_date=str(tour_date), route_id=route_id),
+        columns=ROLLUP_COLUMNS,
+    )
+    return [
+        ("topology: tour route", TOUR_ROUTE_QUERY, (tour_id,)),
+        ("topology: route stops", ROUTE_STOPS_QUERY, (route_id,)),
+        ("fares: pricelist", PRICELIST_FARES_QUERY, (pricelist_id,)),
+        ("prices: export", PRICES_EXPORT_QUERY, (pricelist_id,)),
+        ("inventory: tour", LOAD_TOUR_QUERY, (tour_id,)),
+        ("inventory: seats", LOAD_SEATS_QUERY, (tour_id,)),
+        ("tickets: book seat", BOOK_SEAT_QUERY, seat),
+        ("tickets: seat state", SEAT_STATE_QUERY, seat),
+        ("tickets: book group", BOOK_SEATS_QUERY, {"tour_id": tour_id, "seat_nums": [1, 2, 3], "mask": 1}),
+        ("tickets: take holds", TAKE_HOLDS_QUERY,
+         {"tour_id": tour_id, "seat_nums": [1], "mask": 1, "hold_token": "x"}),
+        ("holds: release by token", RELEASE_QUERY.format(where=RELEASE_TOKEN_WHERE), {"token": "x"}),
+        ("holds: release expired", RELEASE_QUERY.format(where=RELEASE_EXPIRED_WHERE), {"limit": 1000}),
+        ("tickets: update availability", UPDATE_SEATS_QUERY,
+         {"tour_id": tour_id, "seat_nums": [1], "masks": [1]}),
+        ("tickets: record sale", RECORD_SALE_QUERY,
+         {"tour_id": tour_id, "departure_stop_id": dep, "arrival_stop_id": arr, "tickets": 1}),
+        ("tours: rebuild availability", REBUILD_TOURS_QUERY, {"tour_ids": [tour_id]}),
+        ("tours: search", SEARCH_TOURS_QUERY, (dep, arr, tour_date)),
+        ("search: departures", DEPARTURES_QUERY, None),
+        ("search: arrivals", ARRIVALS_QUERY, {"departure_stop_id": dep}),
+        ("search: dates", DATES_QUERY, (dep, arr)),
+        ("available: by tour",
+         "SELECT tour_id, departure_stop_id, arrival_stop_id, seats FROM available "
+         "WHERE tour_id = %s", (tour_id,)),
+        ("versions: etag", VERSIONS_QUERY, (["prices", "stop"],)),
+        ("journeys: day tours", DAY_TOURS_QUERY, (tour_date,)),
+        ("journeys: tours", TOURS_QUERY, ([tour_id],)),
+        ("journeys: route times", ROUTE_TIMES_QUERY, ([route_id],)),
+        ("journeys: tour pairs", TOUR_PAIRS_QUERY, ([tour_id],)),
+        ("journeys: tour seats", TOUR_SEATS_QUERY, ([tour_id],)),
+        ("journeys: leg seats", LEG_SEATS_QUERY, ([tour_id], [dep], [arr])),
+        ("report: details page", details_page, report_params),
+        ("report: summary", SUMMARY_QUERY.format(where_clause=summary_where), summary_params),
+    ]
+
+
+def plan_nodes(node):
+    yield node
+    for child in node.get("Plans", []):
+        yield from plan_nodes(child)
+
+
+def explain(cur, query, params):
+    """План запроса (корневой узел EXPLAIN FORMAT JSON)."""
+    cur.execute("EXPLAIN (FORMAT JSON) " + query, params)
+    plan = cur.fetchone()[0]
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return plan[0]["Plan"]
+
+
+def table_access(plan):
+    """{таблица: множество индексов, по которым она читается (None — Seq Scan)}."""
+    access = {}
+    for node in plan_nodes(plan):
+        table = node.get("Relation Name")
+        if table is None or "Scan" not in node["Node Type"]:
+            continue
+        if node["Node Type"] == "Seq Scan":
+            indexes = {None}
+        elif node["Node Type"] == "Bitmap Heap Scan":
+            indexes = {n.get("Index Name") for n in plan_nodes(node) if n["Node Type"] == "Bitmap Index Scan"}
+        else:
+            indexes = {node.get("Index Name")}
+        access.setdefault(table, set()).update(indexes)
+    return access
+
+
+def plan_problems(name, plan):
+    """Список проблем плана запроса name: Seq Scan и отступления от EXPECTED_ACCESS."""
+    access = table_access(plan)
+    problems = [f"Seq Scan on {table}" for table, indexes in sorted(access.items()) if None in indexes]
+    for table, allowed in EXPECTED_ACCESS.get(name, {}).items():
+        used = access.get(table)
+        if not used:
+            problems.append(f"{table} is not read")
+        elif used - allowed - {None}:
+            problems.append(f"{table} read by {', '.join(sorted(used - allowed - {None}))}")
+    return problems
+
+
+def prepare(cur, tours=0):
+    """
+    Готовит транзакцию к проверке и возвращает sample для hot_queries.
+    tours > 0 — предварительно создать столько тестовых рейсов (в текущей транзакции).
+    """
+    if tours:
+        seed(cur, tours)
+    cur.execute(SAMPLE_QUERY)
+    sample = cur.fetchone()
+    if sample is None:
+        raise SystemExit("no tours with at least two route stops found: seed the database first")
+    cur.execute("SET LOCAL enable_seqscan = off;")
+    return sample
+
+
+def check(cur, verbose=False, tours=0):
+    """
+    Возвращает список (название, проблема) для запросов с Seq Scan или
+    с чтением наличия мест не по ожидаемым индексам.
+    """
+    problems = []
+    for name, query, params in hot_queries(prepare(cur, tours)):
+        plan = explain(cur, query, params)
+        scans = sorted({
+            f'{n["Node Type"]} {n.get("Index Name") or n.get("Relation Name", "")}'.strip()
+            for n in plan_nodes(plan) if "Scan" in n["Node Type"]
+        })
+        found = plan_problems(name, plan)
+        status = "FAIL" if found else "ok  "
+        print(f"{status} {name}: {', '.join(scans)}")
+        if verbose:
+            print(json.dumps(plan, indent=2))
+        problems.extend((name, problem) for problem in found)
+    return problems
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--tours", type=int, default=500, help="число тестовых рейсов")
+    parser.add_argument("--no-seed", action="store_true", help="не создавать тестовые данные")
+    parser.add_argument("-v", "--verbose", action="store_true", help="печатать планы целиком")
+    args = parser.parse_args()
+
+    conn = get_connection()
+    cur = conn.cursor()
+    try:
+        problems = check(cur, args.verbose, 0 if args.no_seed else args.tours)
+    finally:
+        conn.rollback()
+        cur.close()
+        conn.close()
+
+    if problems:
+        print("problems found:")
+        for name, problem in problems:
+            print(f"  {name}: {problem}")
+        return 1
+    print("no sequential scans in hot queries")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
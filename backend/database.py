@@ -1,8 +1,252 @@
+import os
+import threading
+import time
+from contextlib import contextmanager
+
 import psycopg2
+from fastapi import HTTPException
+from psycopg2 import extensions
+
+from metrics import METRICS_ENABLED, InstrumentedCursor, observe_pool_wait
+
+DATABASE_URL = os.getenv("DATABASE_URL", "postgresql://postgres@localhost:5432/test")
+
+# Размеры пула и таймауты (можно переопределить через переменные окружения)
+POOL_MIN_SIZE = int(os.getenv("DB_POOL_MIN_SIZE", "2"))
+POOL_MAX_SIZE = int(os.getenv("DB_POOL_MAX_SIZE", "20"))
+POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "10"))
+# Соединение, простоявшее в пуле дольше этого времени, проверяется через SELECT 1
+POOL_HEALTH_CHECK_AFTER = float(os.getenv("DB_POOL_HEALTH_CHECK_AFTER", "30"))
+
+
+class PoolTimeout(Exception):
+    """Не удалось получить соединение из пула за отведённое время."""
+
+
+class ConnectionPool:
+    """
+    Потокобезопасный пул соединений psycopg2.
+
+    - держит от min_size до max_size открытых соединений;
+    - при выдаче проверяет соединение (закрытое или «сломанное» заменяется новым);
+    - при возврате откатывает незавершённую транзакцию;
+    - если пул исчерпан, ждёт освобождения соединения не дольше timeout секунд.
+    """
+
+    def __init__(self, dsn, min_size=POOL_MIN_SIZE, max_size=POOL_MAX_SIZE,
+                 timeout=POOL_TIMEOUT, health_check_after=POOL_HEALTH_CHECK_AFTER):
+        if min_size < 0 or max_size < 1 or min_size > max_size:
+            raise ValueError("Invalid pool size")
+        self.dsn = dsn
+        self.min_size = min_size
+        self.max_size = max_size
+        self.timeout = timeout
+        self.health_check_after = health_check_after
+
+        self._cond = threading.Condition()
+        self._idle = []  # [(conn, время возврата в пул)]
+        self._size = 0   # открытые соединения (свободные + выданные)
+        self._closed = False
+
+        # Счётчики
+        self.checkouts = 0
+        self.exhausted = 0     # сколько раз пришлось ждать свободного соединения
+        self.timeouts = 0      # сколько раз ожидание закончилось ошибкой
+        self.wait_time = 0.0   # суммарное время ожидания, сек
+        self.connects = 0
+        self.discarded = 0     # соединения, выброшенные после неудачной проверки
+
+        for _ in range(min_size):
+            self._idle.append((self._connect(), time.monotonic()))
+            self._size += 1
+
+    def _connect(self):
+        if METRICS_ENABLED:
+            conn = psycopg2.connect(self.dsn, cursor_factory=InstrumentedCursor)
+        else:
+            conn = psycopg2.connect(self.dsn)
+        with self._cond:
+            self.connects += 1
+        return conn
+
+    def _is_healthy(self, conn, idle_since):
+        if conn.closed:
+            return False
+        if conn.get_transaction_status() == extensions.TRANSACTION_STATUS_UNKNOWN:
+            return False
+        if time.monotonic() - idle_since < self.health_check_after:
+            return True
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SELECT 1")
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    def _discard(self, conn):
+        with self._cond:
+            self.discarded += 1
+        try:
+            conn.close()
+        except psycopg2.Error:
+            pass
+
+    def getconn(self):
+        start = time.monotonic()
+        deadline = start + self.timeout
+        waited = False
+        with self._cond:
+            while True:
+                if self._closed:
+                    raise PoolTimeout("Connection pool is closed")
+                if self._idle:
+                    conn, idle_since = self._idle.pop()
+                    break
+                if self._size < self.max_size:
+                    # Резервируем место, само подключение выполняется вне блокировки
+                    self._size += 1
+                    conn, idle_since = None, None
+                    break
+                if not waited:
+                    self.exhausted += 1
+                    waited = True
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self.timeouts += 1
+                    self.wait_time += time.monotonic() - start
+                    raise PoolTimeout(
+                        f"No free database connection after {self.timeout:.1f}s "
+                        f"(pool size {self.max_size})"
+                    )
+                self._cond.wait(remaining)
+            self.checkouts += 1
+            waited_for = time.monotonic() - start
+            self.wait_time += waited_for
+        observe_pool_wait(waited_for)
+
+        if conn is not None and not self._is_healthy(conn, idle_since):
+            self._discard(conn)
+            conn = None
+        if conn is None:
+            try:
+                conn = self._connect()
+            except Exception:
+                with self._cond:
+                    self._size -= 1
+                    self._cond.notify()
+                raise
+        return conn
+
+    def putconn(self, conn, discard=False):
+        if not discard and not conn.closed:
+            try:
+                if conn.get_transaction_status() != extensions.TRANSACTION_STATUS_IDLE:
+                    conn.rollback()
+            except psycopg2.Error:
+                discard = True
+        with self._cond:
+            if discard or conn.closed or self._closed:
+                self._size -= 1
+                self._discard(conn)
+            else:
+                self._idle.append((conn, time.monotonic()))
+            self._cond.notify()
+
+    @contextmanager
+    def connection(self):
+        """Выдаёт соединение и гарантированно возвращает его в пул."""
+        conn = self.getconn()
+        discard = False
+        try:
+            yield conn
+        except psycopg2.OperationalError:
+            discard = True
+            raise
+        finally:
+            self.putconn(conn, discard=discard)
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            for conn, _ in self._idle:
+                conn.close()
+            self._size -= len(self._idle)
+            self._idle = []
+            self._cond.notify_all()
+
+    def stats(self):
+        with self._cond:
+            return {
+                "size": self._size,
+                "idle": len(self._idle),
+                "in_use": self._size - len(self._idle),
+                "min_size": self.min_size,
+                "max_size": self.max_size,
+                "checkouts": self.checkouts,
+                "exhausted": self.exhausted,
+                "timeouts": self.timeouts,
+                "wait_time_seconds": self.wait_time,
+                "connects": self.connects,
+                "discarded": self.discarded,
+            }
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ConnectionPool(DATABASE_URL)
+    return _pool
+
+
+def close_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.close()
+            _pool = None
+
+
+@contextmanager
+def connection():
+    """
+    Контекстный менеджер для кода вне HTTP-запросов (скрипты, фоновые задачи):
+
+        with connection() as conn:
+            ...
+    """
+    with get_pool().connection() as conn:
+        yield conn
+
 
-DATABASE_URL = "postgresql://postgres@localhost:5432/test"
+def get_db():
+    """
+    FastAPI-зависимость: соединение из пула на время обработки запроса.
+    Незавершённая транзакция откатывается, соединение возвращается в пул
+    в том числе при исключении в обработчике.
+    """
+    pool = get_pool()
+    try:
+        conn = pool.getconn()
+    except PoolTimeout as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    discard = False
+    try:
+        yield conn
+    except psycopg2.OperationalError:
+        discard = True
+        raise
+    finally:
+        pool.putconn(conn, discard=discard)
 
 
 def get_connection():
+    """Отдельное соединение вне пула (для миграций и одноразовых скриптов)."""
     conn = psycopg2.connect(DATABASE_URL)
     return conn
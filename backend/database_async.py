@@ -0,0 +1,270 @@
+"""
+Асинхронный доступ к БД для «горячих» read-эндпоинтов.
+
+Используется нативный асинхронный режим psycopg2 (async_=True): запросы
+ждут ответа через event loop, а не занимают поток из threadpool Starlette.
+Драйвер, схема и SQL (плейсхолдеры %s) те же, что и в синхронном
+database.py, поэтому один и тот же текст запроса можно выполнять из обоих
+путей. Асинхронные соединения работают в режиме autocommit — подходят
+только для чтения; все записи идут через синхронный пул.
+
+Размер пула ограничивает число одновременных запросов к БД: остальные
+корутины ждут свободное соединение, не блокируя потоки.
+"""
+import asyncio
+import os
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+
+import psycopg2
+from fastapi import HTTPException
+from psycopg2 import extensions
+
+from database import DATABASE_URL, PoolTimeout
+from metrics import observe_pool_wait, observe_statement
+
+ASYNC_POOL_MIN_SIZE = int(os.getenv("DB_ASYNC_POOL_MIN_SIZE", "2"))
+ASYNC_POOL_MAX_SIZE = int(os.getenv("DB_ASYNC_POOL_MAX_SIZE", "20"))
+ASYNC_POOL_TIMEOUT = float(os.getenv("DB_ASYNC_POOL_TIMEOUT", "10"))
+ASYNC_POOL_HEALTH_CHECK_AFTER = float(os.getenv("DB_ASYNC_POOL_HEALTH_CHECK_AFTER", "30"))
+
+
+async def wait_ready(conn):
+    """Дожидается завершения текущей операции асинхронного соединения."""
+    loop = asyncio.get_running_loop()
+    while True:
+        state = conn.poll()
+        if state == extensions.POLL_OK:
+            return
+        fd = conn.fileno()
+        fut = loop.create_future()
+
+        def ready():
+            if not fut.done():
+                fut.set_result(None)
+
+        if state == extensions.POLL_READ:
+            loop.add_reader(fd, ready)
+            remove = loop.remove_reader
+        elif state == extensions.POLL_WRITE:
+            loop.add_writer(fd, ready)
+            remove = loop.remove_writer
+        else:
+            raise psycopg2.OperationalError(f"Unexpected poll state: {state}")
+        try:
+            await fut
+        finally:
+            remove(fd)
+
+
+async def execute(conn, query, params=None):
+    """Выполняет запрос и возвращает курсор; при ошибке курсор закрывается."""
+    start = time.perf_counter()
+    cur = conn.cursor()
+    try:
+        cur.execute(query, params)
+        await wait_ready(conn)
+    except BaseException:
+        try:
+            cur.close()
+        except psycopg2.Error:
+            # Запрос ещё выполняется (например, корутину отменили):
+            # курсор закроется вместе с соединением
+            pass
+        raise
+    finally:
+        observe_statement(time.perf_counter() - start)
+    return cur
+
+
+async def fetchall(conn, query, params=None):
+    cur = await execute(conn, query, params)
+    try:
+        return cur.fetchall()
+    finally:
+        cur.close()
+
+
+async def fetchone(conn, query, params=None):
+    cur = await execute(conn, query, params)
+    try:
+        return cur.fetchone()
+    finally:
+        cur.close()
+
+
+class AsyncConnectionPool:
+    """
+    Пул асинхронных соединений psycopg2 с ограничением параллелизма.
+
+    Счётчики совпадают по смыслу с database.ConnectionPool.
+    """
+
+    def __init__(self, dsn, min_size=ASYNC_POOL_MIN_SIZE, max_size=ASYNC_POOL_MAX_SIZE,
+                 timeout=ASYNC_POOL_TIMEOUT, health_check_after=ASYNC_POOL_HEALTH_CHECK_AFTER):
+        if min_size < 0 or max_size < 1 or min_size > max_size:
+            raise ValueError("Invalid pool size")
+        self.dsn = dsn
+        self.min_size = min_size
+        self.max_size = max_size
+        self.timeout = timeout
+        self.health_check_after = health_check_after
+
+        self._idle = deque()  # (conn, время возврата в пул)
+        self._slots = asyncio.Semaphore(max_size)
+        self._in_use = 0
+        self._demand = 0  # выданные соединения + ожидающие корутины
+        self._closed = False
+
+        self.checkouts = 0
+        self.exhausted = 0
+        self.timeouts = 0
+        self.wait_time = 0.0
+        self.connects = 0
+        self.discarded = 0
+
+    async def open(self):
+        for _ in range(self.min_size - len(self._idle)):
+            self._idle.append((await self._connect(), time.monotonic()))
+
+    async def _connect(self):
+        conn = psycopg2.connect(self.dsn, async_=True)
+        await wait_ready(conn)
+        self.connects += 1
+        return conn
+
+    async def _is_healthy(self, conn, idle_since):
+        if conn.closed:
+            return False
+        if time.monotonic() - idle_since < self.health_check_after:
+            return True
+        try:
+            await fetchone(conn, "SELECT 1")
+            return True
+        except psycopg2.Error:
+            return False
+
+    def _discard(self, conn):
+        self.discarded += 1
+        try:
+            conn.close()
+        except psycopg2.Error:
+            pass
+
+    @asynccontextmanager
+    async def connection(self):
+        if self._closed:
+            raise PoolTimeout("Connection pool is closed")
+        start = time.monotonic()
+        self._demand += 1
+        if self._demand > self.max_size:
+            self.exhausted += 1
+        try:
+            await asyncio.wait_for(self._slots.acquire(), self.timeout)
+        except asyncio.TimeoutError:
+            self._demand -= 1
+            self.timeouts += 1
+            self.wait_time += time.monotonic() - start
+            raise PoolTimeout(
+                f"No free database connection after {self.timeout:.1f}s "
+                f"(pool size {self.max_size})"
+            )
+        except BaseException:
+            self._demand -= 1
+            raise
+        self.checkouts += 1
+        waited_for = time.monotonic() - start
+        self.wait_time += waited_for
+        observe_pool_wait(waited_for)
+        self._in_use += 1
+        try:
+            conn = None
+            while self._idle and conn is None:
+                candidate, idle_since = self._idle.pop()
+                if await self._is_healthy(candidate, idle_since):
+                    conn = candidate
+                else:
+                    self._discard(candidate)
+            if conn is None:
+                conn = await self._connect()
+            try:
+                yield conn
+            finally:
+                # Соединение с незавершённым запросом (например, при отмене
+                # корутины) повторно использовать нельзя.
+                if conn.closed or conn.isexecuting() or self._closed:
+                    self._discard(conn)
+                else:
+                    self._idle.append((conn, time.monotonic()))
+        finally:
+            self._in_use -= 1
+            self._demand -= 1
+            self._slots.release()
+
+    async def close(self):
+        self._closed = True
+        while self._idle:
+            conn, _ = self._idle.pop()
+            conn.close()
+
+    def stats(self):
+        return {
+            "size": self._in_use + len(self._idle),
+            "idle": len(self._idle),
+            "in_use": self._in_use,
+            "min_size": self.min_size,
+            "max_size": self.max_size,
+            "checkouts": self.checkouts,
+            "exhausted": self.exhausted,
+            "timeouts": self.timeouts,
+            "wait_time_seconds": self.wait_time,
+            "connects": self.connects,
+            "discarded": self.discarded,
+        }
+
+
+_async_pool = None
+
+
+def get_async_pool():
+    global _async_pool
+    if _async_pool is None:
+        _async_pool = AsyncConnectionPool(DATABASE_URL)
+    return _async_pool
+
+
+async def open_async_pool():
+    await get_async_pool().open()
+
+
+async def close_async_pool():
+    global _async_pool
+    if _async_pool is not None:
+        await _async_pool.close()
+        _async_pool = None
+
+
+@asynccontextmanager
+async def async_connection():
+    """
+    Соединение из асинхронного пула внутри обработчика — когда оно нужно
+    не всегда (например, только при промахе кэша):
+
+        async with async_connection() as conn:
+            ...
+    """
+    try:
+        async with get_async_pool().connection() as conn:
+            yield conn
+    except PoolTimeout as e:
+        raise HTTPException(status_code=503, detail=str(e))
+
+
+async def get_async_db():
+    """FastAPI-зависимость для async def обработчиков."""
+    try:
+        async with get_async_pool().connection() as conn:
+            yield conn
+    except PoolTimeout as e:
+        raise HTTPException(status_code=503, detail=str(e))
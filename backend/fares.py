@@ -0,0 +1,147 @@
+"""
+Кэш прайсов: плотная матрица цен каждого прайса в памяти процесса.
+
+Остановкам, которые встречаются в прайсе, присваиваются порядковые номера;
+цена пары (dep, arr) хранится в ячейке ordinals[dep] * size + ordinals[arr]
+плоского списка (None — цены нет). Цена участка и проверка «продаётся ли
+участок» (создание рейсов, результаты поиска, детали отчёта) — два поиска
+в словаре и один в списке вместо соединения с prices на каждую строку.
+Пара остановок в прайсе уникальна (migrations/0010_prices_unique_pair.sql).
+
+Прайс загружается одним запросом при первом обращении; обработчики prices
+(в том числе массовые, /prices/bulk) сбрасывают его после коммита
+(invalidate_pricelist). Для нескольких воркеров действует FARES_MAX_AGE —
+время, через которое прайс перечитывается.
+"""
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from database_async import fetchall
+
+FARES_MAX_AGE = float(os.getenv("FARES_MAX_AGE", "60"))
+FARES_MAX_PRICELISTS = int(os.getenv("FARES_MAX_PRICELISTS", "1000"))
+
+PRICELIST_FARES_QUERY = """
+    SELECT departure_stop_id, arrival_stop_id, price
+    FROM prices
+    WHERE pricelist_id = %s
+    ORDER BY id
+"""
+
+
+class FareMatrix:
+    """Цены одного прайса."""
+
+    __slots__ = ("pricelist_id", "ordinals", "size", "fares", "loaded_at")
+
+    def __init__(self, pricelist_id, rows):
+        self.pricelist_id = pricelist_id
+        # stop_id -> порядковый номер остановки в прайсе (с 0)
+        self.ordinals = {}
+        for dep, arr, _ in rows:
+            self.ordinals.setdefault(dep, len(self.ordinals))
+            self.ordinals.setdefault(arr, len(self.ordinals))
+        self.size = len(self.ordinals)
+        self.fares = [None] * (self.size * self.size)
+        for dep, arr, price in rows:
+            cell = self.ordinals[dep] * self.size + self.ordinals[arr]
+            if self.fares[cell] is None:
+                self.fares[cell] = price
+        self.loaded_at = time.monotonic()
+
+    def price(self, departure_stop_id, arrival_stop_id):
+        """Цена участка или None, если её нет в прайсе."""
+        i = self.ordinals.get(departure_stop_id)
+        j = self.ordinals.get(arrival_stop_id)
+        if i is None or j is None:
+            return None
+        return self.fares[i * self.size + j]
+
+    def has(self, departure_stop_id, arrival_stop_id):
+        return self.price(departure_stop_id, arrival_stop_id) is not None
+
+    def priced(self, pairs):
+        """Пары из pairs, на которые в прайсе есть цена, в том же порядке."""
+        return [pair for pair in pairs if self.has(*pair)]
+
+
+class FareCache:
+    def __init__(self, max_age=FARES_MAX_AGE, max_pricelists=FARES_MAX_PRICELISTS):
+        self.max_age = max_age
+        self.max_pricelists = max_pricelists
+        self._pricelists = OrderedDict()
+        self._generation = 0
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.loads = 0
+        self.invalidations = 0
+        self.evictions = 0
+
+    def peek(self, pricelist_id):
+        with self._lock:
+            matrix = self._pricelists.get(pricelist_id)
+            if matrix is not None and (self.max_age <= 0 or time.monotonic() - matrix.loaded_at < self.max_age):
+                self._pricelists.move_to_end(pricelist_id)
+                self.hits += 1
+                return matrix
+            self.misses += 1
+            return None
+
+    def put(self, pricelist_id, rows, generation=None):
+        """Кладёт прайс в кэш (если с generation не было инвалидаций) и возвращает его."""
+        matrix = FareMatrix(pricelist_id, rows)
+        with self._lock:
+            if generation is None or generation == self._generation:
+                self.loads += 1
+                self._pricelists[pricelist_id] = matrix
+                self._pricelists.move_to_end(pricelist_id)
+                while len(self._pricelists) > self.max_pricelists:
+                    self._pricelists.popitem(last=False)
+                    self.evictions += 1
+        return matrix
+
+    @property
+    def generation(self):
+        return self._generation
+
+    def get(self, cur, pricelist_id):
+        """Матрица цен прайса; при промахе читается через курсор cur."""
+        matrix = self.peek(pricelist_id)
+        if matrix is not None:
+            return matrix
+        generation = self._generation
+        cur.execute(PRICELIST_FARES_QUERY, (pricelist_id,))
+        return self.put(pricelist_id, cur.fetchall(), generation)
+
+    async def aget(self, conn, pricelist_id):
+        """То же, что get, через асинхронное соединение conn."""
+        matrix = self.peek(pricelist_id)
+        if matrix is not None:
+            return matrix
+        generation = self._generation
+        rows = await fetchall(conn, PRICELIST_FARES_QUERY, (pricelist_id,))
+        return self.put(pricelist_id, rows, generation)
+
+    def invalidate_pricelist(self, pricelist_id):
+        with self._lock:
+            self._generation += 1
+            if self._pricelists.pop(pricelist_id, None) is not None:
+                self.invalidations += 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                "pricelists": len(self._pricelists),
+                "hits": self.hits,
+                "misses": self.misses,
+                "loads": self.loads,
+                "invalidations": self.invalidations,
+                "evictions": self.evictions,
+            }
+
+
+fares = FareCache()
@@ -0,0 +1,336 @@
+"""
+Кэш занятости мест рейсов в памяти процесса.
+
+Для каждого активного рейса хранится матрица «места × сегменты» в виде
+битовых множеств (int): для каждого сегмента — множество свободных на нём
+мест, плюс множество заблокированных мест. Схема мест, число свободных
+мест и проверка «есть ли место на участке dep -> arr» считаются парой
+побитовых операций без обращения к Postgres.
+
+Рейс загружается при первом обращении и затем поддерживается
+инкрементально: обработчики записи после коммита передают сюда итоговое
+состояние изменённых мест (маска + blocked + маска удержаний held). Изменения, пришедшие пока
+рейс загружается, буферизуются и применяются поверх загруженного снимка.
+
+Об изменениях уведомляются подписчики (add_listener) — например, рассылка
+схемы мест по WebSocket (seat_events.py).
+
+В рамках одного процесса кэш точен. Если запущено несколько воркеров,
+каждый видит чужие продажи с задержкой не более INVENTORY_MAX_AGE секунд;
+защиту от двойной продажи в любом случае обеспечивает условный UPDATE в БД.
+"""
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import date
+
+from database_async import fetchall, fetchone, get_async_pool
+from segments import RangeAnd, segment_mask
+from topology import ROUTE_STOPS_QUERY, topology
+
+INVENTORY_MAX_TOURS = int(os.getenv("INVENTORY_MAX_TOURS", "2000"))
+INVENTORY_MAX_AGE = float(os.getenv("INVENTORY_MAX_AGE", "10"))
+
+# Общие для синхронной и асинхронной загрузки запросы
+LOAD_TOUR_QUERY = """
+    SELECT t.date, t.route_id
+    FROM tour t
+    WHERE t.id = %s
+"""
+
+LOAD_SEATS_QUERY = """
+    SELECT seat_num, available, blocked, held
+    FROM seat
+    WHERE tour_id = %s
+    ORDER BY seat_num
+"""
+
+
+def seat_status(available, blocked, held, mask):
+    """Состояние места на участке с маской сегментов mask (см. GET /seat/)."""
+    if blocked:
+        return "blocked"
+    if available & mask == mask:
+        return "available"
+    if (available | held) & mask == mask:
+        # Участок занят только удержаниями — место может освободиться
+        return "held"
+    return "occupied"
+
+
+class TourInventory:
+    """Занятость мест одного рейса."""
+
+    __slots__ = ("tour_id", "date", "route_id", "route", "num_segments",
+                 "seat_nums", "seat_index", "seat_masks", "seat_held", "blocked",
+                 "free", "free_ranges", "loaded_at")
+
+    def __init__(self, tour_id, tour_date, route, seats):
+        self.tour_id = tour_id
+        self.date = tour_date
+        self.route_id = route.route_id
+        # Топология маршрута (topology.RouteTopology): позиции остановок и диапазоны сегментов
+        self.route = route
+        self.num_segments = route.num_segments
+        self.seat_nums = [row[0] for row in seats]
+        self.seat_index = {seat_num: i for i, seat_num in enumerate(self.seat_nums)}
+        self.seat_masks = [0] * len(self.seat_nums)
+        # Сегменты, удержанные на время оформления (routers/hold.py)
+        self.seat_held = [0] * len(self.seat_nums)
+        self.blocked = 0
+        # free[k] — множество мест (бит i = место seat_nums[i]), свободных на сегменте k + 1
+        self.free = [0] * self.num_segments
+        # RangeAnd над free, строится при первом запросе после изменения мест
+        self.free_ranges = None
+        self.loaded_at = time.monotonic()
+        for seat_num, available, blocked, held in seats:
+            self.set_seat(seat_num, available, blocked, held)
+
+    def segment_range(self, departure_stop_id, arrival_stop_id):
+        """(первый, последний) сегменты поездки или None, если участок не на маршруте."""
+        return self.route.segment_range(departure_stop_id, arrival_stop_id)
+
+    def set_seat(self, seat_num, available, blocked, held=0):
+        i = self.seat_index.get(seat_num)
+        if i is None:
+            return
+        bit = 1 << i
+        self.seat_masks[i] = available
+        self.seat_held[i] = held
+        if blocked:
+            self.blocked |= bit
+        else:
+            self.blocked &= ~bit
+        for k in range(self.num_segments):
+            if available >> k & 1:
+                self.free[k] |= bit
+            else:
+                self.free[k] &= ~bit
+        self.free_ranges = None
+
+    def free_set(self, first, last):
+        """Множество мест, свободных на всех сегментах first..last и не заблокированных."""
+        ranges = self.free_ranges
+        if ranges is None:
+            ranges = self.free_ranges = RangeAnd(self.free)
+        return ranges.query(first, last) & ~self.blocked
+
+    def free_count(self, first, last):
+        return self.free_set(first, last).bit_count()
+
+    def has_free_seat(self, first, last):
+        return self.free_set(first, last) != 0
+
+    def seat_map(self, first, last):
+        mask = segment_mask(first, last)
+        return [
+            {"seat_num": seat_num, "status": seat_status(available, blocked, held, mask)}
+            for seat_num, available, blocked, held in self.seat_states()
+        ]
+
+    def seat_states(self):
+        """[(seat_num, available, blocked, held), ...] — в том же виде, что и update_seats."""
+        return [
+            (seat_num, self.seat_masks[i], bool(self.blocked >> i & 1), self.seat_held[i])
+            for i, seat_num in enumerate(self.seat_nums)
+        ]
+
+
+class InventoryEngine:
+    """
+    LRU-кэш TourInventory. При переполнении сначала вытесняются прошедшие
+    рейсы, затем давно не использовавшиеся. Прошедшие рейсы также
+    периодически убирает evict_past (вызывается из routers/hold.run_sweeper).
+    """
+
+    def __init__(self, max_tours=INVENTORY_MAX_TOURS, max_age=INVENTORY_MAX_AGE):
+        self.max_tours = max_tours
+        self.max_age = max_age
+        self._tours = OrderedDict()
+        self._loading = {}  # tour_id -> изменения, пришедшие во время загрузки (None — инвалидация)
+        self._lock = threading.Lock()
+        self._listeners = []
+
+        self.hits = 0
+        self.misses = 0
+        self.loads = 0
+        self.evictions = 0
+        self.updates = 0
+
+    # --- чтение ---
+
+    def peek(self, tour_id):
+        """Загруженный и не устаревший рейс или None."""
+        with self._lock:
+            inv = self._tours.get(tour_id)
+            if inv is not None and (self.max_age <= 0 or time.monotonic() - inv.loaded_at < self.max_age):
+                self._tours.move_to_end(tour_id)
+                self.hits += 1
+                return inv
+            self.misses += 1
+            return None
+
+    def get(self, conn, tour_id):
+        """Рейс из кэша; при промахе загружается через синхронное соединение."""
+        inv = self.peek(tour_id)
+        if inv is not None:
+            return inv
+        started = self._begin_load(tour_id)
+        cur = conn.cursor()
+        try:
+            cur.execute(LOAD_TOUR_QUERY, (tour_id,))
+            tour = cur.fetchone()
+            route = seats = None
+            if tour is not None:
+                route = topology.route(cur, tour[1])
+                cur.execute(LOAD_SEATS_QUERY, (tour_id,))
+                seats = cur.fetchall()
+        except BaseException:
+            self._abort_load(tour_id)
+            raise
+        finally:
+            cur.close()
+        return self._finish_load(tour_id, started, tour, route, seats)
+
+    async def aget(self, tour_id):
+        """
+        То же, что get, для async-обработчиков. Соединение из асинхронного
+        пула берётся только при промахе, попадание в кэш не трогает БД.
+        """
+        inv = self.peek(tour_id)
+        if inv is not None:
+            return inv
+        started = self._begin_load(tour_id)
+        try:
+            async with get_async_pool().connection() as conn:
+                tour = await fetchone(conn, LOAD_TOUR_QUERY, (tour_id,))
+                route = seats = None
+                if tour is not None:
+                    route = topology.peek_route(tour[1])
+                    if route is None:
+                        generation = topology.generation
+                        rows = await fetchall(conn, ROUTE_STOPS_QUERY, (tour[1],))
+                        route = topology.put_route(tour[1], [row[0] for row in rows], generation)
+                    seats = await fetchall(conn, LOAD_SEATS_QUERY, (tour_id,))
+        except BaseException:
+            self._abort_load(tour_id)
+            raise
+        return self._finish_load(tour_id, started, tour, route, seats)
+
+    def _begin_load(self, tour_id):
+        with self._lock:
+            self._loading.setdefault(tour_id, [])
+            return time.monotonic()
+
+    def _abort_load(self, tour_id):
+        with self._lock:
+            self._loading.pop(tour_id, None)
+
+    def _finish_load(self, tour_id, started, tour, route, seats):
+        with self._lock:
+            pending = self._loading.pop(tour_id, [])
+            if tour is None:
+                return None
+            topology.set_tour_route(tour_id, tour[1])
+            existing = self._tours.get(tour_id)
+            if existing is not None and existing.loaded_at >= started:
+                # Параллельная загрузка уже положила более свежий снимок
+                return existing
+            inv = TourInventory(tour_id, tour[0], route, seats)
+            if pending is None:
+                # Рейс изменён структурно во время загрузки — снимок не кэшируем
+                return inv
+            for seat_num, available, blocked, held in pending:
+                inv.set_seat(seat_num, available, blocked, held)
+            self.loads += 1
+            self._tours[tour_id] = inv
+            self._tours.move_to_end(tour_id)
+            self._evict()
+            return inv
+
+    def _evict(self):
+        if len(self._tours) <= self.max_tours:
+            return
+        today = date.today()
+        for tour_id in [t for t, inv in self._tours.items() if inv.date < today]:
+            del self._tours[tour_id]
+            self.evictions += 1
+        while len(self._tours) > self.max_tours:
+            self._tours.popitem(last=False)
+            self.evictions += 1
+
+    # --- запись (вызывается после коммита) ---
+
+    def add_listener(self, listener):
+        """
+        Подписывает listener на изменения: listener.seats_changed(tour_id, seats)
+        и listener.reset(tour_id=None, route_id=None) вызываются под блокировкой
+        кэша, в порядке коммитов, из потока обработчика — они должны быть быстрыми.
+        """
+        with self._lock:
+            self._listeners.append(listener)
+
+    def update_seats(self, tour_id, seats):
+        """Применяет итоговое состояние мест: [(seat_num, available, blocked, held), ...]."""
+        with self._lock:
+            self.updates += 1
+            pending = self._loading.get(tour_id)
+            if pending is not None:
+                pending.extend(seats)
+            inv = self._tours.get(tour_id)
+            if inv is not None:
+                for seat_num, available, blocked, held in seats:
+                    inv.set_seat(seat_num, available, blocked, held)
+            for listener in self._listeners:
+                listener.seats_changed(tour_id, seats)
+
+    def invalidate(self, tour_id):
+        """Сбрасывает рейс (изменились маршрут, разположение или рейс удалён)."""
+        with self._lock:
+            self._tours.pop(tour_id, None)
+            if tour_id in self._loading:
+                self._loading[tour_id] = None
+            for listener in self._listeners:
+                listener.reset(tour_id=tour_id)
+
+    def invalidate_route(self, route_id):
+        """Сбрасывает все рейсы маршрута (изменились остановки маршрута)."""
+        with self._lock:
+            for tour_id in [t for t, inv in self._tours.items() if inv.route_id == route_id]:
+                del self._tours[tour_id]
+            for tour_id in self._loading:
+                self._loading[tour_id] = None
+            for listener in self._listeners:
+                listener.reset(route_id=route_id)
+
+    def clear(self):
+        with self._lock:
+            self._tours.clear()
+            for tour_id in self._loading:
+                self._loading[tour_id] = None
+            for listener in self._listeners:
+                listener.reset()
+
+    def evict_past(self):
+        """Удаляет из кэша прошедшие рейсы."""
+        today = date.today()
+        with self._lock:
+            for tour_id in [t for t, inv in self._tours.items() if inv.date < today]:
+                del self._tours[tour_id]
+                self.evictions += 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                "tours": len(self._tours),
+                "max_tours": self.max_tours,
+                "hits": self.hits,
+                "misses": self.misses,
+                "loads": self.loads,
+                "evictions": self.evictions,
+                "updates": self.updates,
+            }
+
+
+inventory = InventoryEngine()
@@ -0,0 +1,530 @@
+"""
+Планировщик поездок с пересадками (GET /journeys/).
+
+Для каждой даты в памяти строится индекс рейсов дня: расписание маршрутов
+из routestop (время прибытия и отправления в минутах от полуночи дня
+рейса; переход через полночь учитывается), рейсы каждого маршрута, пары
+остановок, на которые продаются билеты (представление available), и занятость
+мест рейса — тот же TourInventory, что и в кэше занятости (inventory.py).
+
+Поиск — RAPTOR по раундам: раунд k находит самое раннее прибытие на
+каждую остановку не более чем с k поездками. В раунде просматриваются
+только маршруты через остановки, улучшенные в предыдущем раунде.
+Пересадка возможна на той же остановке не раньше чем через
+min_transfer_minutes после прибытия. Участок поездки засчитывается, только
+если на нём продаются билеты и в каком-то рейсе маршрута есть место,
+свободное на всём участке; у всех рейсов маршрута за день одно расписание,
+поэтому для участка выбирается первый рейс со свободным местом. Поиск
+повторяется для каждого времени отправления из начальной остановки (от
+позднего к раннему) с сохранением меток раундов между запусками (rRAPTOR):
+более ранний запуск просматривает только то, что улучшает найденное. В ответ
+попадают поездки, которые нельзя улучшить одновременно по времени
+отправления, прибытия и числу пересадок.
+
+Индекс обновляется по частям:
+  - места — после коммита продажи/удержания/блокировки через
+    inventory.add_listener (как рассылка seat_events.py);
+  - рейсы — обработчики tours вызывают invalidate_tours, и при следующем
+    запросе перечитываются только эти рейсы;
+  - маршруты — изменение остановок маршрута (inventory.invalidate_route)
+    перечитывает его расписание и рейсы;
+  - цены — пары рейсов берутся из прайсов, поэтому обработчики prices
+    сбрасывают индекс целиком (reset).
+При нескольких воркерах чужие изменения рейсов и маршрутов видны через
+JOURNEY_MAX_AGE секунд, когда дата перестраивается целиком; занятость
+мест найденных участков в любом случае сверяется с available в БД.
+"""
+import os
+import threading
+import time
+from collections import OrderedDict, defaultdict
+from datetime import datetime, timedelta
+
+from inventory import TourInventory, inventory
+from topology import RouteTopology
+
+JOURNEY_MAX_DATES = int(os.getenv("JOURNEY_MAX_DATES", "31"))
+JOURNEY_MAX_AGE = float(os.getenv("JOURNEY_MAX_AGE", "60"))
+MIN_TRANSFER_MINUTES = int(os.getenv("JOURNEY_MIN_TRANSFER_MINUTES", "10"))
+MAX_TRANSFERS = 3
+
+MINUTES_PER_DAY = 24 * 60
+NEVER = float("inf")
+
+DAY_TOURS_QUERY = "SELECT id, route_id FROM tour WHERE date = %s ORDER BY id"
+
+TOURS_QUERY = "SELECT id, route_id, date FROM tour WHERE id = ANY(%s)"
+
+ROUTE_TIMES_QUERY = """
+    SELECT route_id, stop_id, arrival_time, departure_time
+    FROM routestop
+    WHERE route_id = ANY(%s)
+    ORDER BY route_id, "order"
+"""
+
+TOUR_PAIRS_QUERY = """
+    SELECT tour_id, departure_stop_id, arrival_stop_id
+    FROM available
+    WHERE tour_id = ANY(%s)
+"""
+
+TOUR_SEATS_QUERY = """
+    SELECT tour_id, seat_num, available, blocked, held
+    FROM seat
+    WHERE tour_id = ANY(%s)
+    ORDER BY tour_id, seat_num
+"""
+
+# Проверка найденных участков по свободным местам в available
+LEG_SEATS_QUERY = """
+    SELECT a.tour_id, a.departure_stop_id, a.arrival_stop_id, a.seats
+    FROM unnest(%s::int[], %s::int[], %s::int[]) AS l(tour_id, dep, arr)
+    JOIN available a
+      ON a.tour_id = l.tour_id AND a.departure_stop_id = l.dep AND a.arrival_stop_id = l.arr
+"""
+
+
+def _minutes(value):
+    return None if value is None else value.hour * 60 + value.minute
+
+
+class Timetable:
+    """Остановки маршрута и время прибытия/отправления в минутах от полуночи дня рейса."""
+
+    __slots__ = ("route_id", "stops", "topology", "arrivals", "departures")
+
+    def __init__(self, route_id, rows):
+        # rows: [(stop_id, arrival_time, departure_time), ...] в порядке маршрута
+        self.route_id = route_id
+        self.stops = [row[0] for row in rows]
+        self.topology = RouteTopology(route_id, self.stops)
+        self.arrivals = []
+        self.departures = []
+        day = 0
+        last = None
+        for _, arrival_time, departure_time in rows:
+            arrival = _minutes(arrival_time if arrival_time is not None else departure_time)
+            departure = _minutes(departure_time if departure_time is not None else arrival_time)
+            if arrival is None:
+                # Остановка без времени — на ней нельзя сесть или выйти
+                self.arrivals.append(None)
+                self.departures.append(None)
+                continue
+            arrival += day
+            if last is not None and arrival < last:
+                day += MINUTES_PER_DAY
+                arrival += MINUTES_PER_DAY
+            departure += day
+            if departure < arrival:
+                day += MINUTES_PER_DAY
+                departure += MINUTES_PER_DAY
+            last = departure
+            self.arrivals.append(arrival)
+            self.departures.append(departure)
+
+
+class DayTour:
+    __slots__ = ("route_id", "inventory", "pairs")
+
+    def __init__(self, route_id, tour_inventory, pairs):
+        self.route_id = route_id
+        self.inventory = tour_inventory
+        self.pairs = pairs
+
+
+class DayIndex:
+    """
+    Рейсы одной даты. После построения структура не меняется (изменения
+    создают новый DayIndex), меняется только занятость мест рейсов.
+    """
+
+    def __init__(self, day):
+        self.date = day
+        self.timetables = {}   # route_id -> Timetable
+        self.tours = {}        # tour_id -> DayTour
+        self.route_tours = {}  # route_id -> [tour_id, ...]
+        self.stop_routes = {}  # stop_id -> [(route_id, позиция остановки), ...]
+        self.loading = []      # рейсы, загружаемые в индекс (JourneyIndex._add_tours)
+        self.loaded_at = time.monotonic()
+
+    def copy(self):
+        new = DayIndex(self.date)
+        new.timetables = dict(self.timetables)
+        new.tours = dict(self.tours)
+        new.loaded_at = self.loaded_at
+        return new
+
+    def finish(self):
+        route_tours = defaultdict(list)
+        for tour_id in sorted(self.tours):
+            route_tours[self.tours[tour_id].route_id].append(tour_id)
+        self.route_tours = dict(route_tours)
+        stop_routes = defaultdict(list)
+        for route_id in self.route_tours:
+            timetable = self.timetables[route_id]
+            for i, stop_id in enumerate(timetable.stops):
+                if timetable.arrivals[i] is not None:
+                    stop_routes[stop_id].append((route_id, i))
+        self.stop_routes = dict(stop_routes)
+
+    # --- поиск ---
+
+    def leg_tour(self, timetable, board, alight, banned):
+        """Первый рейс маршрута со свободным местом между позициями board и alight или None."""
+        pair = (timetable.stops[board], timetable.stops[alight])
+        for tour_id in self.route_tours[timetable.route_id]:
+            tour = self.tours[tour_id]
+            if pair in tour.pairs and (tour_id, *pair) not in banned \
+                    and tour.inventory.has_free_seat(board + 1, alight):
+                return tour_id
+        return None
+
+    def _raptor(self, origin, target, start, min_transfer, banned, labels, parents):
+        """
+        Один запуск RAPTOR из origin со временем start. labels[k] и parents[k] —
+        самое раннее прибытие на остановки не более чем с k поездками и
+        цепочки этих поездок; они сохраняются между запусками (от позднего
+        start к раннему), поэтому запуск находит только то, что улучшает
+        более поздние отправления при том же числе поездок.
+        Возвращает {число поездок: (прибытие, [(tour_id, timetable, посадка, высадка), ...])}.
+        """
+        labels[0][origin] = start
+        marked = {origin}
+        found = {}
+        for legs in range(1, len(labels)):
+            previous, current = labels[legs - 1], labels[legs]
+            previous_parents, current_parents = parents[legs - 1], parents[legs]
+            queue = {}
+            for stop in marked:
+                if previous[stop] < current.get(stop, previous[stop] + 1):
+                    current[stop] = previous[stop]
+                    current_parents[stop] = previous_parents.get(stop)
+                for route_id, position in self.stop_routes.get(stop, ()):
+                    if position < queue.get(route_id, position + 1):
+                        queue[route_id] = position
+            marked = set()
+            for route_id, first in queue.items():
+                timetable = self.timetables[route_id]
+                boards = []
+                for i in range(first, len(timetable.stops)):
+                    stop = timetable.stops[i]
+                    arrival = timetable.arrivals[i]
+                    if boards and arrival is not None and arrival < _bound(previous, current, stop) \
+                            and arrival < _bound(previous, current, target):
+                        for board in boards:
+                            tour_id = self.leg_tour(timetable, board, i, banned)
+                            if tour_id is not None:
+                                current[stop] = arrival
+                                # Цепочка поездок до остановки посадки — из предыдущего раунда
+                                chain = previous_parents.get(timetable.stops[board])
+                                current_parents[stop] = (tour_id, timetable, board, i, chain)
+                                marked.add(stop)
+                                break
+                    ready = previous.get(stop)
+                    departure = timetable.departures[i]
+                    if ready is not None and departure is not None:
+                        if stop != origin:
+                            ready += min_transfer
+                        if ready <= departure:
+                            boards.append(i)
+            if target in marked:
+                found[legs] = (current[target], _unwind(current_parents[target]))
+            if not marked:
+                break
+        return found
+
+    def plan(self, origin, target, earliest=0, max_transfers=2, min_transfer=MIN_TRANSFER_MINUTES,
+             banned=frozenset()):
+        """
+        Поездки из origin в target, не улучшаемые одновременно по отправлению,
+        прибытию и числу пересадок: [(отправление, прибытие, [(tour_id, route_id,
+        dep, arr, время отправления, время прибытия), ...]), ...].
+        """
+        if origin == target:
+            return []
+        starts = sorted({
+            self.timetables[route_id].departures[position]
+            for route_id, position in self.stop_routes.get(origin, ())
+            if self.timetables[route_id].departures[position] is not None
+            and self.timetables[route_id].departures[position] >= earliest
+        }, reverse=True)
+        labels = [{} for _ in range(max_transfers + 2)]
+        parents = [{} for _ in range(max_transfers + 2)]
+        journeys = []
+        for start in starts:
+            found = self._raptor(origin, target, start, min_transfer, banned, labels, parents)
+            for legs_count, (arrival, path) in sorted(found.items()):
+                legs = [
+                    (tour_id, timetable.route_id, timetable.stops[board], timetable.stops[alight],
+                     timetable.departures[board], timetable.arrivals[alight])
+                    for tour_id, timetable, board, alight in path
+                ]
+                departure = legs[0][4]
+                # Уже найденные поездки отправляются не раньше этой
+                if any(a <= arrival and len(l) <= legs_count and d >= departure for d, a, l in journeys):
+                    continue
+                journeys.append((departure, arrival, legs))
+        journeys.sort(key=lambda j: (j[0], j[1], len(j[2])))
+        return journeys
+
+    def to_datetime(self, minutes):
+        return datetime.combine(self.date, datetime.min.time()) + timedelta(minutes=minutes)
+
+
+def _bound(previous, current, stop):
+    """Прибытие на stop, которое должен улучшить раунд (не хуже предыдущего раунда)."""
+    return min(previous.get(stop, NEVER), current.get(stop, NEVER))
+
+
+def _unwind(parent):
+    path = []
+    while parent is not None:
+        tour_id, timetable, board, alight, parent = parent
+        path.append((tour_id, timetable, board, alight))
+    path.reverse()
+    return path
+
+
+class JourneyIndex:
+    """
+    LRU-кэш DayIndex по датам с инкрементальным обновлением.
+
+    Даты загружаются и обновляются без общей блокировки: новый индекс
+    строится вне её и подменяет старый под _lock, только если за время
+    построения его не перестроили параллельно (иначе изменения снова
+    помечаются к обновлению) и, для загрузки даты целиком, не было
+    инвалидаций рейсов (generation). Запросы одной ещё не загруженной
+    даты ждут одну загрузку, запросы загруженных дат не ждут никого.
+    """
+
+    def __init__(self, max_dates=JOURNEY_MAX_DATES, max_age=JOURNEY_MAX_AGE):
+        self.max_dates = max_dates
+        self.max_age = max_age
+        self._days = OrderedDict()
+        self._tour_dates = {}      # tour_id -> дата в кэше
+        self._dirty_tours = set()
+        self._dirty_routes = set()
+        # tour_id -> [число загрузок рейса, изменения мест с начала первой из них]
+        self._loading = {}
+        self._day_locks = {}       # дата -> блокировка загрузки даты
+        self._generation = 0
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.loads = 0
+        self.updates = 0
+        self.evictions = 0
+
+    def _cached(self, day):
+        with self._lock:
+            idx = self._days.get(day)
+            if idx is not None and (self.max_age <= 0 or time.monotonic() - idx.loaded_at < self.max_age):
+                self._days.move_to_end(day)
+                return idx
+            return None
+
+    def get(self, cur, day):
+        """Индекс даты; изменившиеся рейсы и маршруты перечитываются через курсор cur."""
+        self._refresh(cur)
+        idx = self._cached(day)
+        with self._lock:
+            if idx is not None:
+                self.hits += 1
+                return idx
+            self.misses += 1
+            day_lock = self._day_locks.setdefault(day, threading.Lock())
+        with day_lock:
+            try:
+                # Дату мог загрузить параллельный запрос, пока этот ждал
+                idx = self._cached(day)
+                if idx is not None:
+                    return idx
+                generation = self._generation
+                cur.execute(DAY_TOURS_QUERY, (day,))
+                idx = DayIndex(day)
+                self._add_tours(cur, idx, cur.fetchall())
+                self._install(idx, generation=generation)
+                return idx
+            finally:
+                with self._lock:
+                    if self._day_locks.get(day) is day_lock:
+                        del self._day_locks[day]
+
+    def _add_tours(self, cur, idx, tours, reload_routes=()):
+        """Добавляет в idx рейсы [(tour_id, route_id), ...] с расписаниями их маршрутов."""
+        routes = {route_id for _, route_id in tours if route_id not in idx.timetables} | set(reload_routes)
+        if routes:
+            cur.execute(ROUTE_TIMES_QUERY, (list(routes),))
+            rows = defaultdict(list)
+            for route_id, stop_id, arrival_time, departure_time in cur.fetchall():
+                rows[route_id].append((stop_id, arrival_time, departure_time))
+            for route_id in routes:
+                if len(rows.get(route_id, ())) >= 2:
+                    idx.timetables[route_id] = Timetable(route_id, rows[route_id])
+                else:
+                    idx.timetables.pop(route_id, None)
+        tour_ids = [tour_id for tour_id, _ in tours]
+        if not tour_ids:
+            return
+        with self._lock:
+            for tour_id in tour_ids:
+                self._loading.setdefault(tour_id, [0, []])[0] += 1
+        idx.loading = tour_ids
+        try:
+            cur.execute(TOUR_PAIRS_QUERY, (tour_ids,))
+            pairs = defaultdict(set)
+            for tour_id, dep, arr in cur.fetchall():
+                pairs[tour_id].add((dep, arr))
+            cur.execute(TOUR_SEATS_QUERY, (tour_ids,))
+            seats = defaultdict(list)
+            for tour_id, *state in cur.fetchall():
+                seats[tour_id].append(state)
+        except BaseException:
+            with self._lock:
+                self._finish_loading(idx)
+            raise
+        for tour_id, route_id in tours:
+            timetable = idx.timetables.get(route_id)
+            if timetable is not None:
+                tour_inventory = TourInventory(tour_id, idx.date, timetable.topology, seats[tour_id])
+                idx.tours[tour_id] = DayTour(route_id, tour_inventory, pairs[tour_id])
+
+    def _finish_loading(self, idx):
+        """
+        Применяет к рейсам idx изменения мест, пришедшие во время загрузки
+        (вызывается под _lock). Изменения — итоговые состояния мест в порядке
+        коммитов с начала самой ранней из параллельных загрузок рейса, поэтому
+        их повторное применение поверх более позднего снимка безопасно.
+        """
+        for tour_id in idx.loading:
+            loading = self._loading[tour_id]
+            tour = idx.tours.get(tour_id)
+            if tour is not None:
+                for state in loading[1]:
+                    tour.inventory.set_seat(*state)
+            loading[0] -= 1
+            if not loading[0]:
+                del self._loading[tour_id]
+        idx.loading = []
+
+    def _install(self, idx, previous=None, generation=None):
+        """
+        Кладёт построенный индекс даты в кэш. False, если индекс устарел:
+        дата перестроена или вытеснена параллельно (previous) либо с начала
+        загрузки были инвалидации (generation).
+        """
+        idx.finish()
+        with self._lock:
+            self._finish_loading(idx)
+            if previous is not None and self._days.get(idx.date) is not previous:
+                return False
+            if generation is not None and generation != self._generation:
+                return False
+            for tour_id in idx.tours:
+                self._tour_dates[tour_id] = idx.date
+            if previous is not None:
+                for tour_id in previous.tours.keys() - idx.tours.keys():
+                    if self._tour_dates.get(tour_id) == idx.date:
+                        del self._tour_dates[tour_id]
+            if previous is None:
+                self.loads += 1
+            else:
+                self.updates += 1
+            self._days[idx.date] = idx
+            self._days.move_to_end(idx.date)
+            while len(self._days) > self.max_dates:
+                _, evicted = self._days.popitem(last=False)
+                for tour_id in evicted.tours:
+                    if self._tour_dates.get(tour_id) == evicted.date:
+                        del self._tour_dates[tour_id]
+                self.evictions += 1
+            return True
+
+    def _refresh(self, cur):
+        """Перечитывает изменившиеся рейсы и маршруты в загруженных датах."""
+        with self._lock:
+            tours, routes = self._dirty_tours, self._dirty_routes
+            self._dirty_tours, self._dirty_routes = set(), set()
+            days = list(self._days.values())
+        if not (tours or routes) or not days:
+            return
+        try:
+            for idx in days:
+                for route_id in routes:
+                    tours.update(idx.route_tours.get(route_id, ()))
+            current = {}
+            if tours:
+                cur.execute(TOURS_QUERY, (list(tours),))
+                current = {tour_id: (route_id, day) for tour_id, route_id, day in cur.fetchall()}
+            for idx in days:
+                touched = [t for t in tours if t in idx.tours or current.get(t, (None, None))[1] == idx.date]
+                reload_routes = routes & idx.timetables.keys()
+                if not touched and not reload_routes:
+                    continue
+                new = idx.copy()
+                for tour_id in touched:
+                    new.tours.pop(tour_id, None)
+                added = [(t, current[t][0]) for t in touched if t in current and current[t][1] == idx.date]
+                reload_routes |= routes & {route_id for _, route_id in added}
+                self._add_tours(cur, new, added, reload_routes)
+                if not self._install(new, previous=idx):
+                    # Дату перестроил параллельный запрос, возможно по более
+                    # старым данным — обновить её ещё раз при следующем запросе
+                    with self._lock:
+                        self._dirty_tours.update(touched)
+                        self._dirty_routes.update(reload_routes)
+        except BaseException:
+            with self._lock:
+                self._dirty_tours |= tours
+                self._dirty_routes |= routes
+            raise
+
+    # --- изменения (вызываются после коммита) ---
+
+    def invalidate_tours(self, tour_ids):
+        """Рейсы созданы, изменены или удалены: перечитать их при следующем запросе."""
+        with self._lock:
+            self._generation += 1
+            self._dirty_tours.update(tour_ids)
+
+    def seats_changed(self, tour_id, seats):
+        with self._lock:
+            loading = self._loading.get(tour_id)
+            if loading is not None:
+                loading[1].extend(seats)
+            day = self._tour_dates.get(tour_id)
+            if day is None:
+                return
+            idx = self._days.get(day)
+            tour = idx.tours.get(tour_id) if idx is not None else None
+            if tour is not None:
+                for state in seats:
+                    tour.inventory.set_seat(*state)
+
+    def reset(self, tour_id=None, route_id=None):
+        with self._lock:
+            self._generation += 1
+            if tour_id is not None:
+                self._dirty_tours.add(tour_id)
+            elif route_id is not None:
+                self._dirty_routes.add(route_id)
+            else:
+                self._days.clear()
+                self._tour_dates.clear()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "dates": len(self._days),
+                "tours": len(self._tour_dates),
+                "hits": self.hits,
+                "misses": self.misses,
+                "loads": self.loads,
+                "updates": self.updates,
+                "evictions": self.evictions,
+            }
+
+
+journey_index = JourneyIndex()
+inventory.add_listener(journey_index)
@@ -1,10 +1,34 @@
+import asyncio
+from contextlib import asynccontextmanager
+
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 
+from database import close_pool, get_pool
+from database_async import close_async_pool, open_async_pool
+import metrics
+
 # Импортируем все роутеры
-from routers import stop, route, pricelist, prices, tour, passenger, report, available, seat, search, ticket
+from routers import stop, route, pricelist, prices, tour, passenger, report, available, seat, search, ticket, hold, journey
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Открываем пулы соединений при старте и закрываем при остановке
+    get_pool()
+    await open_async_pool()
+    # Снятие просроченных удержаний мест (routers/hold.py)
+    sweeper = asyncio.create_task(hold.run_sweeper())
+    yield
+    sweeper.cancel()
+    try:
+        await sweeper
+    except asyncio.CancelledError:
+        pass
+    await close_async_pool()
+    close_pool()
 
-app = FastAPI()
+
+app = FastAPI(lifespan=lifespan)
 
 # Настраиваем CORS (если нужно)
 origins = ["http://localhost:3000","http://10.4.4.108:3000" ]
@@ -16,6 +40,10 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Время ответа и статистика запросов к БД по маршрутам (GET /metrics)
+if metrics.METRICS_ENABLED:
+    app.add_middleware(metrics.MetricsMiddleware)
+
 # Подключаем роутеры
 app.include_router(stop.router)
 app.include_router(route.router)
@@ -24,10 +52,13 @@ app.include_router(prices.router)
 app.include_router(tour.router)
 app.include_router(passenger.router)
 app.include_router(ticket.router)
+app.include_router(hold.router)
 app.include_router(report.router)
 app.include_router(available.router)
 app.include_router(seat.router)
 app.include_router(search.router)
+app.include_router(journey.router)
+app.include_router(metrics.router)
 
 if __name__ == "__main__":
     import uvicorn
@@ -0,0 +1,294 @@
+"""
+Метрики API в текстовом формате Prometheus (GET /metrics).
+
+По каждому шаблону маршрута (например, "/routes/{route_id}/stops") и методу
+собираются:
+  - число запросов по кодам ответа;
+  - гистограмма времени ответа;
+  - число SQL-запросов и суммарное время их выполнения;
+  - время ожидания соединения из пула.
+
+Время SQL считает курсор InstrumentedCursor (cursor_factory соединений пула)
+и database_async.execute; ожидание соединения — пулы из database.py и
+database_async.py. Данные накапливаются в объекте RequestStats текущего
+запроса, доступном через contextvars: контекст копируется и в потоки
+threadpool, в которых выполняются синхронные обработчики и зависимости.
+Вне HTTP-запроса (скрипты, фоновые задачи) ничего не записывается.
+
+На запрос приходится несколько вызовов perf_counter и одна запись в
+словарь под блокировкой, поэтому метрики можно не отключать в работе.
+Отключение: METRICS_ENABLED=0.
+
+Кроме того, при каждом опросе /metrics выгружаются счётчики пулов
+соединений, кэшей и подписок WebSocket на схему мест (их метод stats()).
+"""
+import os
+import threading
+import time
+from bisect import bisect_left
+from contextvars import ContextVar
+
+from fastapi import APIRouter
+from fastapi.responses import PlainTextResponse
+from psycopg2 import extensions
+
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "1") != "0"
+
+# Верхние границы корзин гистограммы времени ответа, сек
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Метка маршрута для запросов, не совпавших ни с одним маршрутом (404),
+# чтобы произвольные URL не порождали новые серии
+UNMATCHED_ROUTE = "unmatched"
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+class RequestStats:
+    __slots__ = ("statements", "db_time", "pool_wait")
+
+    def __init__(self):
+        self.statements = 0
+        self.db_time = 0.0
+        self.pool_wait = 0.0
+
+
+_current = ContextVar("request_stats", default=None)
+
+
+def observe_statement(elapsed):
+    """Учитывает выполненный SQL-запрос в статистике текущего HTTP-запроса."""
+    stats = _current.get()
+    if stats is not None:
+        stats.statements += 1
+        stats.db_time += elapsed
+
+
+def observe_pool_wait(elapsed):
+    """Учитывает ожидание соединения из пула в статистике текущего HTTP-запроса."""
+    stats = _current.get()
+    if stats is not None:
+        stats.pool_wait += elapsed
+
+
+class InstrumentedCursor(extensions.cursor):
+    """Курсор psycopg2, замеряющий время выполнения запросов."""
+
+    def execute(self, query, vars=None):
+        start = time.perf_counter()
+        try:
+            return super().execute(query, vars)
+        finally:
+            observe_statement(time.perf_counter() - start)
+
+    def executemany(self, query, vars_list):
+        start = time.perf_counter()
+        try:
+            return super().executemany(query, vars_list)
+        finally:
+            observe_statement(time.perf_counter() - start)
+
+
+class _RouteSeries:
+    __slots__ = ("statuses", "buckets", "latency_sum", "count", "statements", "db_time", "pool_wait")
+
+    def __init__(self):
+        self.statuses = {}
+        self.buckets = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.latency_sum = 0.0
+        self.count = 0
+        self.statements = 0
+        self.db_time = 0.0
+        self.pool_wait = 0.0
+
+
+class Registry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._series = {}  # (method, route) -> _RouteSeries
+
+    def record(self, method, route, status, elapsed, stats):
+        with self._lock:
+            series = self._series.get((method, route))
+            if series is None:
+                series = self._series[(method, route)] = _RouteSeries()
+            series.statuses[status] = series.statuses.get(status, 0) + 1
+            series.buckets[bisect_left(LATENCY_BUCKETS, elapsed)] += 1
+            series.latency_sum += elapsed
+            series.count += 1
+            series.statements += stats.statements
+            series.db_time += stats.db_time
+            series.pool_wait += stats.pool_wait
+
+    def snapshot(self):
+        with self._lock:
+            result = []
+            for key, s in sorted(self._series.items()):
+                copy = _RouteSeries()
+                copy.statuses = dict(s.statuses)
+                copy.buckets = list(s.buckets)
+                for attr in ("latency_sum", "count", "statements", "db_time", "pool_wait"):
+                    setattr(copy, attr, getattr(s, attr))
+                result.append((key, copy))
+            return result
+
+
+registry = Registry()
+
+
+class MetricsMiddleware:
+    """ASGI-middleware: время ответа, код ответа и статистика БД по шаблону маршрута."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        stats = RequestStats()
+        token = _current.set(stats)
+        status = 500
+        start = time.perf_counter()
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            elapsed = time.perf_counter() - start
+            _current.reset(token)
+            # Маршрутизатор FastAPI кладёт совпавший маршрут в scope
+            route = scope.get("route")
+            template = getattr(route, "path", None) or UNMATCHED_ROUTE
+            registry.record(scope["method"], template, status, elapsed, stats)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def _labels(**labels):
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in labels.items()) + "}"
+
+
+def render_requests(lines):
+    series = registry.snapshot()
+
+    lines.append("# HELP http_requests_total HTTP requests by route template and status code.")
+    lines.append("# TYPE http_requests_total counter")
+    for (method, route), s in series:
+        for status, count in sorted(s.statuses.items()):
+            lines.append(f"http_requests_total{_labels(method=method, route=route, status=status)} {count}")
+
+    lines.append("# HELP http_request_duration_seconds HTTP response time.")
+    lines.append("# TYPE http_request_duration_seconds histogram")
+    for (method, route), s in series:
+        cumulative = 0
+        for bound, count in zip(LATENCY_BUCKETS + ("+Inf",), s.buckets):
+            cumulative += count
+            le = bound if bound == "+Inf" else repr(float(bound))
+            lines.append(
+                f"http_request_duration_seconds_bucket{_labels(method=method, route=route, le=le)} {cumulative}"
+            )
+        labels = _labels(method=method, route=route)
+        lines.append(f"http_request_duration_seconds_sum{labels} {s.latency_sum}")
+        lines.append(f"http_request_duration_seconds_count{labels} {s.count}")
+
+    for name, attr, kind, help_text in (
+        ("http_request_db_statements_total", "statements", "counter",
+         "SQL statements executed while handling requests."),
+        ("http_request_db_seconds_total", "db_time", "counter",
+         "Time spent executing SQL statements while handling requests."),
+        ("http_request_pool_wait_seconds_total", "pool_wait", "counter",
+         "Time requests spent waiting for a pooled database connection."),
+    ):
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {kind}")
+        for (method, route), s in series:
+            lines.append(f"{name}{_labels(method=method, route=route)} {getattr(s, attr)}")
+
+
+def render_components(lines):
+    """Счётчики пулов соединений и кэшей на момент опроса."""
+    import database
+    import database_async
+    from cache import report_cache, search_cache
+    from fares import fares
+    from inventory import inventory
+    from journeys import journey_index
+    from seat_events import broker
+    from topology import topology
+
+    pools = []
+    if database._pool is not None:
+        pools.append(("sync", database._pool.stats()))
+    if database_async._async_pool is not None:
+        pools.append(("async", database_async._async_pool.stats()))
+
+    lines.append("# HELP db_pool_connections Open pool connections by state.")
+    lines.append("# TYPE db_pool_connections gauge")
+    for pool, s in pools:
+        lines.append(f"db_pool_connections{_labels(pool=pool, state='idle')} {s['idle']}")
+        lines.append(f"db_pool_connections{_labels(pool=pool, state='in_use')} {s['in_use']}")
+    lines.append("# HELP db_pool_max_connections Pool size limit.")
+    lines.append("# TYPE db_pool_max_connections gauge")
+    for pool, s in pools:
+        lines.append(f"db_pool_max_connections{_labels(pool=pool)} {s['max_size']}")
+    lines.append("# HELP db_pool_events_total Pool checkouts, waits for a free connection, timeouts, "
+                 "new and discarded connections.")
+    lines.append("# TYPE db_pool_events_total counter")
+    for pool, s in pools:
+        for event in ("checkouts", "exhausted", "timeouts", "connects", "discarded"):
+            lines.append(f"db_pool_events_total{_labels(pool=pool, event=event)} {s[event]}")
+    lines.append("# HELP db_pool_wait_seconds_total Time spent waiting for pool connections.")
+    lines.append("# TYPE db_pool_wait_seconds_total counter")
+    for pool, s in pools:
+        lines.append(f"db_pool_wait_seconds_total{_labels(pool=pool)} {s['wait_time_seconds']}")
+
+    caches = [
+        ("search", search_cache.stats(), "size"),
+        ("report", report_cache.stats(), "size"),
+        ("inventory", inventory.stats(), "tours"),
+        ("topology", topology.stats(), "routes"),
+        ("journeys", journey_index.stats(), "dates"),
+        ("fares", fares.stats(), "pricelists"),
+    ]
+    lines.append("# HELP cache_entries Entries currently held by in-process caches.")
+    lines.append("# TYPE cache_entries gauge")
+    for cache, s, size_key in caches:
+        lines.append(f"cache_entries{_labels(cache=cache)} {s[size_key]}")
+    lines.append("# HELP cache_events_total Cache hits, misses, loads, invalidations and evictions.")
+    lines.append("# TYPE cache_events_total counter")
+    for cache, s, size_key in caches:
+        for event in ("hits", "misses", "loads", "updates", "invalidations", "evictions"):
+            if event in s:
+                lines.append(f"cache_events_total{_labels(cache=cache, event=event)} {s[event]}")
+
+    s = broker.stats()
+    lines.append("# HELP seat_ws_channels Seat-map WebSocket channels (tour and segment) with subscribers.")
+    lines.append("# TYPE seat_ws_channels gauge")
+    lines.append(f"seat_ws_channels {s['channels']}")
+    lines.append("# HELP seat_ws_subscribers Open seat-map WebSocket connections.")
+    lines.append("# TYPE seat_ws_subscribers gauge")
+    lines.append(f"seat_ws_subscribers {s['subscribers']}")
+
+
+def render():
+    lines = []
+    render_requests(lines)
+    render_components(lines)
+    return "\n".join(lines) + "\n"
+
+
+router = APIRouter(tags=["metrics"])
+
+
+@router.get("/metrics", response_class=PlainTextResponse, include_in_schema=False)
+def get_metrics():
+    return PlainTextResponse(render(), media_type=CONTENT_TYPE)
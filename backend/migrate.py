@@ -0,0 +1,171 @@
+"""
+Применение миграций схемы БД из каталога migrations/.
+
+Миграция — файл NNNN_описание.sql; версия — его имя без расширения.
+Файлы применяются по порядку имён, каждый в отдельной транзакции вместе
+с записью в таблицу schema_migrations, поэтому повторный запуск применяет
+только новые миграции, а упавшая миграция не оставляет частичных изменений.
+Параллельные запуски сериализуются advisory-блокировкой.
+
+Запуск (из каталога backend):
+    python migrate.py                # применить новые миграции
+    python migrate.py status         # список миграций и их состояние
+    python migrate.py baseline 0004  # отметить миграции до 0004 включительно
+                                     # как применённые, не выполняя их
+                                     # (для баз, обновлённых вручную)
+"""
+import argparse
+import hashlib
+import os
+import sys
+
+from database import get_connection
+
+MIGRATIONS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "migrations")
+
+# Произвольный постоянный ключ advisory-блокировки миграций
+MIGRATION_LOCK_ID = 7_340_013
+
+CREATE_TABLE_QUERY = """
+    CREATE TABLE IF NOT EXISTS schema_migrations (
+        version text PRIMARY KEY,
+        checksum text NOT NULL,
+        applied_at timestamptz NOT NULL DEFAULT now()
+    );
+"""
+
+
+def available_migrations(directory=MIGRATIONS_DIR):
+    """[(version, path, checksum), ...] в порядке применения."""
+    result = []
+    for name in sorted(os.listdir(directory)):
+        if not name.endswith(".sql"):
+            continue
+        path = os.path.join(directory, name)
+        with open(path, "rb") as f:
+            checksum = hashlib.sha256(f.read()).hexdigest()
+        result.append((name[:-4], path, checksum))
+    return result
+
+
+def applied_migrations(cur):
+    """{version: checksum} для уже применённых миграций."""
+    cur.execute("SELECT version, checksum FROM schema_migrations;")
+    return dict(cur.fetchall())
+
+
+def _prepare(conn):
+    # Файлы миграций в UTF-8 (комментарии на русском)
+    conn.set_client_encoding("UTF8")
+    cur = conn.cursor()
+    cur.execute(CREATE_TABLE_QUERY)
+    conn.commit()
+    cur.execute("SELECT pg_advisory_lock(%s);", (MIGRATION_LOCK_ID,))
+    conn.commit()
+    return cur
+
+
+def _release(conn, cur):
+    conn.rollback()
+    cur.execute("SELECT pg_advisory_unlock(%s);", (MIGRATION_LOCK_ID,))
+    conn.commit()
+    cur.close()
+
+
+def migrate(conn, log=print):
+    """Применяет все ещё не применённые миграции. Возвращает список версий."""
+    cur = _prepare(conn)
+    done = []
+    try:
+        applied = applied_migrations(cur)
+        for version, path, checksum in available_migrations():
+            if version in applied:
+                continue
+            with open(path, encoding="utf-8") as f:
+                sql = f.read()
+            log(f"applying {version} ...")
+            try:
+                cur.execute(sql)
+                cur.execute(
+                    "INSERT INTO schema_migrations (version, checksum) VALUES (%s, %s);",
+                    (version, checksum)
+                )
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                log(f"migration {version} failed, rolled back")
+                raise
+            done.append(version)
+        return done
+    finally:
+        _release(conn, cur)
+
+
+def baseline(conn, target):
+    """Отмечает миграции с версией <= target как применённые без выполнения."""
+    cur = _prepare(conn)
+    try:
+        marked = []
+        for version, _, checksum in available_migrations():
+            if version.split("_", 1)[0] > target:
+                break
+            cur.execute(
+                "INSERT INTO schema_migrations (version, checksum) VALUES (%s, %s) "
+                "ON CONFLICT (version) DO NOTHING;",
+                (version, checksum)
+            )
+            marked.append(version)
+        conn.commit()
+        return marked
+    finally:
+        _release(conn, cur)
+
+
+def status(conn):
+    """[(version, state), ...]; state: applied, pending или changed (файл изменён после применения)."""
+    cur = conn.cursor()
+    try:
+        cur.execute(CREATE_TABLE_QUERY)
+        conn.commit()
+        applied = applied_migrations(cur)
+    finally:
+        cur.close()
+    result = []
+    for version, _, checksum in available_migrations():
+        if version not in applied:
+            state = "pending"
+        elif applied[version] != checksum:
+            state = "changed"
+        else:
+            state = "applied"
+        result.append((version, state))
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("command", nargs="?", default="up", choices=("up", "status", "baseline"))
+    parser.add_argument("version", nargs="?", help="для baseline: номер последней уже применённой миграции")
+    args = parser.parse_args()
+
+    conn = get_connection()
+    try:
+        if args.command == "status":
+            for version, state in status(conn):
+                print(f"{state:8} {version}")
+            return 0
+        if args.command == "baseline":
+            if not args.version:
+                parser.error("baseline requires a version, e.g. 0004")
+            for version in baseline(conn, args.version):
+                print(f"marked   {version}")
+            return 0
+        done = migrate(conn)
+        print(f"{len(done)} migration(s) applied" if done else "database is up to date")
+        return 0
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
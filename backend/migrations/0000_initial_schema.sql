@@ -0,0 +1,78 @@
+-- Исходная схема БД в том виде, в котором с ней работал код до появления
+-- миграций. Следующие миграции переводят её в текущее состояние.
+--
+-- IF NOT EXISTS позволяет применить файл к уже существующей базе:
+-- таблицы, созданные раньше вручную, не пересоздаются.
+
+CREATE TABLE IF NOT EXISTS stop (
+    id serial PRIMARY KEY,
+    stop_name varchar(255) NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS route (
+    id serial PRIMARY KEY,
+    name varchar(255) NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS routestop (
+    id serial PRIMARY KEY,
+    route_id int NOT NULL REFERENCES route(id) ON DELETE CASCADE,
+    stop_id int NOT NULL REFERENCES stop(id),
+    "order" int NOT NULL,
+    arrival_time time,
+    departure_time time
+);
+
+CREATE TABLE IF NOT EXISTS pricelist (
+    id serial PRIMARY KEY,
+    name varchar(255) NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS prices (
+    id serial PRIMARY KEY,
+    pricelist_id int NOT NULL REFERENCES pricelist(id),
+    departure_stop_id int NOT NULL REFERENCES stop(id),
+    arrival_stop_id int NOT NULL REFERENCES stop(id),
+    price numeric(10,2) NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS tour (
+    id serial PRIMARY KEY,
+    route_id int NOT NULL REFERENCES route(id),
+    pricelist_id int NOT NULL REFERENCES pricelist(id),
+    date date NOT NULL,
+    seats int NOT NULL,
+    layout_variant int NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS passenger (
+    id serial PRIMARY KEY,
+    name varchar(255) NOT NULL,
+    phone varchar(50),
+    email varchar(255)
+);
+
+-- available: строка свободных сегментов ("1234"), "0" — место заблокировано
+CREATE TABLE IF NOT EXISTS seat (
+    id serial PRIMARY KEY,
+    tour_id int NOT NULL REFERENCES tour(id),
+    seat_num int NOT NULL,
+    available varchar(50) NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS ticket (
+    id serial PRIMARY KEY,
+    tour_id int NOT NULL REFERENCES tour(id),
+    seat_id int NOT NULL REFERENCES seat(id),
+    passenger_id int REFERENCES passenger(id),
+    departure_stop_id int NOT NULL REFERENCES stop(id),
+    arrival_stop_id int NOT NULL REFERENCES stop(id)
+);
+
+CREATE TABLE IF NOT EXISTS available (
+    id serial PRIMARY KEY,
+    tour_id int NOT NULL REFERENCES tour(id),
+    departure_stop_id int NOT NULL REFERENCES stop(id),
+    arrival_stop_id int NOT NULL REFERENCES stop(id),
+    seats int NOT NULL
+);
@@ -0,0 +1,28 @@
+-- Перевод seat.available со строки сегментов ("1234", "0" — место
+-- заблокировано) на битовую маску bigint и отдельный флаг blocked.
+-- Бит (i - 1) маски установлен, если сегмент i свободен.
+
+ALTER TABLE seat ADD COLUMN blocked boolean NOT NULL DEFAULT false;
+ALTER TABLE seat ADD COLUMN available_mask bigint NOT NULL DEFAULT 0;
+
+UPDATE seat s
+SET blocked = (s.available = '0'),
+    available_mask = CASE
+        WHEN s.available = '0' THEN (
+            -- Для заблокированного места строка сегментов не сохранилась:
+            -- считаем свободными все сегменты маршрута рейса.
+            SELECT (1::bigint << GREATEST(count(*)::int - 1, 0)) - 1
+            FROM routestop rs
+            JOIN tour t ON t.route_id = rs.route_id
+            WHERE t.id = s.tour_id
+        )
+        ELSE (
+            SELECT COALESCE(bit_or(1::bigint << (d::int - 1)), 0)
+            FROM regexp_split_to_table(s.available, '') AS d
+            WHERE d BETWEEN '1' AND '9'
+        )
+    END;
+
+ALTER TABLE seat DROP COLUMN available;
+ALTER TABLE seat RENAME COLUMN available_mask TO available;
+ALTER TABLE seat ALTER COLUMN available DROP DEFAULT;
@@ -0,0 +1,7 @@
+-- Счётчик свободных мест не может уйти в минус: при гонке покупок
+-- транзакция получит check_violation и откатится (409 в API).
+
+UPDATE available SET seats = 0 WHERE seats < 0;
+
+ALTER TABLE available
+    ADD CONSTRAINT available_seats_non_negative CHECK (seats >= 0);
@@ -0,0 +1,17 @@
+-- Индексы для постраничного отчёта (POST /report/tickets) и его сводки.
+--
+-- Порядок деталей — tr.date DESC, t.id. Рейсы читаются по индексу даты
+-- в обратном порядке, билеты каждого рейса — по (tour_id, id), поэтому
+-- первая страница требует только нескольких индексных чтений при любом
+-- размере таблицы ticket. INCLUDE делает индексы покрывающими для
+-- столбцов, нужных соединениям и фильтрам отчёта.
+
+CREATE INDEX IF NOT EXISTS tour_date_id_idx
+    ON tour (date DESC, id) INCLUDE (route_id, pricelist_id);
+
+CREATE INDEX IF NOT EXISTS ticket_tour_id_id_idx
+    ON ticket (tour_id, id) INCLUDE (seat_id, passenger_id, departure_stop_id, arrival_stop_id);
+
+-- Цена билета: одна строка прайса на (pricelist, dep, arr)
+CREATE INDEX IF NOT EXISTS prices_pricelist_segment_idx
+    ON prices (pricelist_id, departure_stop_id, arrival_stop_id) INCLUDE (price);
@@ -0,0 +1,33 @@
+-- Агрегаты продаж для сводки отчёта (см. rollup.py): число билетов и
+-- выручка по (рейс, отправление, прибытие). Дата рейса и маршрут
+-- продублированы, чтобы фильтры отчёта работали без соединений.
+
+CREATE TABLE IF NOT EXISTS sales_rollup (
+    date date NOT NULL,
+    route_id int NOT NULL,
+    tour_id int NOT NULL,
+    departure_stop_id int NOT NULL,
+    arrival_stop_id int NOT NULL,
+    tickets int NOT NULL,
+    revenue numeric(14,2) NOT NULL,
+    PRIMARY KEY (tour_id, departure_stop_id, arrival_stop_id)
+);
+
+CREATE INDEX IF NOT EXISTS sales_rollup_date_idx
+    ON sales_rollup (date) INCLUDE (route_id, departure_stop_id, arrival_stop_id, tickets, revenue);
+
+CREATE INDEX IF NOT EXISTS sales_rollup_route_date_idx
+    ON sales_rollup (route_id, date) INCLUDE (departure_stop_id, arrival_stop_id, tickets, revenue);
+
+-- Заполнение по уже проданным билетам
+DELETE FROM sales_rollup;
+
+INSERT INTO sales_rollup (date, route_id, tour_id, departure_stop_id, arrival_stop_id, tickets, revenue)
+SELECT tr.date, tr.route_id, tr.id, t.departure_stop_id, t.arrival_stop_id,
+       count(*), sum(pr.price)
+FROM ticket t
+JOIN tour tr ON tr.id = t.tour_id
+JOIN prices pr ON pr.pricelist_id = tr.pricelist_id
+              AND pr.departure_stop_id = t.departure_stop_id
+              AND pr.arrival_stop_id = t.arrival_stop_id
+GROUP BY tr.id, t.departure_stop_id, t.arrival_stop_id;
@@ -0,0 +1,28 @@
+-- Индексы под горячие запросы API. Проверка планов: python check_plans.py.
+
+-- Места рейса: загрузка схемы мест, бронирование (tour_id, seat_num).
+-- Номер места в рейсе уникален — места создаются через generate_series.
+CREATE UNIQUE INDEX IF NOT EXISTS seat_tour_seat_num_idx
+    ON seat (tour_id, seat_num);
+
+-- Счётчики рейса: уменьшение при продаже, пересчёт при изменении рейса,
+-- GET /available?tour_id=...
+CREATE INDEX IF NOT EXISTS available_tour_pair_idx
+    ON available (tour_id, departure_stop_id, arrival_stop_id);
+
+-- Поиск (/search/*, /tours/search) смотрит только участки со свободными
+-- местами; частичный индекс не содержит распроданных строк.
+CREATE INDEX IF NOT EXISTS available_open_pair_idx
+    ON available (departure_stop_id, arrival_stop_id, tour_id) INCLUDE (seats)
+    WHERE seats > 0;
+
+-- Остановки маршрута по порядку (топология маршрута, создание рейса)
+CREATE INDEX IF NOT EXISTS routestop_route_order_idx
+    ON routestop (route_id, "order") INCLUDE (stop_id);
+
+-- Внешние ключи без индекса: удаление пассажира или места проверяет ticket
+CREATE INDEX IF NOT EXISTS ticket_passenger_idx
+    ON ticket (passenger_id);
+
+CREATE INDEX IF NOT EXISTS ticket_seat_idx
+    ON ticket (seat_id);
@@ -0,0 +1,30 @@
+-- Временное удержание мест на время оформления покупки (routers/hold.py).
+--
+-- Удержание снимает биты сегментов в seat.available так же, как продажа,
+-- поэтому чужая покупка или удержание тех же сегментов не пройдёт условный
+-- UPDATE места. seat.held — объединение масок действующих удержаний места:
+-- по нему схема мест отличает «удержано» от «продано».
+
+ALTER TABLE seat ADD COLUMN IF NOT EXISTS held bigint NOT NULL DEFAULT 0;
+
+CREATE TABLE IF NOT EXISTS seat_hold (
+    id serial PRIMARY KEY,
+    token text NOT NULL,
+    tour_id int NOT NULL REFERENCES tour(id) ON DELETE CASCADE,
+    seat_id int NOT NULL REFERENCES seat(id) ON DELETE CASCADE,
+    seat_num int NOT NULL,
+    departure_stop_id int NOT NULL,
+    arrival_stop_id int NOT NULL,
+    mask bigint NOT NULL,
+    created_at timestamptz NOT NULL DEFAULT now(),
+    expires_at timestamptz NOT NULL
+);
+
+-- Покупка и отмена по токену оформления
+CREATE INDEX IF NOT EXISTS seat_hold_token_idx ON seat_hold (token);
+
+-- Очистка просроченных удержаний
+CREATE INDEX IF NOT EXISTS seat_hold_expires_idx ON seat_hold (expires_at);
+
+-- Каскадное удаление при удалении мест рейса
+CREATE INDEX IF NOT EXISTS seat_hold_seat_idx ON seat_hold (seat_id);
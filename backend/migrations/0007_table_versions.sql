@@ -0,0 +1,43 @@
+-- Версии справочных таблиц для ETag списочных эндпоинтов (versions.py).
+--
+-- Версия увеличивается триггером уровня оператора на любую запись в
+-- таблицу — из обработчиков API, каскадных удалений, seed_data.py — в той
+-- же транзакции, что и само изменение, поэтому новая версия видна только
+-- вместе с новыми данными. Начальное значение — время создания в мс, чтобы
+-- после пересоздания базы версии не совпали со старыми ETag клиентов.
+
+CREATE TABLE IF NOT EXISTS table_version (
+    table_name text PRIMARY KEY,
+    version bigint NOT NULL DEFAULT (extract(epoch FROM clock_timestamp()) * 1000)::bigint
+);
+
+INSERT INTO table_version (table_name)
+VALUES ('stop'), ('route'), ('routestop'), ('prices'), ('tour')
+ON CONFLICT (table_name) DO NOTHING;
+
+CREATE OR REPLACE FUNCTION bump_table_version() RETURNS trigger AS $$
+BEGIN
+    UPDATE table_version SET version = version + 1 WHERE table_name = TG_TABLE_NAME;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS stop_version ON stop;
+CREATE TRIGGER stop_version AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON stop
+    FOR EACH STATEMENT EXECUTE FUNCTION bump_table_version();
+
+DROP TRIGGER IF EXISTS route_version ON route;
+CREATE TRIGGER route_version AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON route
+    FOR EACH STATEMENT EXECUTE FUNCTION bump_table_version();
+
+DROP TRIGGER IF EXISTS routestop_version ON routestop;
+CREATE TRIGGER routestop_version AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON routestop
+    FOR EACH STATEMENT EXECUTE FUNCTION bump_table_version();
+
+DROP TRIGGER IF EXISTS prices_version ON prices;
+CREATE TRIGGER prices_version AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON prices
+    FOR EACH STATEMENT EXECUTE FUNCTION bump_table_version();
+
+DROP TRIGGER IF EXISTS tour_version ON tour;
+CREATE TRIGGER tour_version AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON tour
+    FOR EACH STATEMENT EXECUTE FUNCTION bump_table_version();
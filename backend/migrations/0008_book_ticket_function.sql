@@ -0,0 +1,163 @@
+-- Продажа одного билета одной функцией (BOOKING_ENGINE=sql, routers/ticket.py).
+--
+-- Делает то же, что create_ticket на Python, за один вызов из приложения:
+-- проверка рейса и участка, выкуп удержания или бронирование сегментов места
+-- условным UPDATE, пассажир и билет, уменьшение счётчиков available и
+-- агрегат sales_rollup. Запросы и порядок блокировок те же, что в Python,
+-- поэтому оба пути можно использовать одновременно.
+--
+-- Отказы возвращаются как ошибки с SQLSTATE BK<HTTP-статус> (BK404, BK400,
+-- BK409) и текстом ответа API. Возвращает билет, пассажира, новое состояние
+-- места и участки, на которых закончились места (для сброса кэша поиска).
+
+CREATE OR REPLACE FUNCTION book_ticket(
+    p_tour_id int,
+    p_seat_num int,
+    p_departure_stop_id int,
+    p_arrival_stop_id int,
+    p_passenger_name varchar,
+    p_passenger_phone varchar,
+    p_passenger_email varchar,
+    p_hold_token text,
+    OUT ticket_id int,
+    OUT passenger_id int,
+    OUT seat_num int,
+    OUT available bigint,
+    OUT blocked boolean,
+    OUT held bigint,
+    OUT sold_out_deps int[],
+    OUT sold_out_arrs int[]
+) AS $$
+#variable_conflict use_column
+DECLARE
+    v_route_id int;
+    v_stops int[];
+    v_first int;
+    v_last int;
+    v_lo int;
+    v_hi int;
+    v_mask bigint;
+    v_seat_id int;
+    v_old bigint;
+    v_blocked boolean;
+    v_held boolean;
+BEGIN
+    SELECT t.route_id INTO v_route_id FROM tour t WHERE t.id = p_tour_id;
+    IF NOT FOUND THEN
+        RAISE EXCEPTION 'Tour not found' USING ERRCODE = 'BK404';
+    END IF;
+
+    -- Сегменты поездки по позициям остановок (как topology.RouteTopology)
+    SELECT array_agg(rs.stop_id ORDER BY rs."order") INTO v_stops
+    FROM routestop rs WHERE rs.route_id = v_route_id;
+    v_first := array_position(v_stops, p_departure_stop_id);
+    v_last := array_position(v_stops, p_arrival_stop_id) - 1;
+    IF v_first IS NULL OR v_last IS NULL OR v_last < v_first THEN
+        RAISE EXCEPTION 'Invalid segment for this tour' USING ERRCODE = 'BK400';
+    END IF;
+    SELECT bit_or(1::bigint << (s - 1)) INTO v_mask FROM generate_series(v_first, v_last) s;
+
+    IF p_hold_token IS NOT NULL THEN
+        -- TAKE_HOLDS_QUERY: счётчики уже уменьшены при удержании
+        WITH taken AS (
+            DELETE FROM seat_hold h
+            WHERE h.token = p_hold_token
+              AND h.tour_id = p_tour_id
+              AND h.seat_num = p_seat_num
+              AND h.mask = v_mask
+            RETURNING h.seat_id, h.mask
+        )
+        UPDATE seat s
+        SET held = s.held & ~taken.mask
+        FROM taken
+        WHERE s.id = taken.seat_id
+        RETURNING s.id, s.seat_num, s.available, s.blocked, s.held
+        INTO v_seat_id, seat_num, available, blocked, held;
+    END IF;
+
+    IF v_seat_id IS NULL THEN
+        -- BOOK_SEAT_QUERY
+        UPDATE seat s
+        SET available = s.available & ~v_mask
+        WHERE s.tour_id = p_tour_id
+          AND s.seat_num = p_seat_num
+          AND NOT s.blocked
+          AND s.available & v_mask = v_mask
+        RETURNING s.id, s.seat_num, s.available, s.blocked, s.held
+        INTO v_seat_id, seat_num, available, blocked, held;
+
+        IF NOT FOUND THEN
+            SELECT s.blocked, s.held & v_mask <> 0 INTO v_blocked, v_held
+            FROM seat s WHERE s.tour_id = p_tour_id AND s.seat_num = p_seat_num;
+            IF NOT FOUND THEN
+                RAISE EXCEPTION 'Seat not found' USING ERRCODE = 'BK404';
+            ELSIF v_blocked THEN
+                RAISE EXCEPTION 'Seat is blocked' USING ERRCODE = 'BK400';
+            ELSIF v_held THEN
+                RAISE EXCEPTION 'Seat is held by another customer' USING ERRCODE = 'BK409';
+            END IF;
+            RAISE EXCEPTION 'Seat already booked for selected segments' USING ERRCODE = 'BK409';
+        END IF;
+
+        -- Участки, на которых место было свободно целиком и которые
+        -- пересекают проданные сегменты (RouteTopology.pairs_losing_seat):
+        -- отправление в пределах свободного отрезка вокруг поездки до её
+        -- последнего сегмента, прибытие — от первого сегмента до конца отрезка
+        v_old := available | v_mask;
+        v_lo := v_first;
+        WHILE v_lo > 1 AND (v_old >> (v_lo - 2)) & 1 = 1 LOOP
+            v_lo := v_lo - 1;
+        END LOOP;
+        v_hi := v_last;
+        WHILE v_hi < array_length(v_stops, 1) - 1 AND (v_old >> v_hi) & 1 = 1 LOOP
+            v_hi := v_hi + 1;
+        END LOOP;
+
+        -- DECREMENT_AVAILABLE_QUERY: строки блокируются в порядке id
+        WITH p AS (
+            SELECT v_stops[d] AS dep, v_stops[a] AS arr
+            FROM generate_series(v_lo, v_last) d, generate_series(v_first + 1, v_hi + 1) a
+            WHERE a > d
+        ), locked AS (
+            SELECT av.id FROM available av
+            JOIN p ON av.departure_stop_id = p.dep AND av.arrival_stop_id = p.arr
+            WHERE av.tour_id = p_tour_id
+            ORDER BY av.id
+            FOR UPDATE OF av
+        ), changed AS (
+            UPDATE available av SET seats = av.seats - 1
+            FROM locked
+            WHERE av.id = locked.id
+            RETURNING av.departure_stop_id, av.arrival_stop_id, av.seats
+        )
+        SELECT coalesce(array_agg(c.departure_stop_id), '{}'), coalesce(array_agg(c.arrival_stop_id), '{}')
+        INTO sold_out_deps, sold_out_arrs
+        FROM changed c
+        WHERE c.seats = 0;
+    ELSE
+        sold_out_deps := '{}';
+        sold_out_arrs := '{}';
+    END IF;
+
+    INSERT INTO passenger (name, phone, email)
+    VALUES (p_passenger_name, p_passenger_phone, p_passenger_email)
+    RETURNING id INTO passenger_id;
+
+    INSERT INTO ticket (tour_id, seat_id, passenger_id, departure_stop_id, arrival_stop_id)
+    VALUES (p_tour_id, v_seat_id, passenger_id, p_departure_stop_id, p_arrival_stop_id)
+    RETURNING id INTO ticket_id;
+
+    -- rollup.RECORD_SALE_QUERY
+    INSERT INTO sales_rollup (date, route_id, tour_id, departure_stop_id, arrival_stop_id, tickets, revenue)
+    SELECT tr.date, tr.route_id, tr.id, pr.departure_stop_id, pr.arrival_stop_id, count(*), sum(pr.price)
+    FROM tour tr
+    JOIN prices pr ON pr.pricelist_id = tr.pricelist_id
+                  AND pr.departure_stop_id = p_departure_stop_id
+                  AND pr.arrival_stop_id = p_arrival_stop_id
+    WHERE tr.id = p_tour_id
+    GROUP BY tr.id, pr.departure_stop_id, pr.arrival_stop_id
+    ON CONFLICT (tour_id, departure_stop_id, arrival_stop_id) DO UPDATE
+    SET tickets = sales_rollup.tickets + EXCLUDED.tickets,
+        revenue = sales_rollup.revenue + EXCLUDED.revenue;
+END;
+$$ LANGUAGE plpgsql;
@@ -0,0 +1,40 @@
+-- Одна цена на пару остановок в прайсе: массовая загрузка цен
+-- (POST /prices/bulk) сливает матрицу через INSERT ... ON CONFLICT по
+-- (pricelist_id, departure_stop_id, arrival_stop_id).
+--
+-- Если пара уже повторялась, остаётся строка с меньшим id — та же, что
+-- берёт кэш цен (fares.py). Агрегаты продаж рейсов затронутых прайсов
+-- считались по всем повторам и пересчитываются.
+
+DELETE FROM sales_rollup sr
+USING tour tr
+WHERE tr.id = sr.tour_id
+  AND tr.pricelist_id IN (
+      SELECT pricelist_id FROM prices
+      GROUP BY pricelist_id, departure_stop_id, arrival_stop_id
+      HAVING count(*) > 1
+  );
+
+DELETE FROM prices p
+USING prices k
+WHERE k.pricelist_id = p.pricelist_id
+  AND k.departure_stop_id = p.departure_stop_id
+  AND k.arrival_stop_id = p.arrival_stop_id
+  AND k.id < p.id;
+
+-- rollup.INSERT_AGGREGATES для рейсов, у которых нет агрегатов
+INSERT INTO sales_rollup (date, route_id, tour_id, departure_stop_id, arrival_stop_id, tickets, revenue)
+SELECT tr.date, tr.route_id, tr.id, t.departure_stop_id, t.arrival_stop_id, count(*), sum(pr.price)
+FROM ticket t
+JOIN tour tr ON tr.id = t.tour_id
+JOIN prices pr ON pr.pricelist_id = tr.pricelist_id
+              AND pr.departure_stop_id = t.departure_stop_id
+              AND pr.arrival_stop_id = t.arrival_stop_id
+WHERE NOT EXISTS (SELECT 1 FROM sales_rollup sr WHERE sr.tour_id = tr.id)
+GROUP BY tr.id, t.departure_stop_id, t.arrival_stop_id;
+
+-- Заменяет неуникальный prices_pricelist_segment_idx (0003) с теми же столбцами
+CREATE UNIQUE INDEX IF NOT EXISTS prices_pricelist_pair_key
+    ON prices (pricelist_id, departure_stop_id, arrival_stop_id) INCLUDE (price);
+
+DROP INDEX IF EXISTS prices_pricelist_segment_idx;
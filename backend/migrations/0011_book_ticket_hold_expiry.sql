@@ -0,0 +1,148 @@
+-- Истёкшее удержание (seat_hold.expires_at) больше не выкупается: до этого
+-- его можно было превратить в билет, пока удержание не удалит очистка
+-- (routers/hold.py), и срок удержания был точен лишь до интервала очистки.
+-- Билет с токеном истёкшего удержания получает 409, как и при
+-- отсутствующем удержании: сегменты места остаются занятыми удержанием.
+--
+-- book_ticket (0009) пересоздаётся с условием expires_at > now() в выкупе
+-- удержания (как TAKE_HOLDS_QUERY в routers/ticket.py); остальное без изменений.
+
+CREATE OR REPLACE FUNCTION book_ticket(
+    p_tour_id int,
+    p_seat_num int,
+    p_departure_stop_id int,
+    p_arrival_stop_id int,
+    p_passenger_name varchar,
+    p_passenger_phone varchar,
+    p_passenger_email varchar,
+    p_hold_token text,
+    OUT ticket_id int,
+    OUT passenger_id int,
+    OUT seat_num int,
+    OUT available bigint,
+    OUT blocked boolean,
+    OUT held bigint,
+    OUT sold_out_deps int[],
+    OUT sold_out_arrs int[]
+) AS $$
+#variable_conflict use_column
+DECLARE
+    v_route_id int;
+    v_stops int[];
+    v_first int;
+    v_last int;
+    v_lo int;
+    v_hi int;
+    v_mask bigint;
+    v_seat_id int;
+    v_old bigint;
+    v_blocked boolean;
+    v_held boolean;
+    v_segments bigint[];
+BEGIN
+    SELECT t.route_id INTO v_route_id FROM tour t WHERE t.id = p_tour_id;
+    IF NOT FOUND THEN
+        RAISE EXCEPTION 'Tour not found' USING ERRCODE = 'BK404';
+    END IF;
+
+    -- Сегменты поездки по позициям остановок (как topology.RouteTopology)
+    SELECT array_agg(rs.stop_id ORDER BY rs."order") INTO v_stops
+    FROM routestop rs WHERE rs.route_id = v_route_id;
+    v_first := array_position(v_stops, p_departure_stop_id);
+    v_last := array_position(v_stops, p_arrival_stop_id) - 1;
+    IF v_first IS NULL OR v_last IS NULL OR v_last < v_first THEN
+        RAISE EXCEPTION 'Invalid segment for this tour' USING ERRCODE = 'BK400';
+    END IF;
+    SELECT bit_or(1::bigint << (s - 1)) INTO v_mask FROM generate_series(v_first, v_last) s;
+
+    IF p_hold_token IS NOT NULL THEN
+        -- TAKE_HOLDS_QUERY: сегменты сняты с продажи ещё при удержании
+        WITH taken AS (
+            DELETE FROM seat_hold h
+            WHERE h.token = p_hold_token
+              AND h.tour_id = p_tour_id
+              AND h.seat_num = p_seat_num
+              AND h.mask = v_mask
+              AND h.expires_at > now()
+            RETURNING h.seat_id, h.mask
+        )
+        UPDATE seat s
+        SET held = s.held & ~taken.mask
+        FROM taken
+        WHERE s.id = taken.seat_id
+        RETURNING s.id, s.seat_num, s.available, s.blocked, s.held
+        INTO v_seat_id, seat_num, available, blocked, held;
+    END IF;
+
+    sold_out_deps := '{}';
+    sold_out_arrs := '{}';
+    IF v_seat_id IS NULL THEN
+        -- BOOK_SEAT_QUERY
+        UPDATE seat s
+        SET available = s.available & ~v_mask
+        WHERE s.tour_id = p_tour_id
+          AND s.seat_num = p_seat_num
+          AND NOT s.blocked
+          AND s.available & v_mask = v_mask
+        RETURNING s.id, s.seat_num, s.available, s.blocked, s.held
+        INTO v_seat_id, seat_num, available, blocked, held;
+
+        IF NOT FOUND THEN
+            SELECT s.blocked, s.held & v_mask <> 0 INTO v_blocked, v_held
+            FROM seat s WHERE s.tour_id = p_tour_id AND s.seat_num = p_seat_num;
+            IF NOT FOUND THEN
+                RAISE EXCEPTION 'Seat not found' USING ERRCODE = 'BK404';
+            ELSIF v_blocked THEN
+                RAISE EXCEPTION 'Seat is blocked' USING ERRCODE = 'BK400';
+            ELSIF v_held THEN
+                RAISE EXCEPTION 'Seat is held by another customer' USING ERRCODE = 'BK409';
+            END IF;
+            RAISE EXCEPTION 'Seat already booked for selected segments' USING ERRCODE = 'BK409';
+        END IF;
+
+        -- availability.UPDATE_SEATS_QUERY
+        UPDATE tour_availability ta
+        SET segment_seats = set_seat_segments(ta.segment_seats, ARRAY[p_seat_num], ARRAY[available])
+        WHERE ta.tour_id = p_tour_id
+        RETURNING ta.segment_seats INTO v_segments;
+
+        -- Участки, на которых место было свободно целиком и которые
+        -- пересекают проданные сегменты (RouteTopology.pairs_losing_seat):
+        -- если на них не осталось мест, они пропадают из поиска
+        v_old := available | v_mask;
+        v_lo := v_first;
+        WHILE v_lo > 1 AND (v_old >> (v_lo - 2)) & 1 = 1 LOOP
+            v_lo := v_lo - 1;
+        END LOOP;
+        v_hi := v_last;
+        WHILE v_hi < array_length(v_stops, 1) - 1 AND (v_old >> v_hi) & 1 = 1 LOOP
+            v_hi := v_hi + 1;
+        END LOOP;
+        SELECT coalesce(array_agg(v_stops[d]), '{}'), coalesce(array_agg(v_stops[a]), '{}')
+        INTO sold_out_deps, sold_out_arrs
+        FROM generate_series(v_lo, v_last) d, generate_series(v_first + 1, v_hi + 1) a
+        WHERE a > d AND pair_seats(v_segments, d, a - 1) = 0;
+    END IF;
+
+    INSERT INTO passenger (name, phone, email)
+    VALUES (p_passenger_name, p_passenger_phone, p_passenger_email)
+    RETURNING id INTO passenger_id;
+
+    INSERT INTO ticket (tour_id, seat_id, passenger_id, departure_stop_id, arrival_stop_id)
+    VALUES (p_tour_id, v_seat_id, passenger_id, p_departure_stop_id, p_arrival_stop_id)
+    RETURNING id INTO ticket_id;
+
+    -- rollup.RECORD_SALE_QUERY
+    INSERT INTO sales_rollup (date, route_id, tour_id, departure_stop_id, arrival_stop_id, tickets, revenue)
+    SELECT tr.date, tr.route_id, tr.id, pr.departure_stop_id, pr.arrival_stop_id, count(*), sum(pr.price)
+    FROM tour tr
+    JOIN prices pr ON pr.pricelist_id = tr.pricelist_id
+                  AND pr.departure_stop_id = p_departure_stop_id
+                  AND pr.arrival_stop_id = p_arrival_stop_id
+    WHERE tr.id = p_tour_id
+    GROUP BY tr.id, pr.departure_stop_id, pr.arrival_stop_id
+    ON CONFLICT (tour_id, departure_stop_id, arrival_stop_id) DO UPDATE
+    SET tickets = sales_rollup.tickets + EXCLUDED.tickets,
+        revenue = sales_rollup.revenue + EXCLUDED.revenue;
+END;
+$$ LANGUAGE plpgsql;
@@ -1,6 +1,6 @@
 from pydantic import BaseModel
 from datetime import datetime, date
-from typing import Optional, List
+from typing import Literal, Optional, List
 
 # --- Модели за Stop ---
 class StopBase(BaseModel):
@@ -69,6 +69,32 @@ class Prices(PricesBase):
     class Config:
         from_attributes = True
 
+# Масово зареждане на цени (POST /prices/bulk): replace изтрива цените
+# от ценоразписа, които липсват в матрицата
+class PriceRow(BaseModel):
+    departure_stop_id: int
+    arrival_stop_id: int
+    price: float
+
+class PricesBulkImport(BaseModel):
+    pricelist_id: int
+    prices: List[PriceRow]
+    replace: bool = False
+
+# Генериране на матрица от тарифи по сегменти (POST /prices/bulk/generate).
+# Без segment_fares тарифите се вземат от цените между съседни спирки.
+class RouteSegmentFares(BaseModel):
+    route_id: int
+    segment_fares: Optional[List[float]] = None
+
+class PricesGenerate(BaseModel):
+    pricelist_id: int
+    routes: List[RouteSegmentFares]
+    factor: float = 1
+    rounding_step: float = 0.01
+    rounding: Literal["nearest", "up", "down"] = "nearest"
+    replace: bool = False
+
 # --- Модели за Tour ---
 # За вход при създаване използваме layout_variant и active_seats, а общият брой места се пресмята на бекенда
 class TourBase(BaseModel):
@@ -124,11 +150,8 @@ class AvailableBase(BaseModel):
     arrival_stop_id: int
     seats: int
 
-class AvailableCreate(AvailableBase):
-    pass
-
+# Четене от изгледа available (migrations/0009_tour_availability.sql)
 class Available(AvailableBase):
-    id: int
     class Config:
         from_attributes = True
 
@@ -136,7 +159,8 @@ class Available(AvailableBase):
 class SeatBase(BaseModel):
     tour_id: int
     seat_num: int
-    available: str  # Низ, съдържащ свободните сегменти, напр. "1234" или "0" ако мястото е деактивирано
+    available: int  # Битова маска на свободните сегменти: бит (i-1) е вдигнат, ако сегмент i е свободен
+    blocked: bool = False  # Мястото е деактивирано за продажба
 
 class SeatCreate(SeatBase):
     pass
@@ -0,0 +1,241 @@
+"""
+Массовые операции с ценами прайса (POST /prices/bulk*, GET /prices/bulk).
+
+Матрица цен сначала попадает во временную таблицу price_import (COPY из
+CSV или генерация по тарифам сегментов), проверяется и затем сливается
+в prices одним INSERT ... ON CONFLICT по уникальной паре
+(migrations/0010_prices_unique_pair.sql). В режиме replace цены прайса,
+которых нет в матрице, удаляются. Всё выполняется в транзакции
+обработчика; price_import удаляется при её завершении.
+
+CSV — три столбца с заголовком: departure_stop_id,arrival_stop_id,price
+(в том же виде выгружает GET /prices/bulk, так что файл можно загрузить
+обратно).
+"""
+import csv
+import io
+
+CSV_COLUMNS = ("departure_stop_id", "arrival_stop_id", "price")
+
+CREATE_STAGING_QUERY = """
+    CREATE TEMP TABLE price_import (
+        departure_stop_id int NOT NULL,
+        arrival_stop_id int NOT NULL,
+        price numeric(10,2) NOT NULL
+    ) ON COMMIT DROP
+"""
+
+COPY_QUERY = """
+    COPY price_import (departure_stop_id, arrival_stop_id, price)
+    FROM STDIN WITH (FORMAT csv, HEADER true)
+"""
+
+# Цены всех пар остановок маршрутов по тарифам сегментов: цена участка —
+# сумма тарифов его сегментов, умноженная на factor и округлённая до step.
+# Сегмент k — между k-й и (k + 1)-й остановками маршрута, cum.total —
+# сумма тарифов от первой остановки маршрута до данной.
+GENERATE_QUERY = """
+    INSERT INTO price_import (departure_stop_id, arrival_stop_id, price)
+    WITH fare AS (
+        SELECT *
+        FROM unnest(%(route_ids)s::int[], %(segments)s::int[], %(fares)s::numeric[])
+             AS f(route_id, segment, fare)
+    ),
+    stops AS (
+        SELECT rs.route_id, rs.stop_id,
+               row_number() OVER (PARTITION BY rs.route_id ORDER BY rs."order") AS pos
+        FROM routestop rs
+        WHERE rs.route_id IN (SELECT route_id FROM fare)
+    ),
+    cum AS (
+        SELECT s.route_id, s.stop_id, s.pos,
+               coalesce(sum(f.fare) OVER (
+                   PARTITION BY s.route_id ORDER BY s.pos
+                   ROWS BETWEEN UNBOUNDED PRECEDING AND 1 PRECEDING
+               ), 0) AS total
+        FROM stops s
+        LEFT JOIN fare f ON f.route_id = s.route_id AND f.segment = s.pos
+    ),
+    raw AS (
+        SELECT d.stop_id AS departure_stop_id, a.stop_id AS arrival_stop_id,
+               (a.total - d.total) * %(factor)s::numeric / %(step)s::numeric AS units
+        FROM cum d
+        JOIN cum a ON a.route_id = d.route_id AND a.pos > d.pos
+    )
+    SELECT departure_stop_id, arrival_stop_id,
+           CASE %(rounding)s
+               WHEN 'up' THEN ceil(units)
+               WHEN 'down' THEN floor(units)
+               ELSE round(units)
+           END * %(step)s::numeric
+    FROM raw
+"""
+
+# Остановки маршрутов по порядку — читаются в транзакции загрузки, а не
+# из кэша топологии, чтобы число сегментов совпало с GENERATE_QUERY
+ROUTES_STOPS_QUERY = """
+    SELECT route_id, array_agg(stop_id ORDER BY "order")
+    FROM routestop
+    WHERE route_id = ANY(%s)
+    GROUP BY route_id
+"""
+
+# Текущие цены соседних остановок — тарифы сегментов, если они не заданы
+SEGMENT_PRICES_QUERY = """
+    SELECT departure_stop_id, arrival_stop_id, price
+    FROM prices
+    WHERE pricelist_id = %s
+      AND (departure_stop_id, arrival_stop_id) IN (
+          SELECT * FROM unnest(%s::int[], %s::int[])
+      )
+"""
+
+# Первая строка матрицы, которую нельзя загрузить
+INVALID_ROW_QUERY = """
+    SELECT i.departure_stop_id, i.arrival_stop_id,
+           CASE
+               WHEN i.departure_stop_id = i.arrival_stop_id THEN 'departure and arrival stops are the same'
+               WHEN i.price < 0 THEN 'negative price'
+               ELSE 'unknown stop'
+           END
+    FROM price_import i
+    WHERE i.departure_stop_id = i.arrival_stop_id
+       OR i.price < 0
+       OR NOT EXISTS (SELECT 1 FROM stop s WHERE s.id = i.departure_stop_id)
+       OR NOT EXISTS (SELECT 1 FROM stop s WHERE s.id = i.arrival_stop_id)
+    LIMIT 1
+"""
+
+# Пары, для которых в матрице разные цены (одинаковые повторы допустимы)
+CONFLICTS_QUERY = """
+    SELECT departure_stop_id, arrival_stop_id
+    FROM price_import
+    GROUP BY departure_stop_id, arrival_stop_id
+    HAVING count(DISTINCT price) > 1
+    ORDER BY departure_stop_id, arrival_stop_id
+    LIMIT 5
+"""
+
+STAGED_PAIRS_QUERY = """
+    SELECT count(*) FROM (SELECT DISTINCT departure_stop_id, arrival_stop_id FROM price_import) p
+"""
+
+# Пары вставляются в порядке ключа: параллельные загрузки в один прайс
+# блокируют строки в одном порядке
+MERGE_QUERY = """
+    INSERT INTO prices (pricelist_id, departure_stop_id, arrival_stop_id, price)
+    SELECT DISTINCT %(pricelist_id)s, departure_stop_id, arrival_stop_id, price
+    FROM price_import
+    ORDER BY departure_stop_id, arrival_stop_id
+    ON CONFLICT (pricelist_id, departure_stop_id, arrival_stop_id) DO UPDATE
+    SET price = EXCLUDED.price
+    WHERE prices.price <> EXCLUDED.price
+    RETURNING departure_stop_id, arrival_stop_id, xmax = 0 AS inserted
+"""
+
+DELETE_MISSING_QUERY = """
+    DELETE FROM prices p
+    WHERE p.pricelist_id = %(pricelist_id)s
+      AND NOT EXISTS (
+          SELECT 1 FROM price_import i
+          WHERE i.departure_stop_id = p.departure_stop_id
+            AND i.arrival_stop_id = p.arrival_stop_id
+      )
+    RETURNING p.departure_stop_id, p.arrival_stop_id
+"""
+
+EXPORT_QUERY = """
+    SELECT departure_stop_id, arrival_stop_id, price
+    FROM prices
+    WHERE pricelist_id = %s
+    ORDER BY departure_stop_id, arrival_stop_id
+"""
+
+
+def create_staging(cur):
+    cur.execute(CREATE_STAGING_QUERY)
+
+
+def copy_csv(cur, data):
+    """Загружает CSV (bytes) в price_import через COPY."""
+    cur.copy_expert(COPY_QUERY, io.BytesIO(data))
+
+
+def copy_rows(cur, rows):
+    """Загружает строки [(departure_stop_id, arrival_stop_id, price), ...] через COPY."""
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    writer.writerow(CSV_COLUMNS)
+    writer.writerows(rows)
+    copy_csv(cur, buf.getvalue().encode("utf-8"))
+
+
+def route_stops(cur, route_ids):
+    """{route_id: [stop_id, ...]} для маршрутов route_ids."""
+    cur.execute(ROUTES_STOPS_QUERY, (list(route_ids),))
+    return dict(cur.fetchall())
+
+
+def segment_prices(cur, pricelist_id, pairs):
+    """{(dep, arr): цена} для пар соседних остановок pairs из прайса."""
+    cur.execute(SEGMENT_PRICES_QUERY, (pricelist_id, [p[0] for p in pairs], [p[1] for p in pairs]))
+    return {(dep, arr): price for dep, arr, price in cur.fetchall()}
+
+
+def generate(cur, route_fares, factor=1, step=0.01, rounding="nearest"):
+    """
+    Заполняет price_import ценами всех пар остановок маршрутов.
+    route_fares — [(route_id, [тариф сегмента 1, тариф сегмента 2, ...]), ...].
+    """
+    route_ids, segments, fares = [], [], []
+    for route_id, segment_fares in route_fares:
+        for k, fare in enumerate(segment_fares, 1):
+            route_ids.append(route_id)
+            segments.append(k)
+            fares.append(fare)
+    cur.execute(GENERATE_QUERY, {
+        "route_ids": route_ids,
+        "segments": segments,
+        "fares": fares,
+        "factor": factor,
+        "step": step,
+        "rounding": rounding,
+    })
+
+
+def validate(cur):
+    """Текст ошибки для первой некорректной строки price_import или None."""
+    cur.execute(INVALID_ROW_QUERY)
+    row = cur.fetchone()
+    if row is not None:
+        return f"Invalid price for {row[0]} -> {row[1]}: {row[2]}"
+    cur.execute(CONFLICTS_QUERY)
+    conflicts = cur.fetchall()
+    if conflicts:
+        pairs = ", ".join(f"{dep} -> {arr}" for dep, arr in conflicts)
+        return f"Conflicting prices for the same stops: {pairs}"
+    return None
+
+
+def merge(cur, pricelist_id, replace=False):
+    """
+    Сливает price_import в прайс. Возвращает (счётчики, изменённые пары):
+    счётчики — rows, inserted, updated, deleted, unchanged.
+    """
+    cur.execute(STAGED_PAIRS_QUERY)
+    staged = cur.fetchone()[0]
+    cur.execute(MERGE_QUERY, {"pricelist_id": pricelist_id})
+    merged = cur.fetchall()
+    deleted = []
+    if replace:
+        cur.execute(DELETE_MISSING_QUERY, {"pricelist_id": pricelist_id})
+        deleted = cur.fetchall()
+    inserted = sum(1 for row in merged if row[2])
+    counts = {
+        "rows": staged,
+        "inserted": inserted,
+        "updated": len(merged) - inserted,
+        "deleted": len(deleted),
+        "unchanged": staged - len(merged),
+    }
+    return counts, [(row[0], row[1]) for row in merged] + [tuple(row) for row in deleted]
@@ -0,0 +1,38 @@
+"""
+Быстрый JSON-ответ из строк курсора.
+
+Списочные GET-эндпоинты возвращают строки таблиц как есть: ключи берутся
+из cursor.description (имена столбцов или псевдонимы AS в SQL), значения
+сериализуются orjson сразу в байты. Промежуточные Pydantic-модели и
+jsonable_encoder не используются — обработчик, вернувший Response, FastAPI
+отдаёт без проверки по response_model (модель остаётся только для схемы
+OpenAPI), поэтому имена столбцов в SQL должны совпадать с полями модели.
+
+Даты и время orjson сериализует сам (ISO 8601), Decimal (numeric)
+превращается в число, как и в стандартном кодировщике FastAPI.
+"""
+from decimal import Decimal
+
+import orjson
+from fastapi.responses import Response
+
+
+def _default(value):
+    if isinstance(value, Decimal):
+        return float(value)
+    raise TypeError(f"Type is not JSON serializable: {type(value).__name__}")
+
+
+def column_names(cur):
+    return [column.name for column in cur.description]
+
+
+def dump_rows(cur, rows):
+    """JSON-массив объектов {столбец: значение} в байтах."""
+    names = column_names(cur)
+    return orjson.dumps([dict(zip(names, row)) for row in rows], default=_default)
+
+
+def rows_response(cur, status_code=200):
+    """Выбирает все строки выполненного запроса и возвращает их как JSON-ответ."""
+    return Response(dump_rows(cur, cur.fetchall()), status_code=status_code, media_type="application/json")
@@ -0,0 +1,163 @@
+"""
+Агрегаты продаж (таблица sales_rollup) для сводки отчёта.
+
+Одна строка на (рейс, остановка отправления, остановка прибытия) с числом
+проданных билетов и выручкой; дата рейса и маршрут хранятся в строке,
+чтобы фильтры отчёта не требовали соединений. Выручка считается так же,
+как в деталях отчёта: по цене из прайса рейса, билеты без цены не входят.
+
+Агрегаты обновляются в транзакции записи:
+  - продажа билета — record_sale;
+  - изменение цены — refresh_pricelist_pairs;
+  - изменение или удаление рейса — refresh_tours / delete_tours.
+
+Пересчёт и проверка согласованности (из каталога backend):
+    python rollup.py rebuild
+    python rollup.py check        # код возврата 1 при расхождениях
+"""
+import argparse
+import sys
+
+from database import get_connection
+
+# Агрегаты по билетам; {where} — условие на ticket t / tour tr
+AGGREGATE_QUERY = """
+    SELECT tr.date, tr.route_id, tr.id AS tour_id, t.departure_stop_id, t.arrival_stop_id,
+           count(*) AS tickets, sum(pr.price) AS revenue
+    FROM ticket t
+    JOIN tour tr ON tr.id = t.tour_id
+    JOIN prices pr ON pr.pricelist_id = tr.pricelist_id
+                  AND pr.departure_stop_id = t.departure_stop_id
+                  AND pr.arrival_stop_id = t.arrival_stop_id
+    {where}
+    GROUP BY tr.id, t.departure_stop_id, t.arrival_stop_id
+"""
+
+INSERT_AGGREGATES = """
+    INSERT INTO sales_rollup (date, route_id, tour_id, departure_stop_id, arrival_stop_id, tickets, revenue)
+""" + AGGREGATE_QUERY
+
+# Продажа одного билета. Пара остановок в прайсе уникальна
+# (migrations/0010_prices_unique_pair.sql), группировка даёт одну строку.
+RECORD_SALE_QUERY = """
+    INSERT INTO sales_rollup (date, route_id, tour_id, departure_stop_id, arrival_stop_id, tickets, revenue)
+    SELECT tr.date, tr.route_id, tr.id, pr.departure_stop_id, pr.arrival_stop_id,
+           count(*) * %(tickets)s, sum(pr.price) * %(tickets)s
+    FROM tour tr
+    JOIN prices pr ON pr.pricelist_id = tr.pricelist_id
+                  AND pr.departure_stop_id = %(departure_stop_id)s
+                  AND pr.arrival_stop_id = %(arrival_stop_id)s
+    WHERE tr.id = %(tour_id)s
+    GROUP BY tr.id, pr.departure_stop_id, pr.arrival_stop_id
+    ON CONFLICT (tour_id, departure_stop_id, arrival_stop_id) DO UPDATE
+    SET tickets = sales_rollup.tickets + EXCLUDED.tickets,
+        revenue = sales_rollup.revenue + EXCLUDED.revenue
+"""
+
+
+def record_sale(cur, tour_id, departure_stop_id, arrival_stop_id, tickets=1):
+    """Учитывает проданные билеты на участок. Вызывается в транзакции продажи."""
+    cur.execute(RECORD_SALE_QUERY, {
+        "tour_id": tour_id,
+        "departure_stop_id": departure_stop_id,
+        "arrival_stop_id": arrival_stop_id,
+        "tickets": tickets,
+    })
+
+
+def delete_tours(cur, tour_ids):
+    cur.execute("DELETE FROM sales_rollup WHERE tour_id = ANY(%s);", (list(tour_ids),))
+
+
+def refresh_tours(cur, tour_ids):
+    """Пересчитывает агрегаты рейсов (после смены даты, маршрута или прайса)."""
+    tour_ids = list(tour_ids)
+    delete_tours(cur, tour_ids)
+    cur.execute(INSERT_AGGREGATES.format(where="WHERE t.tour_id = ANY(%s)"), (tour_ids,))
+
+
+def refresh_pricelist_pairs(cur, pricelist_id, pairs):
+    """Пересчитывает агрегаты рейсов прайса по парам остановок, цена которых изменилась."""
+    deps = [p[0] for p in pairs]
+    arrs = [p[1] for p in pairs]
+    cur.execute("""
+        DELETE FROM sales_rollup sr
+        USING tour tr
+        WHERE tr.id = sr.tour_id
+          AND tr.pricelist_id = %s
+          AND (sr.departure_stop_id, sr.arrival_stop_id) IN (
+              SELECT * FROM unnest(%s::int[], %s::int[])
+          );
+    """, (pricelist_id, deps, arrs))
+    cur.execute(INSERT_AGGREGATES.format(where="""
+        WHERE tr.pricelist_id = %s
+          AND (t.departure_stop_id, t.arrival_stop_id) IN (
+              SELECT * FROM unnest(%s::int[], %s::int[])
+          )
+    """), (pricelist_id, deps, arrs))
+
+
+def rebuild(cur):
+    """Полный пересчёт агрегатов по всем билетам."""
+    cur.execute("DELETE FROM sales_rollup;")
+    cur.execute(INSERT_AGGREGATES.format(where=""))
+    cur.execute("SELECT count(*) FROM sales_rollup;")
+    return cur.fetchone()[0]
+
+
+def check(cur, tour_id=None):
+    """
+    Сравнивает агрегаты с билетами. Возвращает список расхождений
+    [(tour_id, dep, arr, ожидаемые (tickets, revenue), в таблице (tickets, revenue)), ...].
+    """
+    where = "WHERE t.tour_id = %(tour_id)s" if tour_id is not None else ""
+    rollup_where = "WHERE tour_id = %(tour_id)s" if tour_id is not None else ""
+    cur.execute(f"""
+        WITH e AS ({AGGREGATE_QUERY.format(where=where)}),
+        r AS (SELECT * FROM sales_rollup {rollup_where})
+        SELECT COALESCE(e.tour_id, r.tour_id),
+               COALESCE(e.departure_stop_id, r.departure_stop_id),
+               COALESCE(e.arrival_stop_id, r.arrival_stop_id),
+               e.tickets, e.revenue, r.tickets, r.revenue
+        FROM e
+        FULL JOIN r ON r.tour_id = e.tour_id
+                   AND r.departure_stop_id = e.departure_stop_id
+                   AND r.arrival_stop_id = e.arrival_stop_id
+        WHERE e.tickets IS DISTINCT FROM r.tickets
+           OR e.revenue IS DISTINCT FROM r.revenue
+           OR e.date IS DISTINCT FROM r.date
+           OR e.route_id IS DISTINCT FROM r.route_id
+        ORDER BY 1, 2, 3
+    """, {"tour_id": tour_id})
+    return [(row[0], row[1], row[2], (row[3], row[4]), (row[5], row[6])) for row in cur.fetchall()]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("command", choices=("rebuild", "check"))
+    args = parser.parse_args()
+
+    conn = get_connection()
+    cur = conn.cursor()
+    try:
+        if args.command == "rebuild":
+            rows = rebuild(cur)
+            conn.commit()
+            print(f"sales_rollup rebuilt: {rows} rows")
+            return 0
+        problems = check(cur)
+        conn.rollback()
+        if problems:
+            print(f"sales_rollup: {len(problems)} mismatches")
+            for tour_id, dep, arr, expected, actual in problems[:50]:
+                print(f"  tour {tour_id} {dep}->{arr}: expected {expected}, found {actual}")
+            return 1
+        print("sales_rollup is consistent with tickets")
+        return 0
+    finally:
+        cur.close()
+        conn.close()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,276 @@
+"""
+Временное удержание мест на время оформления покупки.
+
+Удержание снимает сегменты поездки с продажи так же, как билет: биты
+сегментов в seat.available сбрасываются тем же условным UPDATE, что и при
+покупке, поэтому чужая покупка или удержание тех же сегментов получает
+отказ без дополнительных проверок. Маска удержанных сегментов хранится в
+seat.held (схема мест показывает такие места как "held"), сами удержания
+с токеном покупателя и сроком действия — в таблице seat_hold.
+
+Покупка с hold_token (POST /tickets/, /tickets/batch) превращает удержание
+в билет. Просроченные удержания снимает фоновая задача run_sweeper
+(запускается в lifespan приложения) пачками по HOLD_SWEEP_BATCH. Удержание
+действует, пока запись не удалена, то есть до HOLD_TTL + HOLD_SWEEP_INTERVAL
+секунд.
+"""
+import asyncio
+import logging
+import os
+import uuid
+from collections import Counter, defaultdict
+
+from fastapi import APIRouter, Depends, HTTPException
+from pydantic import BaseModel
+
+import availability
+from cache import invalidate_search
+from database import connection, get_db
+from inventory import inventory
+from responses import rows_response
+from topology import topology
+
+HOLD_TTL = int(os.getenv("HOLD_TTL", "300"))
+HOLD_SWEEP_INTERVAL = float(os.getenv("HOLD_SWEEP_INTERVAL", "15"))
+HOLD_SWEEP_BATCH = int(os.getenv("HOLD_SWEEP_BATCH", "1000"))
+
+logger = logging.getLogger(__name__)
+
+router = APIRouter(prefix="/holds", tags=["holds"])
+
+
+class HoldCreate(BaseModel):
+    tour_id: int
+    seat_num: int
+    departure_stop_id: int
+    arrival_stop_id: int
+    # Токен оформления: несколько мест под одним токеном выкупаются и
+    # снимаются вместе. Если не задан, создаётся новый.
+    token: str = None
+
+
+# Условие то же, что в BOOK_SEAT_QUERY (routers/ticket.py)
+HOLD_SEAT_QUERY = """
+    UPDATE seat
+    SET available = available & ~%(mask)s::bigint,
+        held = held | %(mask)s::bigint
+    WHERE tour_id = %(tour_id)s
+      AND seat_num = %(seat_num)s
+      AND NOT blocked
+      AND available & %(mask)s::bigint = %(mask)s::bigint
+    RETURNING id, seat_num, available, blocked, held
+"""
+
+INSERT_HOLD_QUERY = """
+    INSERT INTO seat_hold (token, tour_id, seat_id, seat_num, departure_stop_id, arrival_stop_id, mask, expires_at)
+    VALUES (%(token)s, %(tour_id)s, %(seat_id)s, %(seat_num)s, %(departure_stop_id)s, %(arrival_stop_id)s,
+            %(mask)s, now() + make_interval(secs => %(ttl)s))
+    RETURNING id, expires_at
+"""
+
+LIST_HOLDS_QUERY = """
+    SELECT id, tour_id, seat_num, departure_stop_id, arrival_stop_id, created_at, expires_at
+    FROM seat_hold
+    WHERE token = %s
+    ORDER BY id
+"""
+
+# Снятие удержаний: записи seat_hold удаляются, сегменты возвращаются в
+# seat.available. Места блокируются в том же порядке, что и при групповой
+# покупке (BOOK_SEATS_QUERY), чтобы не попадать с ней во взаимную блокировку.
+# {where} — условие на удаляемые записи seat_hold h.
+RELEASE_QUERY = """
+    WITH released AS (
+        DELETE FROM seat_hold h
+        WHERE {where}
+        RETURNING h.seat_id, h.mask
+    ), freed AS (
+        SELECT seat_id, bit_or(mask) AS mask FROM released GROUP BY seat_id
+    ), locked AS (
+        SELECT s.id, freed.mask FROM seat s
+        JOIN freed ON freed.seat_id = s.id
+        ORDER BY s.tour_id, s.seat_num
+        FOR UPDATE OF s
+    )
+    UPDATE seat s
+    SET available = s.available | locked.mask,
+        held = s.held & ~locked.mask
+    FROM locked
+    WHERE s.id = locked.id
+    RETURNING s.tour_id, s.seat_num, s.available, s.blocked, s.held, locked.mask
+"""
+
+RELEASE_TOKEN_WHERE = "h.token = %(token)s"
+
+# Параллельные чистильщики (несколько воркеров) не ждут друг друга
+RELEASE_EXPIRED_WHERE = """h.id IN (
+            SELECT id FROM seat_hold
+            WHERE expires_at <= now()
+            ORDER BY expires_at
+            LIMIT %(limit)s
+            FOR UPDATE SKIP LOCKED
+        )"""
+
+
+def release(cur, where, params):
+    """
+    Снимает удержания, подходящие под условие where, и возвращает сегменты
+    в продажу. Возвращает (число мест, {tour_id: [состояние места, ...]},
+    участки, на которых снова появились места) для обновления кэшей после
+    коммита.
+    """
+    cur.execute(RELEASE_QUERY.format(where=where), params)
+    rows = cur.fetchall()
+    seats = defaultdict(list)
+    reopened = []
+    by_tour = defaultdict(list)
+    for tour_id, seat_num, available, blocked, held, mask in rows:
+        seats[tour_id].append((seat_num, available, blocked, held))
+        if not blocked:
+            by_tour[tour_id].append((available, mask))
+    # Строки рейсов обновляются в порядке tour_id, чтобы параллельные
+    # снятия удержаний не попадали во взаимную блокировку
+    for tour_id in sorted(by_tour):
+        route = topology.for_tour(cur, tour_id)
+        # Зеркально удержанию: место снова свободно на участках, которые
+        # пересекают освобождённые сегменты и теперь свободны целиком
+        counts = Counter()
+        for available, mask in by_tour[tour_id]:
+            counts.update(route.pairs_losing_seat(available, mask))
+        segment_seats = availability.update_seats(cur, tour_id, seats[tour_id])
+        if segment_seats is None:
+            continue
+        # Участок снова появляется в поиске, если все свободные на нём места — освобождённые
+        for pair, left in availability.pair_counts(route, segment_seats, counts).items():
+            if left == counts[pair]:
+                reopened.append(pair)
+    return len(rows), seats, reopened
+
+
+def _after_release(seats, reopened):
+    for tour_id, states in seats.items():
+        inventory.update_seats(tour_id, states)
+    if reopened:
+        invalidate_search(reopened)
+
+
+@router.post("/")
+def create_hold(hold: HoldCreate, conn=Depends(get_db)):
+    """
+    Удерживает место на участке на HOLD_TTL секунд. Возвращает токен, по
+    которому удержание выкупается (hold_token в POST /tickets/) или снимается.
+    """
+    cur = conn.cursor()
+    try:
+        route = topology.for_tour(cur, hold.tour_id)
+        if route is None:
+            raise HTTPException(status_code=404, detail="Tour not found")
+        mask = route.mask(hold.departure_stop_id, hold.arrival_stop_id)
+        if mask is None:
+            raise HTTPException(status_code=400, detail="Invalid segment for this tour")
+        params = {"tour_id": hold.tour_id, "seat_num": hold.seat_num, "mask": mask}
+
+        cur.execute(HOLD_SEAT_QUERY, params)
+        held = cur.fetchone()
+        if not held:
+            availability.refuse_seat(cur, params)
+
+        token = hold.token or uuid.uuid4().hex
+        cur.execute(INSERT_HOLD_QUERY, {
+            **params,
+            "token": token,
+            "seat_id": held[0],
+            "departure_stop_id": hold.departure_stop_id,
+            "arrival_stop_id": hold.arrival_stop_id,
+            "ttl": HOLD_TTL,
+        })
+        hold_id, expires_at = cur.fetchone()
+
+        # Наличие мест меняется так же, как при продаже (см. create_ticket)
+        segment_seats = availability.update_seats(cur, hold.tour_id, [held[1:]])
+        sold_out = availability.sold_out(route, segment_seats, route.pairs_losing_seat(held[2] | mask, mask))
+
+        conn.commit()
+        inventory.update_seats(hold.tour_id, [held[1:]])
+        if sold_out:
+            invalidate_search(sold_out)
+        return {"hold_id": hold_id, "token": token, "expires_at": expires_at}
+
+    except HTTPException:
+        conn.rollback()
+        raise
+    except Exception as e:
+        conn.rollback()
+        raise HTTPException(status_code=500, detail=str(e))
+    finally:
+        cur.close()
+
+
+@router.get("/{token}")
+def get_holds(token: str, conn=Depends(get_db)):
+    cur = conn.cursor()
+    try:
+        cur.execute(LIST_HOLDS_QUERY, (token,))
+        return rows_response(cur)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+    finally:
+        cur.close()
+
+
+@router.delete("/{token}")
+def release_holds(token: str, conn=Depends(get_db)):
+    """Снимает все удержания токена (покупатель отказался от оформления)."""
+    cur = conn.cursor()
+    try:
+        released, seats, reopened = release(cur, RELEASE_TOKEN_WHERE, {"token": token})
+        if not released:
+            raise HTTPException(status_code=404, detail="Hold not found")
+        conn.commit()
+        _after_release(seats, reopened)
+        return {"released": released}
+    except HTTPException:
+        conn.rollback()
+        raise
+    except Exception as e:
+        conn.rollback()
+        raise HTTPException(status_code=500, detail=str(e))
+    finally:
+        cur.close()
+
+
+def sweep_expired(limit=HOLD_SWEEP_BATCH):
+    """Снимает просроченные удержания пачками по limit. Возвращает число освобождённых мест."""
+    total = 0
+    with connection() as conn:
+        cur = conn.cursor()
+        try:
+            while True:
+                released, seats, reopened = release(cur, RELEASE_EXPIRED_WHERE, {"limit": limit})
+                conn.commit()
+                _after_release(seats, reopened)
+                total += released
+                if released < limit:
+                    return total
+        except BaseException:
+            conn.rollback()
+            raise
+        finally:
+            cur.close()
+
+
+async def run_sweeper(interval=HOLD_SWEEP_INTERVAL):
+    """
+    Фоновая задача: раз в interval секунд снимает просроченные удержания и
+    убирает из кэша мест прошедшие рейсы (иначе при большом
+    INVENTORY_MAX_TOURS они остаются в нём до переполнения).
+    """
+    while True:
+        inventory.evict_past()
+        try:
+            await asyncio.to_thread(sweep_expired)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logger.exception("seat hold sweep failed")
+        await asyncio.sleep(interval)
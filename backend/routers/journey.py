@@ -0,0 +1,77 @@
+from datetime import date, time
+
+from fastapi import APIRouter, Depends, HTTPException, Query
+
+from database import get_db
+from journeys import LEG_SEATS_QUERY, MAX_TRANSFERS, MIN_TRANSFER_MINUTES, journey_index
+
+router = APIRouter(prefix="/journeys", tags=["journeys"])
+
+# Сколько раз план пересчитывается без участков, на которых по available
+# мест уже нет (индекс процесса мог не увидеть продажу другого воркера)
+REPLAN_ATTEMPTS = 2
+
+
+@router.get("/")
+def get_journeys(
+    departure_stop_id: int = Query(..., description="Начальная остановка"),
+    arrival_stop_id: int = Query(..., description="Конечная остановка"),
+    date: date = Query(..., description="Дата отправления"),
+    max_transfers: int = Query(2, ge=0, le=MAX_TRANSFERS),
+    min_transfer_minutes: int = Query(MIN_TRANSFER_MINUTES, ge=0, le=24 * 60),
+    departure_after: time = Query(None, description="Отправление не раньше"),
+    limit: int = Query(20, ge=1, le=100),
+    conn=Depends(get_db),
+):
+    """
+    Поездки с пересадками между остановками на дату (см. journeys.py).
+    Каждая поездка — список участков с рейсом, временем и числом свободных мест.
+    """
+    cur = conn.cursor()
+    try:
+        idx = journey_index.get(cur, date)
+        earliest = 0 if departure_after is None else departure_after.hour * 60 + departure_after.minute
+        banned = set()
+        for attempt in range(REPLAN_ATTEMPTS + 1):
+            journeys = idx.plan(departure_stop_id, arrival_stop_id, earliest, max_transfers,
+                                min_transfer_minutes, frozenset(banned))[:limit]
+            legs = {(leg[0], leg[2], leg[3]) for _, _, path in journeys for leg in path}
+            seats = {}
+            if legs:
+                tour_ids, deps, arrs = (list(column) for column in zip(*legs))
+                cur.execute(LEG_SEATS_QUERY, (tour_ids, deps, arrs))
+                seats = {(tour_id, dep, arr): n for tour_id, dep, arr, n in cur.fetchall()}
+            sold_out = {leg for leg in legs if seats.get(leg, 0) <= 0}
+            if not sold_out or attempt == REPLAN_ATTEMPTS:
+                break
+            banned |= sold_out
+
+        result = []
+        for departure, arrival, path in journeys:
+            if any((leg[0], leg[2], leg[3]) in sold_out for leg in path):
+                continue
+            result.append({
+                "departure_time": idx.to_datetime(departure),
+                "arrival_time": idx.to_datetime(arrival),
+                "duration_minutes": arrival - departure,
+                "transfers": len(path) - 1,
+                "legs": [
+                    {
+                        "tour_id": tour_id,
+                        "route_id": route_id,
+                        "departure_stop_id": dep,
+                        "arrival_stop_id": arr,
+                        "departure_time": idx.to_datetime(leg_departure),
+                        "arrival_time": idx.to_datetime(leg_arrival),
+                        "seats": seats[(tour_id, dep, arr)],
+                    }
+                    for tour_id, route_id, dep, arr, leg_departure, leg_arrival in path
+                ],
+            })
+        return result
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+    finally:
+        cur.close()
@@ -1,27 +1,43 @@
-from fastapi import APIRouter, HTTPException
-from database import get_connection
-from models import Prices, PricesCreate
+import csv
+import io
+from itertools import chain
+from fastapi import APIRouter, Body, Depends, HTTPException, Query, Request
+from fastapi.responses import StreamingResponse
+import psycopg2
+from psycopg2 import errors
+import price_matrix
+from cache import invalidate_reports, invalidate_search
+from database import PoolTimeout, connection, get_db
+from fares import fares
+from journeys import journey_index
+from models import Prices, PricesBulkImport, PricesCreate, PricesGenerate
+from rollup import refresh_pricelist_pairs
+from versions import versioned_rows_response
 
 router = APIRouter(prefix="/prices", tags=["prices"])
 
+# Колко реда се четат наведнъж при експорт на ценоразпис
+PRICES_EXPORT_CHUNK = 5000
+
 @router.get("/", response_model=None)
-def get_prices(pricelist_id: int = None):
+def get_prices(request: Request, pricelist_id: int = None, conn=Depends(get_db)):
     """
     GET-запитване, което връща записите от таблицата prices.
     Ако е зададен pricelist_id, връща само цените за него.
     В резултата се връщат допълнителни полета с имена на спирките.
+    ETag-ът зависи и от спирките заради имената им.
     """
-    conn = get_connection()
     cur = conn.cursor()
     if pricelist_id is not None:
-        cur.execute(
+        response = versioned_rows_response(
+            request, cur, ("prices", "stop"),
             """
             SELECT p.id,
                    p.pricelist_id,
                    p.departure_stop_id,
-                   s1.stop_name AS departure_name,
+                   s1.stop_name AS departure_stop_name,
                    p.arrival_stop_id,
-                   s2.stop_name AS arrival_name,
+                   s2.stop_name AS arrival_stop_name,
                    p.price
             FROM prices p
             JOIN stop s1 ON p.departure_stop_id = s1.id
@@ -32,14 +48,15 @@ def get_prices(pricelist_id: int = None):
             (pricelist_id,)
         )
     else:
-        cur.execute(
+        response = versioned_rows_response(
+            request, cur, ("prices", "stop"),
             """
             SELECT p.id,
                    p.pricelist_id,
                    p.departure_stop_id,
-                   s1.stop_name AS departure_name,
+                   s1.stop_name AS departure_stop_name,
                    p.arrival_stop_id,
-                   s2.stop_name AS arrival_name,
+                   s2.stop_name AS arrival_stop_name,
                    p.price
             FROM prices p
             JOIN stop s1 ON p.departure_stop_id = s1.id
@@ -47,30 +64,27 @@ def get_prices(pricelist_id: int = None):
             ORDER BY p.id ASC;
             """
         )
-
-    rows = cur.fetchall()
     cur.close()
-    conn.close()
-
-    result = []
-    for row in rows:
-        result.append({
-            "id": row[0],
-            "pricelist_id": row[1],
-            "departure_stop_id": row[2],
-            "departure_stop_name": row[3],
-            "arrival_stop_id": row[4],
-            "arrival_stop_name": row[5],
-            "price": row[6]
-        })
-    return result
+    return response
+
+def _after_price_change(pricelist_ids, pairs):
+    """
+    Двойките спирки в търсенето (изгледа available) са тези с цена в
+    ценоразписа на рейса, затова промяна на цена сменя и търсенето, и
+    пътуванията с прекачване. Матриците на засегнатите ценоразписи се
+    изхвърлят от кеша на цените (fares.py).
+    """
+    for pricelist_id in set(pricelist_ids):
+        fares.invalidate_pricelist(pricelist_id)
+    invalidate_reports()
+    invalidate_search(pairs)
+    journey_index.reset()
 
 @router.post("/", response_model=Prices)
-def create_price(price_data: PricesCreate):
+def create_price(price_data: PricesCreate, conn=Depends(get_db)):
     """
     Създава нов запис в таблицата prices и връща данните за създадената цена.
     """
-    conn = get_connection()
     cur = conn.cursor()
     try:
         cur.execute(
@@ -87,45 +101,59 @@ def create_price(price_data: PricesCreate):
             )
         )
         new_id = cur.fetchone()[0]
+        refresh_pricelist_pairs(cur, price_data.pricelist_id,
+                                [(price_data.departure_stop_id, price_data.arrival_stop_id)])
         conn.commit()
+        _after_price_change([price_data.pricelist_id],
+                            [(price_data.departure_stop_id, price_data.arrival_stop_id)])
         return {"id": new_id, **price_data.dict()}
+    except errors.UniqueViolation:
+        conn.rollback()
+        raise HTTPException(status_code=409, detail="Price for these stops already exists in the pricelist")
     except Exception as e:
         conn.rollback()
         raise HTTPException(status_code=500, detail=str(e))
     finally:
         cur.close()
-        conn.close()
 
 @router.put("/{price_id}", response_model=Prices)
-def update_price(price_id: int, price_data: PricesCreate):
+def update_price(price_id: int, price_data: PricesCreate, conn=Depends(get_db)):
     """
     Обновява запис в таблицата prices и връща обновената цена.
     """
-    conn = get_connection()
     cur = conn.cursor()
     try:
         cur.execute(
             """
-            UPDATE prices
+            UPDATE prices p
             SET pricelist_id = %s,
                 departure_stop_id = %s,
                 arrival_stop_id = %s,
                 price = %s
-            WHERE id = %s
-            RETURNING id, pricelist_id, departure_stop_id, arrival_stop_id, price;
+            FROM (SELECT pricelist_id, departure_stop_id, arrival_stop_id FROM prices WHERE id = %s) old
+            WHERE p.id = %s
+            RETURNING p.id, p.pricelist_id, p.departure_stop_id, p.arrival_stop_id, p.price,
+                      old.pricelist_id, old.departure_stop_id, old.arrival_stop_id;
             """,
             (
                 price_data.pricelist_id,
                 price_data.departure_stop_id,
                 price_data.arrival_stop_id,
                 price_data.price,
+                price_id,
                 price_id
             )
         )
         updated_row = cur.fetchone()
-        conn.commit()
         if updated_row is None:
+            conn.rollback()
             raise HTTPException(status_code=404, detail="Price not found")
+        # Агрегатите на продажбите се преизчисляват за старата и новата двойка спирки
+        refresh_pricelist_pairs(cur, updated_row[5], [(updated_row[6], updated_row[7])])
+        refresh_pricelist_pairs(cur, updated_row[1], [(updated_row[2], updated_row[3])])
+        conn.commit()
+        _after_price_change([updated_row[1], updated_row[5]],
+                            [(updated_row[2], updated_row[3]), (updated_row[6], updated_row[7])])
         return {
             "id": updated_row[0],
             "pricelist_id": updated_row[1],
@@ -133,33 +161,210 @@ def update_price(price_id: int, price_data: PricesCreate):
             "arrival_stop_id": updated_row[3],
             "price": updated_row[4]
         }
+    except HTTPException:
+        raise
+    except errors.UniqueViolation:
+        conn.rollback()
+        raise HTTPException(status_code=409, detail="Price for these stops already exists in the pricelist")
     except Exception as e:
         conn.rollback()
         raise HTTPException(status_code=500, detail=str(e))
     finally:
         cur.close()
-        conn.close()
 
 @router.delete("/{price_id}")
-def delete_price(price_id: int):
+def delete_price(price_id: int, conn=Depends(get_db)):
     """
     Изтрива запис от таблицата prices и връща информация за изтрития запис.
     """
-    conn = get_connection()
     cur = conn.cursor()
     try:
         cur.execute(
-            "DELETE FROM prices WHERE id = %s RETURNING id;",
+            "DELETE FROM prices WHERE id = %s RETURNING id, pricelist_id, departure_stop_id, arrival_stop_id;",
             (price_id,)
         )
         deleted_row = cur.fetchone()
-        conn.commit()
         if deleted_row is None:
+            conn.rollback()
             raise HTTPException(status_code=404, detail="Price not found")
+        refresh_pricelist_pairs(cur, deleted_row[1], [(deleted_row[2], deleted_row[3])])
+        conn.commit()
+        _after_price_change([deleted_row[1]], [(deleted_row[2], deleted_row[3])])
         return {"deleted_id": deleted_row[0], "detail": "Price deleted"}
+    except HTTPException:
+        raise
+    except Exception as e:
+        conn.rollback()
+        raise HTTPException(status_code=500, detail=str(e))
+    finally:
+        cur.close()
+
+
+def _bulk_merge(conn, pricelist_id, replace, stage):
+    """
+    Общата част на масовото зареждане: stage(cur) попълва временната таблица
+    price_import, след което матрицата се проверява и се слива в prices
+    в същата транзакция (price_matrix.py). Агрегатите на продажбите се
+    преизчисляват само за променените двойки спирки.
+    """
+    cur = conn.cursor()
+    try:
+        cur.execute("SELECT 1 FROM pricelist WHERE id = %s;", (pricelist_id,))
+        if cur.fetchone() is None:
+            raise HTTPException(status_code=404, detail="Pricelist not found")
+        price_matrix.create_staging(cur)
+        stage(cur)
+        problem = price_matrix.validate(cur)
+        if problem:
+            raise HTTPException(status_code=400, detail=problem)
+        counts, pairs = price_matrix.merge(cur, pricelist_id, replace)
+        if pairs:
+            refresh_pricelist_pairs(cur, pricelist_id, pairs)
+        conn.commit()
+        if pairs:
+            _after_price_change([pricelist_id], pairs)
+        return {"pricelist_id": pricelist_id, **counts}
+    except HTTPException:
+        conn.rollback()
+        raise
+    except (psycopg2.DataError, psycopg2.IntegrityError) as e:
+        # Невалиден CSV, липсваща стойност или цена извън numeric(10,2)
+        conn.rollback()
+        raise HTTPException(status_code=400, detail=e.diag.message_primary or str(e))
     except Exception as e:
         conn.rollback()
         raise HTTPException(status_code=500, detail=str(e))
     finally:
         cur.close()
-        conn.close()
+
+@router.post("/bulk")
+def import_prices(data: PricesBulkImport, conn=Depends(get_db)):
+    """
+    Зарежда матрица цени за ценоразпис с една заявка: редовете минават през
+    COPY във временна таблица и се сливат с prices в една транзакция.
+    Ако replace е true, цените, които липсват в матрицата, се изтриват.
+    Връща броя добавени, променени, изтрити и непроменени цени.
+    """
+    rows = [(p.departure_stop_id, p.arrival_stop_id, p.price) for p in data.prices]
+    return _bulk_merge(conn, data.pricelist_id, data.replace,
+                       lambda cur: price_matrix.copy_rows(cur, rows))
+
+@router.post("/bulk/csv")
+def import_prices_csv(
+    pricelist_id: int,
+    replace: bool = False,
+    body: bytes = Body(..., media_type="text/csv"),
+    conn=Depends(get_db)
+):
+    """
+    Същото като POST /prices/bulk, но тялото е CSV със заглавен ред
+    departure_stop_id,arrival_stop_id,price (както го връща GET /prices/bulk).
+    Файлът се подава направо на COPY.
+    """
+    return _bulk_merge(conn, pricelist_id, replace,
+                       lambda cur: price_matrix.copy_csv(cur, body))
+
+@router.post("/bulk/generate")
+def generate_prices(data: PricesGenerate, conn=Depends(get_db)):
+    """
+    Генерира цени за всички двойки спирки на маршрутите: цената е сумата
+    от тарифите на сегментите по пътя, умножена по factor и закръглена до
+    rounding_step (nearest, up или down). Ако за маршрут няма segment_fares,
+    тарифите са текущите цени между съседни спирки в ценоразписа.
+    Така цялата мрежа се преоценява с една заявка.
+    """
+    if data.factor <= 0 or data.rounding_step <= 0:
+        raise HTTPException(status_code=400, detail="factor and rounding_step must be positive")
+    if not data.routes:
+        raise HTTPException(status_code=400, detail="No routes given")
+
+    def stage(cur):
+        stops = price_matrix.route_stops(cur, [r.route_id for r in data.routes])
+        adjacent = []
+        for r in data.routes:
+            route = stops.get(r.route_id)
+            if route is None or len(route) < 2:
+                raise HTTPException(status_code=400, detail=f"Route {r.route_id} must have at least 2 stops.")
+            if r.segment_fares is None:
+                adjacent.extend(zip(route, route[1:]))
+            elif len(r.segment_fares) != len(route) - 1:
+                raise HTTPException(
+                    status_code=400,
+                    detail=f"Route {r.route_id} has {len(route) - 1} segments, got {len(r.segment_fares)} fares"
+                )
+        current = price_matrix.segment_prices(cur, data.pricelist_id, adjacent) if adjacent else {}
+        route_fares = []
+        for r in data.routes:
+            route = stops[r.route_id]
+            segment_fares = r.segment_fares
+            if segment_fares is None:
+                segment_fares = [current.get(pair) for pair in zip(route, route[1:])]
+                if None in segment_fares:
+                    raise HTTPException(
+                        status_code=400,
+                        detail=f"Route {r.route_id}: pricelist has no price between some adjacent stops"
+                    )
+            route_fares.append((r.route_id, segment_fares))
+        price_matrix.generate(cur, route_fares, data.factor, data.rounding_step, data.rounding)
+
+    return _bulk_merge(conn, data.pricelist_id, data.replace, stage)
+
+def _export_chunks(pricelist_id):
+    """
+    Чете цените на ценоразписа на порции през сървърен (именуван) курсор,
+    както експорта на отчета: в паметта има най-много PRICES_EXPORT_CHUNK реда.
+    """
+    with connection() as conn:
+        cur = conn.cursor()
+        try:
+            cur.execute("SELECT 1 FROM pricelist WHERE id = %s;", (pricelist_id,))
+            if cur.fetchone() is None:
+                raise HTTPException(status_code=404, detail="Pricelist not found")
+        finally:
+            cur.close()
+        cur = conn.cursor(name="prices_export")
+        try:
+            cur.execute(price_matrix.EXPORT_QUERY, (pricelist_id,))
+            while True:
+                rows = cur.fetchmany(PRICES_EXPORT_CHUNK)
+                if not rows:
+                    break
+                yield rows
+        finally:
+            cur.close()
+
+def _csv_lines(chunks):
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    writer.writerow(price_matrix.CSV_COLUMNS)
+    for rows in chunks:
+        writer.writerows(rows)
+        yield buf.getvalue().encode("utf-8")
+        buf.seek(0)
+        buf.truncate()
+    if buf.tell():
+        yield buf.getvalue().encode("utf-8")
+
+@router.get("/bulk")
+def export_prices(pricelist_id: int = Query(...)):
+    """
+    Поточен експорт на ценоразпис като CSV (departure_stop_id,arrival_stop_id,price),
+    подреден по двойка спирки. Файлът може да се зареди обратно през POST /prices/bulk/csv.
+    """
+    chunks = _export_chunks(pricelist_id)
+    # Първата порция се чете преди отговора: грешките връщат нормален статус
+    try:
+        first = next(chunks, None)
+    except HTTPException:
+        raise
+    except PoolTimeout as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+    if first is not None:
+        chunks = chain([first], chunks)
+    return StreamingResponse(
+        _csv_lines(chunks),
+        media_type="text/csv; charset=utf-8",
+        headers={"Content-Disposition": f'attachment; filename="prices_{pricelist_id}.csv"'},
+    )
@@ -1,11 +1,26 @@
-from fastapi import APIRouter, HTTPException
+import base64
+import csv
+import io
+import json
+import os
+from itertools import chain
+from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
 from typing import Optional
-from datetime import datetime
-from database import get_connection
+from datetime import date, datetime
+from cache import report_cache
+from fares import fares
+from database import PoolTimeout, connection, get_db
 
 router = APIRouter(prefix="/report", tags=["report"])
 
+# Сколько строк читается из серверного курсора за один раз при выгрузке
+REPORT_EXPORT_CHUNK = int(os.getenv("REPORT_EXPORT_CHUNK", "2000"))
+# Размер страницы деталей отчёта: по умолчанию и максимальный
+REPORT_PAGE_SIZE = 50
+REPORT_MAX_PAGE_SIZE = 500
+
 class ReportFilters(BaseModel):
     start_date: Optional[str] = None
     end_date: Optional[str] = None
@@ -14,8 +29,188 @@ class ReportFilters(BaseModel):
     departure_stop_id: Optional[int] = None
     arrival_stop_id: Optional[int] = None
 
+# Столбцы, к которым применяются фильтры отчёта
+DETAILS_COLUMNS = {
+    "date": "tr.date",
+    "route_id": "r.id",
+    "tour_id": "t.tour_id",
+    "departure_stop_id": "t.departure_stop_id",
+    "arrival_stop_id": "t.arrival_stop_id",
+}
+ROLLUP_COLUMNS = {
+    "date": "sr.date",
+    "route_id": "sr.route_id",
+    "tour_id": "sr.tour_id",
+    "departure_stop_id": "sr.departure_stop_id",
+    "arrival_stop_id": "sr.arrival_stop_id",
+}
+
+def _report_where(filters: ReportFilters, after=None, columns=DETAILS_COLUMNS):
+    """
+    Строит WHERE по фильтрам отчёта.
+    after — позиция (tour_date, ticket_id) последней строки предыдущей
+    страницы: выбираются строки, идущие после неё в порядке tr.date DESC, t.id.
+    columns — DETAILS_COLUMNS (запрос деталей) или ROLLUP_COLUMNS (sales_rollup).
+    Возвращает (where_clause, params).
+    """
+    conditions = []
+    params = []
+
+    # Фильтр по датам
+    try:
+        if filters.start_date:
+            sd = datetime.strptime(filters.start_date, "%Y-%m-%d").date()
+            conditions.append(f"{columns['date']} >= %s")
+            params.append(sd)
+        if filters.end_date:
+            ed = datetime.strptime(filters.end_date, "%Y-%m-%d").date()
+            conditions.append(f"{columns['date']} <= %s")
+            params.append(ed)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Dates must be in YYYY-MM-DD format")
+
+    # Фильтр по маршруту
+    if filters.route_id:
+        conditions.append(f"{columns['route_id']} = %s")
+        params.append(filters.route_id)
+
+    # Фильтр по рейсу
+    if filters.tour_id:
+        conditions.append(f"{columns['tour_id']} = %s")
+        params.append(filters.tour_id)
+
+    # Фильтр по остановкам
+    if filters.departure_stop_id:
+        conditions.append(f"{columns['departure_stop_id']} = %s")
+        params.append(filters.departure_stop_id)
+    if filters.arrival_stop_id:
+        conditions.append(f"{columns['arrival_stop_id']} = %s")
+        params.append(filters.arrival_stop_id)
+
+    # Keyset-пагинация: условие tr.date <= ... позволяет индексу по дате
+    # начать сразу с нужной позиции, а не пропускать предыдущие страницы
+    if after is not None:
+        after_date, after_id = after
+        conditions.append("tr.date <= %s AND (tr.date < %s OR t.id > %s)")
+        params.extend([after_date, after_date, after_id])
+
+    where_clause = ""
+    if conditions:
+        where_clause = "WHERE " + " AND ".join(conditions)
+    return where_clause, tuple(params)
+
+# СВОДКА: кол-во билетов и сумма продаж из агрегатов sales_rollup
+# (обновляются вместе с продажами, см. rollup.py)
+SUMMARY_QUERY = """
+    SELECT
+        COALESCE(SUM(sr.tickets), 0) AS total_tickets,
+        COALESCE(SUM(sr.revenue), 0) AS total_sales
+    FROM sales_rollup sr
+    {where_clause}
+"""
+
+# ДЕТАЛИ:
+# JOIN seat s для seat_num
+# JOIN stop ds/as_ для имён остановок
+# Вместо price выбирается прайс рейса, а в конце — участок билета:
+# цену подставляет _priced из матрицы цен (fares.py), без JOIN с prices;
+# билеты без цены _priced отбрасывает
+DETAILS_QUERY = """
+    SELECT
+        t.id AS ticket_id,
+        t.tour_id,
+        s.seat_num,
+        tr.pricelist_id,
+        p.name AS passenger_name,
+        p.phone AS passenger_phone,
+        p.email AS passenger_email,
+        tr.date AS tour_date,
+        r.name AS route_name,
+        ds.stop_name AS dep_stop_name,
+        as_.stop_name AS arr_stop_name,
+        t.departure_stop_id,
+        t.arrival_stop_id
+    FROM ticket t
+    JOIN tour tr ON t.tour_id = tr.id
+    JOIN route r ON tr.route_id = r.id
+    JOIN seat s ON t.seat_id = s.id
+    LEFT JOIN passenger p ON t.passenger_id = p.id
+    LEFT JOIN stop ds ON ds.id = t.departure_stop_id
+    LEFT JOIN stop as_ ON as_.id = t.arrival_stop_id
+    {where_clause}
+    ORDER BY tr.date DESC, t.id
+"""
+
+TICKET_FIELDS = [
+    "ticket_id", "tour_id", "seat_num", "price",
+    "passenger_name", "passenger_phone", "passenger_email",
+    "tour_date", "route_name", "departure_stop_name", "arrival_stop_name",
+]
+
+def _priced(cur, rows):
+    """
+    Строки DETAILS_QUERY с ценой вместо pricelist_id и без столбцов участка.
+    Билеты, на участок которых в прайсе рейса нет цены, пропускаются — как
+    раньше при JOIN с prices и как в сводке (sales_rollup).
+    Матрица каждого прайса берётся из кэша (при промахе читается через cur).
+    """
+    priced = []
+    matrices = {}
+    for row in rows:
+        matrix = matrices.get(row[3])
+        if matrix is None:
+            matrix = matrices[row[3]] = fares.get(cur, row[3])
+        price = matrix.price(row[11], row[12])
+        if price is not None:
+            priced.append(row[:3] + (price,) + row[4:11])
+    return priced
+
+def _ticket_dict(row):
+    return {
+        "ticket_id": row[0],
+        "tour_id": row[1],
+        "seat_num": row[2],
+        "price": float(row[3]),
+        "passenger_name": row[4],
+        "passenger_phone": row[5],
+        "passenger_email": row[6],
+        "tour_date": row[7].isoformat(),
+        "route_name": row[8],
+        "departure_stop_name": row[9],
+        "arrival_stop_name": row[10]
+    }
+
+def _summary(cur, filters: ReportFilters):
+    """Сводка по фильтрам; результат кэшируется до следующей продажи или смены цен."""
+    key = tuple(sorted(filters.dict().items()))
+    summary = report_cache.get(key)
+    if summary is not None:
+        return summary
+    generation = report_cache.generation
+    where_clause, params = _report_where(filters, columns=ROLLUP_COLUMNS)
+    cur.execute(SUMMARY_QUERY.format(where_clause=where_clause), params)
+    row = cur.fetchone()
+    summary = {
+        "total_tickets": row[0],
+        "total_sales": float(row[1])
+    }
+    report_cache.set(key, summary, generation)
+    return summary
+
+def _encode_cursor(tour_date, ticket_id):
+    raw = json.dumps([tour_date.isoformat(), ticket_id]).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+def _decode_cursor(cursor):
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        tour_date, ticket_id = json.loads(raw)
+        return date.fromisoformat(tour_date), int(ticket_id)
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
 @router.post("/")
-def get_report(filters: ReportFilters):
+def get_report(filters: ReportFilters, conn=Depends(get_db)):
     """
     Генерирует отчёт по проданным билетам с учётом фильтров:
     - Даты (tour.date)
@@ -27,118 +222,153 @@ def get_report(filters: ReportFilters):
     - summary: кол-во билетов, сумма продаж
     - tickets: список билетов с price, seat_num, именами остановок и т.д.
     """
-    conn = get_connection()
     cur = conn.cursor()
 
     try:
-        conditions = []
-        params = []
+        where_clause, params = _report_where(filters)
 
-        # Фильтр по датам
-        if filters.start_date:
-            sd = datetime.strptime(filters.start_date, "%Y-%m-%d").date()
-            conditions.append("tr.date >= %s")
-            params.append(sd)
-        if filters.end_date:
-            ed = datetime.strptime(filters.end_date, "%Y-%m-%d").date()
-            conditions.append("tr.date <= %s")
-            params.append(ed)
+        summary = _summary(cur, filters)
 
-        # Фильтр по маршруту
-        if filters.route_id:
-            conditions.append("r.id = %s")
-            params.append(filters.route_id)
-
-        # Фильтр по рейсу
-        if filters.tour_id:
-            conditions.append("t.tour_id = %s")
-            params.append(filters.tour_id)
-
-        # Фильтр по остановкам
-        if filters.departure_stop_id:
-            conditions.append("t.departure_stop_id = %s")
-            params.append(filters.departure_stop_id)
-        if filters.arrival_stop_id:
-            conditions.append("t.arrival_stop_id = %s")
-            params.append(filters.arrival_stop_id)
-
-        where_clause = ""
-        if conditions:
-            where_clause = "WHERE " + " AND ".join(conditions)
-
-        # СВОДКА: кол-во билетов и сумма продаж
-        # JOIN prices pr для вычисления цены
-        summary_query = f"""
-            SELECT 
-                COUNT(*) AS total_tickets,
-                COALESCE(SUM(pr.price), 0) AS total_sales
-            FROM ticket t
-            JOIN tour tr ON t.tour_id = tr.id
-            JOIN route r ON tr.route_id = r.id
-            JOIN prices pr ON pr.pricelist_id = tr.pricelist_id
-                          AND pr.departure_stop_id = t.departure_stop_id
-                          AND pr.arrival_stop_id = t.arrival_stop_id
-            {where_clause}
-        """
-        cur.execute(summary_query, tuple(params))
-        row = cur.fetchone()
-        summary = {
-            "total_tickets": row[0],
-            "total_sales": float(row[1])
-        }
-
-        # ДЕТАЛИ:
-        # JOIN seat s для seat_num
-        # JOIN stop ds/as_ для имён остановок
-        # JOIN prices pr чтобы получить price
-        details_query = f"""
-            SELECT
-                t.id AS ticket_id,
-                t.tour_id,
-                s.seat_num,
-                pr.price,
-                p.name AS passenger_name,
-                p.phone AS passenger_phone,
-                p.email AS passenger_email,
-                tr.date AS tour_date,
-                r.name AS route_name,
-                ds.stop_name AS dep_stop_name,
-                as_.stop_name AS arr_stop_name
-            FROM ticket t
-            JOIN tour tr ON t.tour_id = tr.id
-            JOIN route r ON tr.route_id = r.id
-            JOIN seat s ON t.seat_id = s.id
-            LEFT JOIN passenger p ON t.passenger_id = p.id
-            LEFT JOIN stop ds ON ds.id = t.departure_stop_id
-            LEFT JOIN stop as_ ON as_.id = t.arrival_stop_id
-            JOIN prices pr ON pr.pricelist_id = tr.pricelist_id
-                           AND pr.departure_stop_id = t.departure_stop_id
-                           AND pr.arrival_stop_id = t.arrival_stop_id
-            {where_clause}
-            ORDER BY tr.date DESC, t.id
-        """
-        cur.execute(details_query, tuple(params))
-        tickets = []
-        for row in cur.fetchall():
-            tickets.append({
-                "ticket_id": row[0],
-                "tour_id": row[1],
-                "seat_num": row[2],
-                "price": float(row[3]),
-                "passenger_name": row[4],
-                "passenger_phone": row[5],
-                "passenger_email": row[6],
-                "tour_date": row[7].isoformat(),
-                "route_name": row[8],
-                "departure_stop_name": row[9],
-                "arrival_stop_name": row[10]
-            })
+        cur.execute(DETAILS_QUERY.format(where_clause=where_clause), params)
+        tickets = [_ticket_dict(row) for row in _priced(cur, cur.fetchall())]
 
         return {"summary": summary, "tickets": tickets}
 
+    except HTTPException:
+        conn.rollback()
+        raise
     except Exception as e:
         conn.rollback()
         raise HTTPException(status_code=500, detail=str(e))
     finally:
         cur.close()
-        conn.close()
+
+@router.post("/summary")
+def get_report_summary(filters: ReportFilters, conn=Depends(get_db)):
+    """
+    Только сводка отчёта (кол-во билетов, сумма продаж) без деталей.
+    UI запрашивает её один раз, а детали листает через POST /report/tickets.
+    """
+    cur = conn.cursor()
+    try:
+        return _summary(cur, filters)
+    except HTTPException:
+        conn.rollback()
+        raise
+    except Exception as e:
+        conn.rollback()
+        raise HTTPException(status_code=500, detail=str(e))
+    finally:
+        cur.close()
+
+@router.post("/tickets")
+def get_report_tickets(
+    filters: ReportFilters,
+    limit: int = Query(REPORT_PAGE_SIZE, ge=1, le=REPORT_MAX_PAGE_SIZE),
+    cursor: Optional[str] = Query(None, description="next_cursor из предыдущей страницы"),
+    conn=Depends(get_db)
+):
+    """
+    Страница деталей отчёта в порядке tr.date DESC, t.id.
+    Пагинация keyset: cursor кодирует (дата рейса, id билета) последней
+    строки, поэтому стоимость страницы не зависит от её номера.
+    Возвращает tickets и next_cursor (None на последней странице).
+    """
+    cur = conn.cursor()
+    try:
+        after = _decode_cursor(cursor) if cursor else None
+        where_clause, params = _report_where(filters, after)
+        cur.execute(DETAILS_QUERY.format(where_clause=where_clause) + " LIMIT %s", params + (limit + 1,))
+        rows = cur.fetchall()
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            next_cursor = _encode_cursor(rows[-1][7], rows[-1][0])
+        # Курсор — по последней прочитанной строке, поэтому страница с
+        # билетами без цены может оказаться короче limit
+        return {"tickets": [_ticket_dict(row) for row in _priced(cur, rows)], "next_cursor": next_cursor}
+    except HTTPException:
+        conn.rollback()
+        raise
+    except Exception as e:
+        conn.rollback()
+        raise HTTPException(status_code=500, detail=str(e))
+    finally:
+        cur.close()
+
+def _fetch_chunks(query, params, chunk_size):
+    """
+    Читает результат запроса порциями через серверный (именованный) курсор:
+    в памяти одновременно находится не больше chunk_size строк.
+    Соединение берётся из пула на время выгрузки и возвращается в него,
+    когда генератор завершён или закрыт (в том числе при обрыве клиента).
+    Цены подставляются через второй, обычный курсор того же соединения.
+    """
+    with connection() as conn:
+        cur = conn.cursor(name="report_export")
+        fares_cur = conn.cursor()
+        try:
+            cur.execute(query, params)
+            while True:
+                rows = cur.fetchmany(chunk_size)
+                if not rows:
+                    break
+                yield _priced(fares_cur, rows)
+        finally:
+            fares_cur.close()
+            cur.close()
+
+def _csv_lines(chunks):
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    writer.writerow(TICKET_FIELDS)
+    for rows in chunks:
+        for row in rows:
+            d = _ticket_dict(row)
+            writer.writerow([d[f] for f in TICKET_FIELDS])
+        yield buf.getvalue().encode("utf-8")
+        buf.seek(0)
+        buf.truncate()
+    if buf.tell():
+        yield buf.getvalue().encode("utf-8")
+
+def _ndjson_lines(chunks):
+    for rows in chunks:
+        yield "".join(
+            json.dumps(_ticket_dict(row), ensure_ascii=False) + "\n" for row in rows
+        ).encode("utf-8")
+
+EXPORT_FORMATS = {
+    "csv": ("text/csv; charset=utf-8", _csv_lines),
+    "ndjson": ("application/x-ndjson", _ndjson_lines),
+}
+
+@router.post("/export")
+def export_report(
+    filters: ReportFilters,
+    format: str = Query("csv", pattern="^(csv|ndjson)$", description="csv или ndjson"),
+):
+    """
+    Потоковая выгрузка проданных билетов с теми же фильтрами, что и POST /report/.
+    Строки читаются из серверного курсора порциями по REPORT_EXPORT_CHUNK и
+    сразу отправляются клиенту, поэтому память не зависит от размера отчёта.
+    """
+    where_clause, params = _report_where(filters)
+    chunks = _fetch_chunks(DETAILS_QUERY.format(where_clause=where_clause), params, REPORT_EXPORT_CHUNK)
+    # Первую порцию читаем до начала ответа: ошибки пула и запроса
+    # возвращаются обычным кодом ответа, а не обрывом потока
+    try:
+        first = next(chunks, None)
+    except PoolTimeout as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+    if first is not None:
+        chunks = chain([first], chunks)
+
+    media_type, render = EXPORT_FORMATS[format]
+    return StreamingResponse(
+        render(chunks),
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="report.{format}"'},
+    )
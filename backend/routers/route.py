@@ -1,9 +1,13 @@
 # file: route.py
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Request
 from typing import Optional, List
 from datetime import time
 from pydantic import BaseModel
-from database import get_connection  # Предполагается, что у вас есть database.py
+from cache import search_cache
+from database import get_db  # Предполагается, что у вас есть database.py
+from inventory import inventory
+from topology import topology
+from versions import versioned_rows_response
 
 router = APIRouter(prefix="/routes", tags=["routes"])
 
@@ -36,43 +40,47 @@ class RouteStop(BaseModel):
     class Config:
         from_attributes = True
 
+def _invalidate_route(route_id):
+    """
+    Сбрасывает кэшированную топологию маршрута, занятость его рейсов и
+    результаты поиска: представление available строится по остановкам
+    маршрута (route_pair), поэтому от них зависят пары и число мест.
+    """
+    topology.invalidate_route(route_id)
+    inventory.invalidate_route(route_id)
+    search_cache.clear()
+
 #
 # --- Часть 1: CRUD для маршрутов (Route) ---
 #
 
 @router.get("/", response_model=List[Route])
-def get_routes():
+def get_routes(request: Request, conn=Depends(get_db)):
     """
     Получить список всех маршрутов
     """
-    conn = get_connection()
     cur = conn.cursor()
-    cur.execute("SELECT id, name FROM route ORDER BY id ASC;")
-    rows = cur.fetchall()
+    response = versioned_rows_response(request, cur, ("route",), "SELECT id, name FROM route ORDER BY id ASC;")
     cur.close()
-    conn.close()
-    return [{"id": r[0], "name": r[1]} for r in rows]
+    return response
 
 @router.post("/", response_model=Route)
-def create_route(route_data: RouteCreate):
+def create_route(route_data: RouteCreate, conn=Depends(get_db)):
     """
     Создать новый маршрут
     """
-    conn = get_connection()
     cur = conn.cursor()
     cur.execute("INSERT INTO route (name) VALUES (%s) RETURNING id;", (route_data.name,))
     new_id = cur.fetchone()[0]
     conn.commit()
     cur.close()
-    conn.close()
     return {"id": new_id, "name": route_data.name}
 
 @router.delete("/{route_id}")
-def delete_route(route_id: int):
+def delete_route(route_id: int, conn=Depends(get_db)):
     """
     Удалить маршрут по ID (и при необходимости его остановки)
     """
-    conn = get_connection()
     cur = conn.cursor()
     # Если у вас нет CASCADE, можно удалить остановки вручную:
     # cur.execute("DELETE FROM routestop WHERE route_id = %s;", (route_id,))
@@ -80,9 +88,9 @@ def delete_route(route_id: int):
     deleted = cur.fetchone()
     conn.commit()
     cur.close()
-    conn.close()
     if not deleted:
         raise HTTPException(status_code=404, detail="Route not found")
+    _invalidate_route(route_id)
     return {"deleted_id": deleted[0], "detail": "Route deleted"}
 
 #
@@ -91,40 +99,26 @@ def delete_route(route_id: int):
 #
 
 @router.get("/{route_id}/stops", response_model=List[RouteStop])
-def get_route_stops(route_id: int):
+def get_route_stops(route_id: int, request: Request, conn=Depends(get_db)):
     """
     Получить список остановок (RouteStop) для данного маршрута
     """
-    conn = get_connection()
     cur = conn.cursor()
-    cur.execute(
+    response = versioned_rows_response(
+        request, cur, ("routestop",),
         'SELECT id, route_id, stop_id, "order", arrival_time, departure_time '
         'FROM routestop WHERE route_id=%s ORDER BY "order" ASC;',
         (route_id,)
     )
-    rows = cur.fetchall()
     cur.close()
-    conn.close()
-
-    result = []
-    for r in rows:
-        result.append({
-            "id": r[0],
-            "route_id": r[1],
-            "stop_id": r[2],
-            "order": r[3],
-            "arrival_time": r[4],     # это уже Python time
-            "departure_time": r[5]    # тоже time
-        })
-    return result
+    return response
 
 @router.post("/{route_id}/stops", response_model=RouteStop)
-def create_route_stop(route_id: int, data: RouteStopCreate):
+def create_route_stop(route_id: int, data: RouteStopCreate, conn=Depends(get_db)):
     """
     Добавить новую остановку (RouteStop) в маршрут {route_id}.
     arrival_time, departure_time - тип time, приходят в формате "HH:MM" или "HH:MM:SS".
     """
-    conn = get_connection()
     cur = conn.cursor()
     cur.execute(
         'INSERT INTO routestop (route_id, stop_id, "order", arrival_time, departure_time) '
@@ -134,7 +128,7 @@ def create_route_stop(route_id: int, data: RouteStopCreate):
     new_id = cur.fetchone()[0]
     conn.commit()
     cur.close()
-    conn.close()
+    _invalidate_route(route_id)
     return {
         "id": new_id,
         "route_id": route_id,
@@ -145,11 +139,10 @@ def create_route_stop(route_id: int, data: RouteStopCreate):
     }
 
 @router.put("/{route_id}/stops/{stop_id}", response_model=RouteStop)
-def update_route_stop(route_id: int, stop_id: int, data: RouteStopCreate):
+def update_route_stop(route_id: int, stop_id: int, data: RouteStopCreate, conn=Depends(get_db)):
     """
     Обновить остановку (arrival_time, departure_time, order, stop_id)
     """
-    conn = get_connection()
     cur = conn.cursor()
     cur.execute(
         'UPDATE routestop SET stop_id=%s, "order"=%s, arrival_time=%s, departure_time=%s '
@@ -160,9 +153,9 @@ def update_route_stop(route_id: int, stop_id: int, data: RouteStopCreate):
     row = cur.fetchone()
     conn.commit()
     cur.close()
-    conn.close()
     if not row:
         raise HTTPException(status_code=404, detail="RouteStop not found or route mismatch")
+    _invalidate_route(route_id)
     return {
         "id": row[0],
         "route_id": row[1],
@@ -173,17 +166,16 @@ def update_route_stop(route_id: int, stop_id: int, data: RouteStopCreate):
     }
 
 @router.delete("/{route_id}/stops/{stop_id}")
-def delete_route_stop(route_id: int, stop_id: int):
+def delete_route_stop(route_id: int, stop_id: int, conn=Depends(get_db)):
     """
     Удалить остановку (RouteStop) из маршрута
     """
-    conn = get_connection()
     cur = conn.cursor()
     cur.execute("DELETE FROM routestop WHERE id=%s AND route_id=%s RETURNING id;", (stop_id, route_id))
     deleted = cur.fetchone()
     conn.commit()
     cur.close()
-    conn.close()
     if not deleted:
         raise HTTPException(status_code=404, detail="RouteStop not found or mismatch route")
+    _invalidate_route(route_id)
     return {"deleted_id": deleted[0], "detail": "RouteStop deleted"}
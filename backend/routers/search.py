@@ -1,63 +1,85 @@
 from fastapi import APIRouter, Query
-from database import get_connection
+from cache import search_cache
+from database_async import async_connection, fetchall
 
 router = APIRouter(prefix="/search", tags=["search"])
 
-@router.get("/departures")
-def get_departures():
-    conn = get_connection()
-    cur = conn.cursor()
+# Результаты кэшируются в cache.search_cache и сбрасываются обработчиками
+# записи (билеты, рейсы, цены, спирки) через cache.invalidate_search;
+# изменение остановок маршрута сбрасывает кэш целиком (routers/route.py).
+
+# Запросы общие для синхронного и асинхронного пути. available —
+# представление над tour_availability (migrations/0009): число мест на
+# участке считается при чтении, поэтому остановки проверяются по одной
+# подзапросом EXISTS, который останавливается на первом рейсе с местами
+# (OFFSET 0 не даёт планировщику развернуть его в соединение по всем рейсам).
+DEPARTURES_QUERY = """
+    SELECT s.id, s.stop_name FROM stop s
+    WHERE s.id IN (SELECT stop_id FROM routestop)
+    AND EXISTS (
+        SELECT 1 FROM available a
+        WHERE a.departure_stop_id = s.id AND a.seats > 0
+        OFFSET 0
+    )
+"""
 
-    cur.execute("""
-        SELECT DISTINCT departure_stop_id FROM available WHERE seats > 0
-    """)
-    departure_stops = [row[0] for row in cur.fetchall()]
+ARRIVALS_QUERY = """
+    SELECT s.id, s.stop_name FROM stop s
+    WHERE s.id IN (
+        SELECT a.stop_id FROM routestop d
+        JOIN routestop a ON a.route_id = d.route_id AND a."order" > d."order"
+        WHERE d.stop_id = %(departure_stop_id)s
+    )
+    AND EXISTS (
+        SELECT 1 FROM available a
+        WHERE a.departure_stop_id = %(departure_stop_id)s AND a.arrival_stop_id = s.id AND a.seats > 0
+        OFFSET 0
+    )
+"""
 
-    if departure_stops:
-        cur.execute("SELECT id, stop_name FROM stop WHERE id = ANY(%s)", (departure_stops,))
-        stops_list = [{"id": row[0], "stop_name": row[1]} for row in cur.fetchall()]
-    else:
-        stops_list = []
+DATES_QUERY = """
+    SELECT DISTINCT t.date
+    FROM tour t
+    JOIN available a ON a.tour_id = t.id
+    WHERE a.departure_stop_id = %s AND a.arrival_stop_id = %s AND a.seats > 0
+    ORDER BY t.date
+"""
 
-    cur.close()
-    conn.close()
-    return stops_list
+@router.get("/departures")
+async def get_departures():
+    key = ("departures",)
+    cached = search_cache.get(key)
+    if cached is not None:
+        return cached
+    generation = search_cache.generation
+    async with async_connection() as conn:
+        rows = await fetchall(conn, DEPARTURES_QUERY)
+    result = [{"id": row[0], "stop_name": row[1]} for row in rows]
+    search_cache.set(key, result, generation)
+    return result
 
 @router.get("/arrivals")
-def get_arrivals(departure_stop_id: int = Query(...)):
-    conn = get_connection()
-    cur = conn.cursor()
-
-    cur.execute("""
-        SELECT DISTINCT arrival_stop_id FROM available
-        WHERE departure_stop_id = %s AND seats > 0
-    """, (departure_stop_id,))
-    arrival_stops = [row[0] for row in cur.fetchall()]
-
-    if arrival_stops:
-        cur.execute("SELECT id, stop_name FROM stop WHERE id = ANY(%s)", (arrival_stops,))
-        stops_list = [{"id": row[0], "stop_name": row[1]} for row in cur.fetchall()]
-    else:
-        stops_list = []
-
-    cur.close()
-    conn.close()
-    return stops_list
+async def get_arrivals(departure_stop_id: int = Query(...)):
+    key = ("arrivals", departure_stop_id)
+    cached = search_cache.get(key)
+    if cached is not None:
+        return cached
+    generation = search_cache.generation
+    async with async_connection() as conn:
+        rows = await fetchall(conn, ARRIVALS_QUERY, {"departure_stop_id": departure_stop_id})
+    result = [{"id": row[0], "stop_name": row[1]} for row in rows]
+    search_cache.set(key, result, generation)
+    return result
 
 @router.get("/dates")
-def get_dates(departure_stop_id: int, arrival_stop_id: int):
-    conn = get_connection()
-    cur = conn.cursor()
-
-    cur.execute("""
-        SELECT DISTINCT t.date
-        FROM tour t
-        JOIN available a ON a.tour_id = t.id
-        WHERE a.departure_stop_id = %s AND a.arrival_stop_id = %s AND a.seats > 0
-        ORDER BY t.date
-    """, (departure_stop_id, arrival_stop_id))
-    dates = [row[0] for row in cur.fetchall()]
-
-    cur.close()
-    conn.close()
-    return dates
+async def get_dates(departure_stop_id: int, arrival_stop_id: int):
+    key = ("dates", departure_stop_id, arrival_stop_id)
+    cached = search_cache.get(key)
+    if cached is not None:
+        return cached
+    generation = search_cache.generation
+    async with async_connection() as conn:
+        rows = await fetchall(conn, DATES_QUERY, (departure_stop_id, arrival_stop_id))
+    result = [row[0] for row in rows]
+    search_cache.set(key, result, generation)
+    return result
@@ -1,101 +1,109 @@
-from fastapi import APIRouter, HTTPException, Query
-from database import get_connection
+from fastapi import APIRouter, Depends, HTTPException, Query, WebSocket, WebSocketException, status
+import availability
+from cache import invalidate_search
+from database import PoolTimeout, get_db
+from inventory import inventory
+import seat_events
+from topology import topology
 
 router = APIRouter(prefix="/seat", tags=["seat"])
 
 @router.get("/")
-def get_seat_layout(
+async def get_seat_layout(
     tour_id: int = Query(..., description="ID рейса"),
     departure_stop_id: int = Query(..., description="ID отправной остановки"),
     arrival_stop_id: int = Query(..., description="ID конечной остановки")
 ):
     """
     Возвращает схему мест для заданного рейса и сегмента маршрута.
+    Ответ строится из кэша занятости (inventory.py), в БД запрос идёт
+    только при первой загрузке рейса.
     Состояния:
-      - "blocked": если место заблокировано (available = "0")
-      - "occupied": если место занято (есть билет)
+      - "blocked": если место заблокировано (blocked = true)
+      - "occupied": если место занято хотя бы на одном сегменте поездки
+      - "held": если сегменты поездки заняты только временными удержаниями
+        (routers/hold.py) и место может освободиться
       - "available": если место активно и свободно
     """
-    conn = get_connection()
-    cur = conn.cursor()
     try:
-        # 1. Получаем все места для данного рейса
-        cur.execute("""
-            SELECT seat_num, available
-            FROM seat
-            WHERE tour_id = %s
-            ORDER BY seat_num
-        """, (tour_id,))
-        seats_data = cur.fetchall()
-
-        # 2. Получаем занятые места (из таблицы ticket) для выбранного сегмента
-        cur.execute("""
-            SELECT s.seat_num
-            FROM ticket t
-            JOIN seat s ON s.id = t.seat_id
-            WHERE t.tour_id = %s
-              AND t.departure_stop_id <= %s
-              AND t.arrival_stop_id >= %s
-        """, (tour_id, departure_stop_id, arrival_stop_id))
-        booked_seats = {row[0] for row in cur.fetchall()}
-
-        # 3. Формируем ответ для каждого места:
-        #    Если available == "0" -> "blocked"
-        #    Если seat_num в booked_seats -> "occupied"
-        #    Иначе -> "available"
-        layout = []
-        for seat_num, available_str in seats_data:
-            if available_str == "0":
-                status = "blocked"
-            elif seat_num in booked_seats:
-                status = "occupied"
-            else:
-                status = "available"
-            layout.append({
-                "seat_num": seat_num,
-                "status": status
-            })
-
-        return {"seats": layout}
+        inv = await inventory.aget(tour_id)
+    except PoolTimeout as e:
+        raise HTTPException(status_code=503, detail=str(e))
     except Exception as e:
-        conn.rollback()
         raise HTTPException(status_code=500, detail=str(e))
-    finally:
-        cur.close()
-        conn.close()
+    if inv is None:
+        raise HTTPException(status_code=404, detail="Tour not found")
+    span = inv.segment_range(departure_stop_id, arrival_stop_id)
+    if span is None:
+        raise HTTPException(status_code=400, detail="Invalid segment for this tour")
+    return {"seats": inv.seat_map(*span), "free_seats": inv.free_count(*span)}
+
+@router.websocket("/ws")
+async def seat_layout_updates(
+    websocket: WebSocket,
+    tour_id: int = Query(..., description="ID рейса"),
+    departure_stop_id: int = Query(..., description="ID отправной остановки"),
+    arrival_stop_id: int = Query(..., description="ID конечной остановки")
+):
+    """
+    Схема мест рейса на участке с обновлениями в реальном времени вместо
+    повторных запросов GET /seat/: сначала снимок, затем изменения
+    (формат сообщений — в seat_events.py).
+    """
+    try:
+        subscription = await seat_events.broker.subscribe(tour_id, departure_stop_id, arrival_stop_id)
+    except PoolTimeout as e:
+        raise WebSocketException(code=status.WS_1013_TRY_AGAIN_LATER, reason=str(e))
+    if subscription is None:
+        raise WebSocketException(code=status.WS_1008_POLICY_VIOLATION, reason="Tour or segment not found")
+    channel, subscriber = subscription
+    try:
+        await websocket.accept()
+    except BaseException:
+        seat_events.broker.unsubscribe(channel, subscriber)
+        raise
+    await seat_events.serve(websocket, channel, subscriber)
 
 @router.put("/block")
 def block_seat(
     tour_id: int,
     seat_num: int,
-    block: bool = Query(..., description="true для блокировки, false для разблокировки")
+    block: bool = Query(..., description="true для блокировки, false для разблокировки"),
+    conn=Depends(get_db)
 ):
     """
-    Меняет состояние места: блокирует (available = "0") или разблокирует (восстанавливает full available string).
-    Для примера при разблокировке восстанавливается значение "1234" – в реальном применении оно должно вычисляться на основе маршрута.
+    Меняет состояние места: блокирует или разблокирует его для продажи.
+    Маска свободных сегментов при этом не меняется, поэтому уже проданные
+    сегменты остаются проданными и после разблокировки.
     """
-    conn = get_connection()
     cur = conn.cursor()
     try:
-        if block:
-            new_value = "0"
-        else:
-            # Восстанавливаем значение, например, "1234". (Это значение нужно вычислить в зависимости от маршрута)
-            new_value = "1234"
         cur.execute("""
             UPDATE seat
-            SET available = %s
+            SET blocked = %s
             WHERE tour_id = %s AND seat_num = %s
-            RETURNING seat_num, available;
-        """, (new_value, tour_id, seat_num))
+            RETURNING seat_num, available, blocked, held;
+        """, (block, tour_id, seat_num))
         row = cur.fetchone()
         if not row:
             raise HTTPException(status_code=404, detail="Место не найдено")
+        segment_seats = availability.update_seats(cur, tour_id, [row])
+        # Участки, на которых место свободно целиком: при блокировке на них
+        # могут закончиться места, при разблокировке — появиться
+        route = topology.for_tour(cur, tour_id)
+        covered = route.pairs_losing_seat(row[1], row[1]) if segment_seats is not None else []
+        counts = availability.pair_counts(route, segment_seats, covered) if covered else {}
+        changed = [pair for pair, seats in counts.items() if seats == (0 if block else 1)]
         conn.commit()
-        return {"seat_num": row[0], "available": row[1]}
+        inventory.update_seats(tour_id, [row])
+        if changed:
+            invalidate_search(changed)
+        return {"seat_num": row[0], "available": row[1], "blocked": row[2]}
+    except HTTPException:
+        conn.rollback()
+        raise
     except Exception as e:
         conn.rollback()
         raise HTTPException(status_code=500, detail=str(e))
     finally:
         cur.close()
-        conn.close()
@@ -1,46 +1,39 @@
-from fastapi import APIRouter, HTTPException
-from database import get_connection
+from fastapi import APIRouter, Depends, HTTPException, Request
+from cache import search_cache
+from database import get_db
 from models import Stop, StopCreate
+from versions import versioned_rows_response
 
 router = APIRouter(prefix="/stops", tags=["stops"])
 
 @router.get("/", response_model=list[Stop])
-def get_stops():
-    conn = get_connection()
+def get_stops(request: Request, conn=Depends(get_db)):
     cur = conn.cursor()
-    cur.execute("SELECT id, stop_name FROM stop ORDER BY id ASC;")
-    rows = cur.fetchall()
+    response = versioned_rows_response(request, cur, ("stop",), "SELECT id, stop_name FROM stop ORDER BY id ASC;")
     cur.close()
-    conn.close()
-    stops_list = [{"id": row[0], "stop_name": row[1]} for row in rows]
-    return stops_list
+    return response
 
 @router.post("/", response_model=Stop)
-def create_stop(stop_data: StopCreate):
-    conn = get_connection()
+def create_stop(stop_data: StopCreate, conn=Depends(get_db)):
     cur = conn.cursor()
     cur.execute("INSERT INTO stop (stop_name) VALUES (%s) RETURNING id;", (stop_data.stop_name,))
     new_id = cur.fetchone()[0]
     conn.commit()
     cur.close()
-    conn.close()
     return {"id": new_id, "stop_name": stop_data.stop_name}
 
 @router.get("/{stop_id}", response_model=Stop)
-def get_stop(stop_id: int):
-    conn = get_connection()
+def get_stop(stop_id: int, conn=Depends(get_db)):
     cur = conn.cursor()
     cur.execute("SELECT id, stop_name FROM stop WHERE id = %s;", (stop_id,))
     row = cur.fetchone()
     cur.close()
-    conn.close()
     if row is None:
         raise HTTPException(status_code=404, detail="Stop not found")
     return {"id": row[0], "stop_name": row[1]}
 
 @router.put("/{stop_id}", response_model=Stop)
-def update_stop(stop_id: int, stop_data: StopCreate):
-    conn = get_connection()
+def update_stop(stop_id: int, stop_data: StopCreate, conn=Depends(get_db)):
     cur = conn.cursor()
     cur.execute(
         "UPDATE stop SET stop_name = %s WHERE id = %s RETURNING id, stop_name;",
@@ -49,20 +42,20 @@ def update_stop(stop_id: int, stop_data: StopCreate):
     updated_row = cur.fetchone()
     conn.commit()
     cur.close()
-    conn.close()
+    # Названия спирок входят в ответы поиска
+    search_cache.clear()
     if updated_row is None:
         raise HTTPException(status_code=404, detail="Stop not found")
     return {"id": updated_row[0], "stop_name": updated_row[1]}
 
 @router.delete("/{stop_id}")
-def delete_stop(stop_id: int):
-    conn = get_connection()
+def delete_stop(stop_id: int, conn=Depends(get_db)):
     cur = conn.cursor()
     cur.execute("DELETE FROM stop WHERE id = %s RETURNING id;", (stop_id,))
     deleted_row = cur.fetchone()
     conn.commit()
     cur.close()
-    conn.close()
+    search_cache.clear()
     if deleted_row is None:
         raise HTTPException(status_code=404, detail="Stop not found")
     return {"deleted_id": deleted_row[0], "detail": "Stop deleted"}
@@ -1,9 +1,29 @@
-from fastapi import APIRouter, HTTPException
+import logging
+import os
+from typing import List
+from fastapi import APIRouter, Depends, HTTPException
+import psycopg2
+from psycopg2 import errors
 from pydantic import BaseModel
-from database import get_connection
+import availability
+from cache import invalidate_reports, invalidate_search
+from database import get_db
+from inventory import inventory
+from rollup import record_sale
+from topology import topology
 
 router = APIRouter(prefix="/tickets", tags=["tickets"])
 
+logger = logging.getLogger(__name__)
+
+# Как продаётся один билет (POST /tickets/):
+#   python — запросами из create_ticket;
+#   sql    — функцией book_ticket (migrations/0008_book_ticket_function.sql),
+#            один запрос к БД на продажу. Если функции нет в базе, эта
+#            продажа выполняется на Python (настройка не меняется: после
+#            применения миграций функция используется без перезапуска).
+BOOKING_ENGINE = os.getenv("BOOKING_ENGINE", "python")
+
 class TicketCreate(BaseModel):
     tour_id: int
     seat_num: int
@@ -12,50 +32,318 @@ class TicketCreate(BaseModel):
     passenger_email: str = None
     departure_stop_id: int
     arrival_stop_id: int
+    # Токен удержания места (POST /holds/): удержанное место выкупается
+    hold_token: str = None
+
+class BatchTicket(BaseModel):
+    seat_num: int
+    passenger_name: str
+    passenger_phone: str = None
+    passenger_email: str = None
+
+class TicketBatchCreate(BaseModel):
+    tour_id: int
+    departure_stop_id: int
+    arrival_stop_id: int
+    tickets: List[BatchTicket]
+    hold_token: str = None
+
+# Не больше мест, чем в самом большом автобусе
+MAX_BATCH_TICKETS = 48
+
+# Проверка и бронирование сегментов места одной операцией:
+# место обновляется, только если все сегменты поездки ещё свободны.
+# Параллельный UPDATE той же строки ждёт первую транзакцию и заново
+# проверяет условие WHERE, поэтому продать сегмент дважды нельзя.
+# Маска сегментов поездки считается заранее по топологии маршрута (topology.py).
+BOOK_SEAT_QUERY = """
+    UPDATE seat
+    SET available = available & ~%(mask)s::bigint
+    WHERE tour_id = %(tour_id)s
+      AND seat_num = %(seat_num)s
+      AND NOT blocked
+      AND available & %(mask)s::bigint = %(mask)s::bigint
+    RETURNING id, seat_num, available, blocked, held
+"""
+
+# Выкуп удержанных мест: удержание с токеном покупателя на тот же участок
+# удаляется, сегменты места уже сняты с продажи при удержании (и в
+# tour_availability), поэтому с места снимается только отметка held.
+# Истёкшее удержание не выкупается, даже если очистка ещё не удалила его.
+TAKE_HOLDS_QUERY = """
+    WITH taken AS (
+        DELETE FROM seat_hold
+        WHERE token = %(hold_token)s
+          AND tour_id = %(tour_id)s
+          AND seat_num = ANY(%(seat_nums)s)
+          AND mask = %(mask)s
+          AND expires_at > now()
+        RETURNING seat_id, mask
+    )
+    UPDATE seat s
+    SET held = s.held & ~taken.mask
+    FROM taken
+    WHERE s.id = taken.seat_id
+    RETURNING s.id, s.seat_num, s.available, s.blocked, s.held
+"""
+
+# Групповое бронирование: все места группы одним UPDATE. Строки мест
+# блокируются в порядке seat_num, чтобы пересекающиеся группы не
+# попадали во взаимную блокировку; условие WHERE перепроверяется на
+# последней версии строки так же, как в BOOK_SEAT_QUERY.
+BOOK_SEATS_QUERY = """
+    WITH locked AS (
+        SELECT id FROM seat
+        WHERE tour_id = %(tour_id)s AND seat_num = ANY(%(seat_nums)s)
+        ORDER BY seat_num
+        FOR UPDATE
+    )
+    UPDATE seat s
+    SET available = s.available & ~%(mask)s::bigint
+    FROM locked
+    WHERE s.id = locked.id
+      AND NOT s.blocked
+      AND s.available & %(mask)s::bigint = %(mask)s::bigint
+    RETURNING s.id, s.seat_num, s.available, s.blocked, s.held
+"""
+
+SEATS_STATE_QUERY = """
+    SELECT seat_num, blocked, held & %(mask)s::bigint <> 0
+    FROM seat
+    WHERE tour_id = %(tour_id)s AND seat_num = ANY(%(seat_nums)s)
+"""
+
+# Пассажиры и билеты группы одним запросом: id пассажиров берутся из
+# последовательности заранее, чтобы связать каждого с его местом.
+INSERT_GROUP_QUERY = """
+    WITH input AS (
+        SELECT nextval(pg_get_serial_sequence('passenger', 'id')) AS passenger_id, i.*
+        FROM unnest(%(seat_ids)s::int[], %(names)s::varchar[], %(phones)s::varchar[], %(emails)s::varchar[])
+             WITH ORDINALITY AS i(seat_id, name, phone, email, n)
+    ), passengers AS (
+        INSERT INTO passenger (id, name, phone, email)
+        SELECT passenger_id, name, phone, email FROM input
+    )
+    INSERT INTO ticket (tour_id, seat_id, passenger_id, departure_stop_id, arrival_stop_id)
+    SELECT %(tour_id)s, seat_id, passenger_id, %(departure_stop_id)s, %(arrival_stop_id)s
+    FROM input
+    ORDER BY n
+    RETURNING id, seat_id, passenger_id
+"""
+
+BOOK_TICKET_QUERY = """
+    SELECT ticket_id, passenger_id, seat_num, available, blocked, held, sold_out_deps, sold_out_arrs
+    FROM book_ticket(%(tour_id)s, %(seat_num)s, %(departure_stop_id)s, %(arrival_stop_id)s,
+                     %(passenger_name)s, %(passenger_phone)s, %(passenger_email)s, %(hold_token)s)
+"""
+
+
+def book_ticket_installed(cur):
+    """Есть ли в базе функция book_ticket (нужна для BOOKING_ENGINE=sql)."""
+    cur.execute("SELECT to_regproc('book_ticket') IS NOT NULL;")
+    return cur.fetchone()[0]
+
+
+def _book_in_database(ticket, conn):
+    """
+    Продажа функцией book_ticket. None, если функции нет в базе (миграция
+    не применена): тогда вызывающий продаёт этот билет на Python.
+    """
+    cur = conn.cursor()
+    try:
+        cur.execute(BOOK_TICKET_QUERY, ticket.dict())
+        ticket_id, passenger_id, *seat_state, sold_out_deps, sold_out_arrs = cur.fetchone()
+        conn.commit()
+        inventory.update_seats(ticket.tour_id, [tuple(seat_state)])
+        invalidate_reports()
+        if sold_out_deps:
+            invalidate_search(list(zip(sold_out_deps, sold_out_arrs)))
+        return {"ticket_id": ticket_id, "passenger_id": passenger_id}
+
+    except errors.UndefinedFunction:
+        conn.rollback()
+        logger.warning("book_ticket() is missing, apply migrations; booking this ticket with BOOKING_ENGINE=python")
+        return None
+    except (errors.CheckViolation, errors.SerializationFailure, errors.DeadlockDetected) as e:
+        conn.rollback()
+        raise HTTPException(status_code=409, detail=f"Booking conflict, please retry: {e.pgerror or e}")
+    except psycopg2.Error as e:
+        conn.rollback()
+        # Отказы функции: SQLSTATE BK<статус> с текстом ответа
+        if e.pgcode and e.pgcode.startswith("BK"):
+            raise HTTPException(status_code=int(e.pgcode[2:]), detail=e.diag.message_primary)
+        raise HTTPException(status_code=500, detail=str(e))
+    except Exception as e:
+        conn.rollback()
+        raise HTTPException(status_code=500, detail=str(e))
+    finally:
+        cur.close()
+
 
 @router.post("/")
-def create_ticket(ticket: TicketCreate):
-    conn = get_connection()
+def create_ticket(ticket: TicketCreate, conn=Depends(get_db)):
+    if BOOKING_ENGINE == "sql":
+        result = _book_in_database(ticket, conn)
+        if result is not None:
+            return result
     cur = conn.cursor()
     try:
+        route = topology.for_tour(cur, ticket.tour_id)
+        if route is None:
+            raise HTTPException(status_code=404, detail="Tour not found")
+        mask = route.mask(ticket.departure_stop_id, ticket.arrival_stop_id)
+        if mask is None:
+            raise HTTPException(status_code=400, detail="Invalid segment for this tour")
+        params = {"tour_id": ticket.tour_id, "seat_num": ticket.seat_num, "mask": mask}
+
+        booked = None
+        if ticket.hold_token:
+            cur.execute(TAKE_HOLDS_QUERY, {**params, "seat_nums": [ticket.seat_num], "hold_token": ticket.hold_token})
+            booked = cur.fetchone()
+        from_hold = booked is not None
+        if not from_hold:
+            cur.execute(BOOK_SEAT_QUERY, params)
+            booked = cur.fetchone()
+            if not booked:
+                availability.refuse_seat(cur, params)
+        seat_id = booked[0]
+        seat_state = booked[1:]
+
         cur.execute("""
             INSERT INTO passenger (name, phone, email)
             VALUES (%s, %s, %s) RETURNING id;
         """, (ticket.passenger_name, ticket.passenger_phone, ticket.passenger_email))
         passenger_id = cur.fetchone()[0]
 
-        cur.execute("SELECT id, available FROM seat WHERE tour_id=%s AND seat_num=%s;",
-                    (ticket.tour_id, ticket.seat_num))
-        seat_data = cur.fetchone()
-        if not seat_data:
-            raise HTTPException(status_code=404, detail="Seat not found")
-
-        seat_id, available = seat_data
-        segments_to_book = set(range(ticket.departure_stop_id, ticket.arrival_stop_id))
-
-        if not all(str(seg) in available for seg in segments_to_book):
-            raise HTTPException(status_code=400, detail="Seat already booked for selected segments")
-
-        for segment in segments_to_book:
-            available = available.replace(str(segment), "")
-        cur.execute("UPDATE seat SET available=%s WHERE id=%s;", (available, seat_id))
-
         cur.execute("""
             INSERT INTO ticket (tour_id, seat_id, passenger_id, departure_stop_id, arrival_stop_id)
             VALUES (%s, %s, %s, %s, %s) RETURNING id;
         """, (ticket.tour_id, seat_id, passenger_id, ticket.departure_stop_id, ticket.arrival_stop_id))
+        ticket_id = cur.fetchone()[0]
 
-        cur.execute("""
-            UPDATE available SET seats = seats - 1
-            WHERE tour_id=%s AND departure_stop_id <= %s AND arrival_stop_id >= %s;
-        """, (ticket.tour_id, ticket.departure_stop_id, ticket.arrival_stop_id))
+        # Место перестаёт быть свободным для всех участков, которые пересекают
+        # проданные сегменты и на которых оно до продажи было свободно целиком.
+        # У удержанного места сегменты сняты с продажи ещё при удержании.
+        sold_out = []
+        if not from_hold:
+            segment_seats = availability.update_seats(cur, ticket.tour_id, [seat_state])
+            # Участки, на которых места закончились, пропадают из поиска
+            sold_out = availability.sold_out(route, segment_seats, route.pairs_losing_seat(booked[2] | mask, mask))
+
+        record_sale(cur, ticket.tour_id, ticket.departure_stop_id, ticket.arrival_stop_id)
+
+        conn.commit()
+        inventory.update_seats(ticket.tour_id, [seat_state])
+        invalidate_reports()
+        if sold_out:
+            invalidate_search(sold_out)
+        return {"ticket_id": ticket_id, "passenger_id": passenger_id}
+
+    except HTTPException:
+        conn.rollback()
+        raise
+    except (errors.CheckViolation, errors.SerializationFailure, errors.DeadlockDetected) as e:
+        conn.rollback()
+        raise HTTPException(status_code=409, detail=f"Booking conflict, please retry: {e.pgerror or e}")
+    except Exception as e:
+        conn.rollback()
+        raise HTTPException(status_code=500, detail=str(e))
+    finally:
+        cur.close()
+
+
+@router.post("/batch")
+def create_tickets_batch(batch: TicketBatchCreate, conn=Depends(get_db)):
+    """
+    Групповая покупка: несколько мест и пассажиров на один рейс и участок.
+    Всё или ничего — если хотя бы одно место недоступно, не продаётся ни одно.
+    Число запросов к БД не зависит от размера группы.
+    """
+    seat_nums = [t.seat_num for t in batch.tickets]
+    if not seat_nums:
+        raise HTTPException(status_code=400, detail="No tickets in batch")
+    if len(seat_nums) > MAX_BATCH_TICKETS:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_BATCH_TICKETS} tickets per batch")
+    if len(set(seat_nums)) != len(seat_nums):
+        raise HTTPException(status_code=400, detail="Duplicate seat_num in batch")
+
+    cur = conn.cursor()
+    try:
+        route = topology.for_tour(cur, batch.tour_id)
+        if route is None:
+            raise HTTPException(status_code=404, detail="Tour not found")
+        mask = route.mask(batch.departure_stop_id, batch.arrival_stop_id)
+        if mask is None:
+            raise HTTPException(status_code=400, detail="Invalid segment for this tour")
+        params = {"tour_id": batch.tour_id, "seat_nums": seat_nums, "mask": mask}
+
+        held = {}
+        if batch.hold_token:
+            cur.execute(TAKE_HOLDS_QUERY, {**params, "hold_token": batch.hold_token})
+            held = {row[1]: row for row in cur.fetchall()}
+        rest = [n for n in seat_nums if n not in held]
+        booked = {}
+        if rest:
+            cur.execute(BOOK_SEATS_QUERY, {**params, "seat_nums": rest})
+            booked = {row[1]: row for row in cur.fetchall()}
+        if len(booked) != len(rest):
+            # Выясняем причину отказа: нет мест, места заблокированы, удержаны или заняты
+            cur.execute(SEATS_STATE_QUERY, {**params, "seat_nums": rest})
+            states = {row[0]: row[1:] for row in cur.fetchall()}
+            missing = [n for n in rest if n not in states]
+            if missing:
+                raise HTTPException(status_code=404, detail=f"Seats not found: {missing}")
+            blocked = [n for n in rest if states[n][0]]
+            if blocked:
+                raise HTTPException(status_code=400, detail=f"Seats are blocked: {blocked}")
+            on_hold = [n for n in rest if n not in booked and states[n][1]]
+            if on_hold:
+                raise HTTPException(status_code=409, detail=f"Seats are held by another customer: {on_hold}")
+            taken = [n for n in rest if n not in booked]
+            raise HTTPException(status_code=409, detail=f"Seats already booked for selected segments: {taken}")
+        # Выкупленные удержания (их сегменты уже сняты с продажи) и новые места
+        sold = {**held, **booked}
+
+        cur.execute(INSERT_GROUP_QUERY, {
+            "tour_id": batch.tour_id,
+            "departure_stop_id": batch.departure_stop_id,
+            "arrival_stop_id": batch.arrival_stop_id,
+            "seat_ids": [sold[n][0] for n in seat_nums],
+            "names": [t.passenger_name for t in batch.tickets],
+            "phones": [t.passenger_phone for t in batch.tickets],
+            "emails": [t.passenger_email for t in batch.tickets],
+        })
+        # seat_id -> (ticket_id, passenger_id)
+        inserted = {seat_id: (ticket_id, passenger_id) for ticket_id, seat_id, passenger_id in cur.fetchall()}
+
+        # Для каждого места — участки, которые оно перестаёт покрывать (см. create_ticket)
+        affected = set()
+        for _, _, available, _, _ in booked.values():
+            affected.update(route.pairs_losing_seat(available | mask, mask))
+        segment_seats = availability.update_seats(cur, batch.tour_id, [row[1:] for row in booked.values()])
+        sold_out = availability.sold_out(route, segment_seats, affected)
+
+        record_sale(cur, batch.tour_id, batch.departure_stop_id, batch.arrival_stop_id, len(seat_nums))
 
         conn.commit()
-        return {"ticket_id": cur.fetchone()[0], "passenger_id": passenger_id}
+        inventory.update_seats(batch.tour_id, [row[1:] for row in sold.values()])
+        invalidate_reports()
+        if sold_out:
+            invalidate_search(sold_out)
+        tickets = []
+        for seat_num in seat_nums:
+            ticket_id, passenger_id = inserted[sold[seat_num][0]]
+            tickets.append({"ticket_id": ticket_id, "passenger_id": passenger_id, "seat_num": seat_num})
+        return {"tickets": tickets}
 
+    except HTTPException:
+        conn.rollback()
+        raise
+    except (errors.CheckViolation, errors.SerializationFailure, errors.DeadlockDetected) as e:
+        conn.rollback()
+        raise HTTPException(status_code=409, detail=f"Booking conflict, please retry: {e.pgerror or e}")
     except Exception as e:
         conn.rollback()
         raise HTTPException(status_code=500, detail=str(e))
     finally:
         cur.close()
-        conn.close()
@@ -1,8 +1,19 @@
-from fastapi import APIRouter, HTTPException, Query
+from fastapi import APIRouter, Depends, HTTPException, Query, Request
 from pydantic import BaseModel
-from typing import List
-from datetime import date
-from database import get_connection
+import time
+from typing import List, Optional
+from datetime import date, timedelta
+import availability
+from database import get_db
+from database_async import fetchall, get_async_db
+from cache import invalidate_reports, invalidate_search
+from fares import fares
+from inventory import inventory
+from journeys import journey_index
+from rollup import delete_tours, refresh_tours
+from segments import MAX_SEGMENTS, full_mask
+from topology import topology
+from versions import versioned_rows_response
 
 router = APIRouter(prefix="/tours", tags=["tours"])
 
@@ -24,74 +35,163 @@ class Tour(BaseModel):
 
 
 @router.get("/", response_model=List[Tour])
-def get_tours():
-    conn = get_connection()
+def get_tours(request: Request, conn=Depends(get_db)):
     cur = conn.cursor()
-    cur.execute("SELECT id, route_id, pricelist_id, date, layout_variant FROM tour ORDER BY date;")
-    rows = cur.fetchall()
+    response = versioned_rows_response(
+        request, cur, ("tour",),
+        "SELECT id, route_id, pricelist_id, date, layout_variant FROM tour ORDER BY date;"
+    )
     cur.close()
-    conn.close()
-    return [
-        {"id": r[0], "route_id": r[1], "pricelist_id": r[2], "date": r[3], "layout_variant": r[4]}
-        for r in rows
-    ]
+    return response
+
+
+SEATS_PER_LAYOUT = {1: 46, 2: 48}
+MAX_BULK_DAYS = 731
+
+
+def _route_topology(cur, route_id):
+    """Топологията на маршрута (от кеша); проверява дали маршрутът е валиден за рейс."""
+    route = topology.route(cur, route_id)
+    if len(route.stops) < 2:
+        raise HTTPException(status_code=400, detail="Route must have at least 2 stops.")
+    if route.num_segments > MAX_SEGMENTS:
+        raise HTTPException(status_code=400, detail=f"Route must have at most {MAX_SEGMENTS + 1} stops.")
+    return route
+
+
+def _insert_tour_inventory(cur, tour_ids, route, pricelist_id, total_seats, active_seats):
+    """
+    Създава местата и наличността в tour_availability за всички подадени
+    рейсове с по една заявка на таблица, независимо от броя рейсове и места.
+    Връща двойките спирки с цена в ценоразписа (от кеша на цените, fares.py).
+    """
+    pairs = fares.get(cur, pricelist_id).priced(route.pairs())
+
+    active = sorted({s for s in active_seats if 1 <= s <= total_seats})
+
+    cur.execute("""
+        INSERT INTO seat (tour_id, seat_num, available, blocked)
+        SELECT t.id, n, %s, NOT (n = ANY(%s::int[]))
+        FROM unnest(%s::int[]) AS t(id)
+        CROSS JOIN generate_series(1, %s) AS n;
+    """, (full_mask(route.num_segments), active, tour_ids, total_seats))
+    availability.insert_tours(cur, tour_ids, route.num_segments, active)
+    return pairs
 
 
 @router.post("/", response_model=Tour)
-def create_tour(tour: TourCreate):
-    conn = get_connection()
+def create_tour(tour: TourCreate, conn=Depends(get_db)):
     cur = conn.cursor()
     try:
-        seats_layout = {1: 46, 2: 48}
-        total_seats = seats_layout.get(tour.layout_variant)
+        total_seats = SEATS_PER_LAYOUT.get(tour.layout_variant)
         if not total_seats:
             raise HTTPException(status_code=400, detail="Invalid layout_variant")
 
+        route = _route_topology(cur, tour.route_id)
+
         cur.execute("""
             INSERT INTO tour (route_id, pricelist_id, date, seats, layout_variant)
             VALUES (%s, %s, %s, %s, %s) RETURNING id;
         """, (tour.route_id, tour.pricelist_id, tour.date, total_seats, tour.layout_variant))
         tour_id = cur.fetchone()[0]
 
-        cur.execute("SELECT stop_id FROM routestop WHERE route_id=%s ORDER BY \"order\";", (tour.route_id,))
-        stops = [row[0] for row in cur.fetchall()]
-        if len(stops) < 2:
-            raise HTTPException(status_code=400, detail="Route must have at least 2 stops.")
+        pairs = _insert_tour_inventory(cur, [tour_id], route, tour.pricelist_id, total_seats, tour.active_seats)
+
+        conn.commit()
+        journey_index.invalidate_tours([tour_id])
+        invalidate_search(pairs)
+        return {"id": tour_id, **tour.dict(exclude={"active_seats"})}
+
+    except HTTPException:
+        conn.rollback()
+        raise
+    except Exception as e:
+        conn.rollback()
+        raise HTTPException(status_code=500, detail=str(e))
+    finally:
+        cur.close()
+
 
-        segments = [(stops[i], stops[j]) for i in range(len(stops)-1) for j in range(i+1, len(stops))]
-        cur.execute("SELECT departure_stop_id, arrival_stop_id FROM prices WHERE pricelist_id=%s;", (tour.pricelist_id,))
-        valid_segments = set(cur.fetchall())
+class TourBulkCreate(BaseModel):
+    route_id: int
+    pricelist_id: int
+    layout_variant: int
+    active_seats: List[int]
+    start_date: date
+    end_date: date
+    weekdays: Optional[List[int]] = None  # 0 – понеделник ... 6 – неделя; None – всеки ден
 
-        active_count = len(tour.active_seats)
 
-        for dep_stop, arr_stop in segments:
-            if (dep_stop, arr_stop) in valid_segments:
-                cur.execute("""
-                    INSERT INTO available (tour_id, departure_stop_id, arrival_stop_id, seats)
-                    VALUES (%s, %s, %s, %s);
-                """, (tour_id, dep_stop, arr_stop, active_count))
+@router.post("/bulk")
+def create_tours_bulk(data: TourBulkCreate, conn=Depends(get_db)):
+    """
+    Създава рейсове за всяка дата от периода [start_date, end_date]
+    (по желание само в дадените дни от седмицата) в една транзакция.
+    Рейсовете, местата и наличността се вмъкват с по една заявка на таблица.
+    """
+    started = time.perf_counter()
+    cur = conn.cursor()
+    try:
+        total_seats = SEATS_PER_LAYOUT.get(data.layout_variant)
+        if not total_seats:
+            raise HTTPException(status_code=400, detail="Invalid layout_variant")
+        if data.end_date < data.start_date:
+            raise HTTPException(status_code=400, detail="end_date must not be before start_date")
+        days = (data.end_date - data.start_date).days + 1
+        if days > MAX_BULK_DAYS:
+            raise HTTPException(status_code=400, detail=f"Date range must not exceed {MAX_BULK_DAYS} days")
+        if data.weekdays is not None and any(d < 0 or d > 6 for d in data.weekdays):
+            raise HTTPException(status_code=400, detail="weekdays must be in range 0..6")
 
-        segment_str = "".join(str(i+1) for i in range(len(stops)-1))
-        for seat_num in range(1, total_seats+1):
-            available = segment_str if seat_num in tour.active_seats else "0"
-            cur.execute("""
-                INSERT INTO seat (tour_id, seat_num, available) VALUES (%s, %s, %s);
-            """, (tour_id, seat_num, available))
+        dates = [data.start_date + timedelta(days=i) for i in range(days)]
+        if data.weekdays is not None:
+            weekdays = set(data.weekdays)
+            dates = [d for d in dates if d.weekday() in weekdays]
+        if not dates:
+            raise HTTPException(status_code=400, detail="No dates match the requested recurrence")
 
-        conn.commit()
-        return {"id": tour_id, **tour.dict(exclude={"active_seats"})}
+        route = _route_topology(cur, data.route_id)
 
+        cur.execute("""
+            INSERT INTO tour (route_id, pricelist_id, date, seats, layout_variant)
+            SELECT %s, %s, d, %s, %s
+            FROM unnest(%s::date[]) AS d
+            ORDER BY d
+            RETURNING id, date;
+        """, (data.route_id, data.pricelist_id, total_seats, data.layout_variant, dates))
+        created = cur.fetchall()
+        tours_done = time.perf_counter()
+
+        pairs = _insert_tour_inventory(cur, [r[0] for r in created], route, data.pricelist_id,
+                                       total_seats, data.active_seats)
+        inventory_done = time.perf_counter()
+
+        conn.commit()
+        journey_index.invalidate_tours([r[0] for r in created])
+        invalidate_search(pairs)
+        finished = time.perf_counter()
+        return {
+            "created": len(created),
+            "tours": [{"id": r[0], "date": r[1]} for r in created],
+            "timings_ms": {
+                "tours": round((tours_done - started) * 1000, 1),
+                "inventory": round((inventory_done - tours_done) * 1000, 1),
+                "commit": round((finished - inventory_done) * 1000, 1),
+                "total": round((finished - started) * 1000, 1),
+            },
+        }
+    except HTTPException:
+        conn.rollback()
+        raise
     except Exception as e:
         conn.rollback()
         raise HTTPException(status_code=500, detail=str(e))
     finally:
         cur.close()
-        conn.close()
 
 
 @router.delete("/{tour_id}")
-def delete_tour(tour_id: int, force: bool = Query(False)):
-    conn = get_connection()
+def delete_tour(tour_id: int, force: bool = Query(False), conn=Depends(get_db)):
     cur = conn.cursor()
     try:
         # Проверяваме дали има продадени билети
@@ -99,10 +199,14 @@ def delete_tour(tour_id: int, force: bool = Query(False)):
         if cur.fetchone()[0] > 0 and not force:
             raise HTTPException(status_code=400, detail="Има продадени билети. Използвайте force=true за каскадно изтриване.")
 
-        # Изтриваме свързаните записи
+        # Участъците на маршрута, които може да изчезнат от търсенето
+        route = topology.for_tour(cur, tour_id)
+        pairs = route.pairs() if route is not None else []
+
+        # Изтриваме свързаните записи (tour_availability — каскадно с рейса)
         cur.execute("DELETE FROM ticket WHERE tour_id = %s", (tour_id,))
+        delete_tours(cur, [tour_id])
         cur.execute("DELETE FROM seat WHERE tour_id = %s", (tour_id,))
-        cur.execute("DELETE FROM available WHERE tour_id = %s", (tour_id,))
         cur.execute("DELETE FROM tour WHERE id = %s RETURNING id", (tour_id,))
         
         deleted = cur.fetchone()
@@ -110,70 +214,119 @@ def delete_tour(tour_id: int, force: bool = Query(False)):
             raise HTTPException(status_code=404, detail="Tour not found")
         
         conn.commit()
+        inventory.invalidate(tour_id)
+        topology.forget_tour(tour_id)
+        journey_index.invalidate_tours([tour_id])
+        invalidate_search(pairs)
+        invalidate_reports()
         return {"detail": "Рейс изтрит", "deleted_id": deleted[0]}
+    except HTTPException:
+        conn.rollback()
+        raise
     except Exception as e:
         conn.rollback()
         raise HTTPException(status_code=500, detail=str(e))
     finally:
         cur.close()
-        conn.close()
 
 @router.put("/{tour_id}", response_model=Tour)
-def update_tour(tour_id: int, tour_data: TourCreate):
-    conn = get_connection()
+def update_tour(tour_id: int, tour_data: TourCreate, conn=Depends(get_db)):
+    """
+    Актуализира рейса, като променя само разликата спрямо текущото състояние:
+    активират/деактивират се само местата, чийто статус се е сменил, а
+    продадените сегменти се запазват. В tour_availability се записват само
+    местата, чието състояние се е сменило.
+    """
     cur = conn.cursor()
     try:
-        # Актуализираме основната информация за тура (без поле seats, което се пресмята автоматично)
+        total_seats = SEATS_PER_LAYOUT.get(tour_data.layout_variant)
+        if not total_seats:
+            raise HTTPException(status_code=400, detail="Неизвестен layout_variant")
+
+        # Заключваме рейса, за да не се променя паралелно
+        cur.execute("SELECT route_id, pricelist_id, seats, date FROM tour WHERE id = %s FOR UPDATE;", (tour_id,))
+        current = cur.fetchone()
+        if not current:
+            raise HTTPException(status_code=404, detail="Tour not found")
+        old_route_id, old_pricelist_id, old_total_seats, old_date = current
+
+        # Участъците, чиито резултати в търсенето може да се променят:
+        # двойките на стария и на новия маршрут
+        pairs = set(topology.route(cur, old_route_id).pairs())
+
+        route = _route_topology(cur, tour_data.route_id)
+        pairs.update(route.pairs())
+        route_changed = tour_data.route_id != old_route_id
+        changed_seats = []
+        active = sorted({s for s in tour_data.active_seats if 1 <= s <= total_seats})
+
+        # Актуализираме основната информация за тура
         cur.execute(
             """
             UPDATE tour
-            SET route_id = %s, pricelist_id = %s, date = %s, layout_variant = %s
-            WHERE id = %s
-            RETURNING id;
+            SET route_id = %s, pricelist_id = %s, date = %s, layout_variant = %s, seats = %s
+            WHERE id = %s;
             """,
-            (tour_data.route_id, tour_data.pricelist_id, tour_data.date, tour_data.layout_variant, tour_id)
+            (tour_data.route_id, tour_data.pricelist_id, tour_data.date,
+             tour_data.layout_variant, total_seats, tour_id)
         )
-        if not cur.fetchone():
-            raise HTTPException(status_code=404, detail="Tour not found")
 
-        # Обновяваме списъка със спирки за маршрута
-        cur.execute("SELECT stop_id FROM routestop WHERE route_id = %s ORDER BY \"order\"", (tour_data.route_id,))
-        stops = [r[0] for r in cur.fetchall()]
-        num_segments = len(stops) - 1
-        available_str = "".join(str(i) for i in range(1, num_segments + 1))
+        if route_changed:
+            # Сегментите на друг маршрут не съответстват на продадените билети
+            cur.execute("SELECT 1 FROM ticket WHERE tour_id = %s LIMIT 1;", (tour_id,))
+            if cur.fetchone():
+                raise HTTPException(status_code=400, detail="Не може да се смени маршрутът на рейс с продадени билети")
+            cur.execute("DELETE FROM seat WHERE tour_id = %s;", (tour_id,))
+            cur.execute("DELETE FROM tour_availability WHERE tour_id = %s;", (tour_id,))
+            _insert_tour_inventory(cur, [tour_id], route, tour_data.pricelist_id, total_seats, active)
+        else:
+            # Смяна на разположението: добавяме липсващите места или
+            # премахваме излишните, ако по тях няма продадени билети
+            seat_changes = []
+            if total_seats < old_total_seats:
+                cur.execute("""
+                    SELECT 1 FROM ticket t JOIN seat s ON s.id = t.seat_id
+                    WHERE s.tour_id = %s AND s.seat_num > %s LIMIT 1;
+                """, (tour_id, total_seats))
+                if cur.fetchone():
+                    raise HTTPException(status_code=400, detail="Има продадени билети за места извън новото разположение")
+                cur.execute("DELETE FROM seat WHERE tour_id = %s AND seat_num > %s;", (tour_id, total_seats))
+                # Премахнатите места не са свободни на нито един сегмент
+                seat_changes = [(n, 0, True, 0) for n in range(total_seats + 1, old_total_seats + 1)]
+            elif total_seats > old_total_seats:
+                cur.execute("""
+                    INSERT INTO seat (tour_id, seat_num, available, blocked)
+                    SELECT %s, n, %s, NOT (n = ANY(%s::int[]))
+                    FROM generate_series(%s, %s) AS n
+                    RETURNING seat_num, available, blocked, held;
+                """, (tour_id, full_mask(route.num_segments), active, old_total_seats + 1, total_seats))
+                seat_changes = cur.fetchall()
 
-        seats_per_layout = {1: 46, 2: 48}
-        total_seats = seats_per_layout.get(tour_data.layout_variant)
-        if not total_seats:
-            raise HTTPException(status_code=400, detail="Неизвестен layout_variant")
+            # Една заявка за всички места, чийто статус се променя
+            cur.execute("""
+                UPDATE seat
+                SET blocked = NOT (seat_num = ANY(%(active)s::int[]))
+                WHERE tour_id = %(tour_id)s
+                  AND blocked = (seat_num = ANY(%(active)s::int[]))
+                RETURNING seat_num, available, blocked, held;
+            """, {"tour_id": tour_id, "active": active})
+            changed_seats = cur.fetchall()
+            availability.update_seats(cur, tour_id, seat_changes + changed_seats)
 
-        # Обновяваме записите в таблицата seat
-        for seat_num in range(1, total_seats + 1):
-            is_active = seat_num in tour_data.active_seats
-            seat_available = available_str if is_active else "0"
-            cur.execute(
-                """
-                UPDATE seat SET available = %s
-                WHERE tour_id = %s AND seat_num = %s;
-                """,
-                (seat_available, tour_id, seat_num)
-            )
-
-        # Обновяваме таблицата available – задаваме броя свободни места за всеки сегмент
-        active_count = len(tour_data.active_seats)
-        for i in range(num_segments):
-            dep_stop = stops[i]
-            arr_stop = stops[i+1]
-            cur.execute(
-                """
-                UPDATE available
-                SET seats = %s
-                WHERE tour_id = %s AND departure_stop_id = %s AND arrival_stop_id = %s;
-                """,
-                (active_count, tour_id, dep_stop, arr_stop)
-            )
+        # Агрегатите на продажбите пазят дата, маршрут и цена от ценоразписа
+        if (tour_data.date, tour_data.route_id, tour_data.pricelist_id) != (old_date, old_route_id, old_pricelist_id):
+            refresh_tours(cur, [tour_id])
 
         conn.commit()
+        if route_changed:
+            topology.set_tour_route(tour_id, tour_data.route_id)
+        if route_changed or total_seats != old_total_seats:
+            inventory.invalidate(tour_id)
+        else:
+            inventory.update_seats(tour_id, changed_seats)
+        journey_index.invalidate_tours([tour_id])
+        invalidate_search(pairs)
+        invalidate_reports()
         return {
             "id": tour_id,
             "route_id": tour_data.route_id,
@@ -181,45 +334,45 @@ def update_tour(tour_id: int, tour_data: TourCreate):
             "date": tour_data.date,
             "layout_variant": tour_data.layout_variant
         }
+    except HTTPException:
+        conn.rollback()
+        raise
     except Exception as e:
         conn.rollback()
         raise HTTPException(status_code=500, detail=str(e))
     finally:
         cur.close()
-        conn.close()
+
+SEARCH_TOURS_QUERY = """
+    SELECT t.id, t.date, a.seats, t.layout_variant, t.pricelist_id
+    FROM tour t
+    JOIN available a ON t.id = a.tour_id
+    WHERE a.departure_stop_id = %s
+      AND a.arrival_stop_id = %s
+      AND t.date = %s
+      AND a.seats > 0;
+"""
 
 @router.get("/search")
-def search_tours(
+async def search_tours(
     departure_stop_id: int, 
     arrival_stop_id: int, 
-    date: date
+    date: date,
+    conn=Depends(get_async_db)
 ):
-    conn = get_connection()
-    cur = conn.cursor()
-
     try:
         # Находим туры на указанную дату с доступными местами между остановками
-        cur.execute("""
-            SELECT t.id, t.date, a.seats, t.layout_variant
-            FROM tour t
-            JOIN available a ON t.id = a.tour_id
-            WHERE a.departure_stop_id = %s
-              AND a.arrival_stop_id = %s
-              AND t.date = %s
-              AND a.seats > 0;
-        """, (departure_stop_id, arrival_stop_id, date))
-
-        rows = cur.fetchall()
-        tours = [
-            {"id": row[0], "date": row[1], "seats": row[2], "layout_variant": row[3]}
-            for row in rows
-        ]
+        rows = await fetchall(conn, SEARCH_TOURS_QUERY, (departure_stop_id, arrival_stop_id, date))
+        # Цена участка — из матрицы цен прайса рейса (fares.py), без JOIN с prices
+        tours = []
+        for row in rows:
+            price = (await fares.aget(conn, row[4])).price(departure_stop_id, arrival_stop_id)
+            tours.append({
+                "id": row[0], "date": row[1], "seats": row[2], "layout_variant": row[3],
+                "price": float(price) if price is not None else None,
+            })
 
         return tours
 
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
-
-    finally:
-        cur.close()
-        conn.close()
@@ -0,0 +1,274 @@
+"""
+Рассылка изменений схемы мест по WebSocket (GET /seat/ws).
+
+Клиент подписывается на рейс и участок (tour_id, departure_stop_id,
+arrival_stop_id — как в GET /seat/), получает снимок схемы мест, а затем
+только изменения:
+
+    {"type": "snapshot", "tour_id": 1, "seats": [{"seat_num": 1, "status": "available"}, ...], "free_seats": 45}
+    {"type": "seats", "tour_id": 1, "seats": [{"seat_num": 7, "status": "occupied"}], "free_seats": 44}
+
+Подписчики одного рейса и участка объединены в канал: канал хранит текущие
+состояния мест, при изменении считает, у каких мест поменялось состояние
+на его участке, и сериализует сообщение один раз для всех подписчиков.
+Продажа на непересекающемся участке сообщений не порождает.
+
+Изменения приходят из кэша занятости (inventory.add_listener) — после
+коммита любой записи: продажи, удержания, блокировки места, изменения
+рейса. Обработчики записи выполняются в потоках threadpool, поэтому
+событие передаётся в event loop через call_soon_threadsafe. Если у рейса
+нет подписчиков, публикация — одна проверка словаря.
+
+У каждого подписчика ограниченная очередь (SEAT_WS_QUEUE_SIZE сообщений):
+если клиент не успевает читать, накопленные изменения заменяются одним
+свежим снимком, и запись остальным подписчикам не задерживается.
+
+Как и кэш занятости, рассылка работает в пределах процесса: при
+нескольких воркерах подписчик видит только продажи своего воркера.
+"""
+import asyncio
+import os
+
+import orjson
+from fastapi import WebSocket, WebSocketDisconnect
+
+from inventory import inventory, seat_status
+from segments import segment_mask
+
+SEAT_WS_QUEUE_SIZE = int(os.getenv("SEAT_WS_QUEUE_SIZE", "32"))
+
+
+class Subscriber:
+    __slots__ = ("queue",)
+
+    def __init__(self):
+        self.queue = asyncio.Queue(maxsize=SEAT_WS_QUEUE_SIZE)
+
+
+class Channel:
+    """Подписчики одного рейса и участка и текущие состояния мест на этом участке."""
+
+    def __init__(self, tour_id, departure_stop_id, arrival_stop_id):
+        self.tour_id = tour_id
+        self.departure_stop_id = departure_stop_id
+        self.arrival_stop_id = arrival_stop_id
+        self.route_id = None
+        self.mask = None
+        self.statuses = {}
+        self.free_seats = 0
+        self.subscribers = set()
+        self._snapshot = None
+
+    def load(self, inv):
+        """Берёт состояния мест из рейса кэша. False, если участка нет на маршруте рейса."""
+        span = inv.segment_range(self.departure_stop_id, self.arrival_stop_id)
+        if span is None:
+            return False
+        self.route_id = inv.route_id
+        self.mask = segment_mask(*span)
+        self.statuses = {
+            seat_num: seat_status(available, blocked, held, self.mask)
+            for seat_num, available, blocked, held in inv.seat_states()
+        }
+        self.free_seats = sum(1 for status in self.statuses.values() if status == "available")
+        self._snapshot = None
+        return True
+
+    def apply(self, seats):
+        """Применяет состояния мест [(seat_num, available, blocked, held), ...]; возвращает изменившиеся."""
+        changed = []
+        for seat_num, available, blocked, held in seats:
+            old = self.statuses.get(seat_num)
+            if old is None:
+                continue
+            status = seat_status(available, blocked, held, self.mask)
+            if status != old:
+                self.statuses[seat_num] = status
+                self.free_seats += (status == "available") - (old == "available")
+                changed.append({"seat_num": seat_num, "status": status})
+        if changed:
+            self._snapshot = None
+        return changed
+
+    def snapshot(self):
+        if self._snapshot is None:
+            self._snapshot = _encode({
+                "type": "snapshot",
+                "tour_id": self.tour_id,
+                "seats": [{"seat_num": n, "status": s} for n, s in self.statuses.items()],
+                "free_seats": self.free_seats,
+            })
+        return self._snapshot
+
+    def broadcast(self, message):
+        for subscriber in self.subscribers:
+            try:
+                subscriber.queue.put_nowait(message)
+            except asyncio.QueueFull:
+                # Клиент отстал: вместо накопленных изменений — один снимок
+                _drain(subscriber.queue)
+                subscriber.queue.put_nowait(self.snapshot())
+
+    def close(self):
+        """Рейс удалён или участок больше не на маршруте: подписчики отключаются."""
+        self.mask = None
+        for subscriber in self.subscribers:
+            _drain(subscriber.queue)
+            subscriber.queue.put_nowait(None)
+
+
+def _drain(queue):
+    while not queue.empty():
+        queue.get_nowait()
+
+
+def _encode(message):
+    return orjson.dumps(message).decode()
+
+
+class SeatBroker:
+    """Каналы подписчиков по рейсам. Методы, кроме seats_changed и reset, вызываются из event loop."""
+
+    def __init__(self):
+        self._loop = None
+        self._tours = {}  # tour_id -> {(departure_stop_id, arrival_stop_id): Channel}
+        self._resets = {}  # tour_id -> пришёл ли новый сброс во время перезагрузки
+
+    # --- публикация (из любого потока) ---
+
+    def seats_changed(self, tour_id, seats):
+        if tour_id in self._tours:
+            self._call(self._dispatch, tour_id, list(seats))
+
+    def reset(self, tour_id=None, route_id=None):
+        if self._tours:
+            self._call(self._schedule_reset, tour_id, route_id)
+
+    def _call(self, callback, *args):
+        try:
+            self._loop.call_soon_threadsafe(callback, *args)
+        except RuntimeError:
+            # Event loop уже остановлен (завершение приложения)
+            pass
+
+    # --- event loop ---
+
+    def _dispatch(self, tour_id, seats):
+        for channel in self._tours.get(tour_id, {}).values():
+            if channel.mask is None:
+                continue
+            changed = channel.apply(seats)
+            if changed:
+                channel.broadcast(_encode({
+                    "type": "seats",
+                    "tour_id": tour_id,
+                    "seats": changed,
+                    "free_seats": channel.free_seats,
+                }))
+
+    def _schedule_reset(self, tour_id, route_id):
+        for tid, channels in list(self._tours.items()):
+            if tour_id is not None and tid != tour_id:
+                continue
+            if route_id is not None and not any(c.route_id == route_id for c in channels.values()):
+                continue
+            if tid in self._resets:
+                self._resets[tid] = True
+            else:
+                self._resets[tid] = False
+                self._loop.create_task(self._reload(tid))
+
+    async def _reload(self, tour_id):
+        """Рейс изменён структурно: заново загружает его и рассылает снимки."""
+        while True:
+            try:
+                inv = await inventory.aget(tour_id)
+            except Exception:
+                # Подписчики отключаются и при переподключении получат свежий снимок
+                inv = None
+            # Если рейс снова изменили во время загрузки, снимок мог устареть
+            if not self._resets[tour_id]:
+                break
+            self._resets[tour_id] = False
+        del self._resets[tour_id]
+        for channel in list(self._tours.get(tour_id, {}).values()):
+            if channel.mask is None:
+                continue
+            if inv is None or not channel.load(inv):
+                channel.close()
+            else:
+                channel.broadcast(channel.snapshot())
+
+    async def subscribe(self, tour_id, departure_stop_id, arrival_stop_id):
+        """(канал, подписчик) или None, если рейса или участка нет."""
+        self._loop = asyncio.get_running_loop()
+        inv = await inventory.aget(tour_id)
+        if inv is None:
+            return None
+        key = (departure_stop_id, arrival_stop_id)
+        channels = self._tours.setdefault(tour_id, {})
+        channel = channels.get(key)
+        if channel is None or channel.mask is None:
+            # Канал регистрируется до чтения состояний мест: изменение,
+            # внесённое в кэш позже, уже будет опубликовано в _dispatch
+            channel = channels[key] = Channel(tour_id, departure_stop_id, arrival_stop_id)
+            if not channel.load(inv):
+                del channels[key]
+                if not channels:
+                    del self._tours[tour_id]
+                return None
+        subscriber = Subscriber()
+        channel.subscribers.add(subscriber)
+        return channel, subscriber
+
+    def unsubscribe(self, channel, subscriber):
+        channel.subscribers.discard(subscriber)
+        if channel.subscribers:
+            return
+        channels = self._tours.get(channel.tour_id)
+        if channels is not None and channels.get((channel.departure_stop_id, channel.arrival_stop_id)) is channel:
+            del channels[(channel.departure_stop_id, channel.arrival_stop_id)]
+            if not channels:
+                del self._tours[channel.tour_id]
+
+    def stats(self):
+        channels = [c for tour in self._tours.values() for c in tour.values()]
+        return {
+            "tours": len(self._tours),
+            "channels": len(channels),
+            "subscribers": sum(len(c.subscribers) for c in channels),
+        }
+
+
+broker = SeatBroker()
+inventory.add_listener(broker)
+
+
+async def serve(websocket: WebSocket, channel, subscriber):
+    """Отправляет снимок и изменения канала, пока клиент не отключится."""
+
+    async def send():
+        await websocket.send_text(channel.snapshot())
+        while True:
+            message = await subscriber.queue.get()
+            if message is None:
+                await websocket.close(code=1000, reason="Seat map is no longer available")
+                return
+            await websocket.send_text(message)
+
+    async def receive():
+        # Сообщения клиента не нужны, но чтение замечает отключение
+        while True:
+            await websocket.receive_text()
+
+    tasks = [asyncio.create_task(send()), asyncio.create_task(receive())]
+    try:
+        done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+        for task in done:
+            error = task.exception()
+            if error is not None and not isinstance(error, WebSocketDisconnect):
+                raise error
+    finally:
+        for task in tasks:
+            task.cancel()
+        broker.unsubscribe(channel, subscriber)
@@ -0,0 +1,241 @@
+"""
+Генератор синтетических данных для локальной БД в объёме, близком к рабочему.
+
+Создаёт остановки, маршруты (порядок остановок и время прибытия/отправления),
+прайсы с ценами на все пары остановок маршрута, ежедневные рейсы на заданное
+число месяцев, проданные билеты с пассажирами и согласованные с ними маски
+мест, наличие мест tour_availability и агрегаты sales_rollup.
+
+Все значения выбираются генератором случайных чисел с заданным seed, поэтому
+одинаковые параметры дают одинаковые данные. С --reset таблицы очищаются и
+счётчики id сбрасываются — тогда совпадают и идентификаторы.
+
+Запуск (из каталога backend):
+    python seed_data.py --reset
+    python seed_data.py --reset --routes 40 --months 6 --seed 7
+    python migrate.py && python seed_data.py --reset && python benchmark.py
+
+После заполнения выполняется ANALYZE, чтобы планы запросов соответствовали
+данным.
+"""
+import argparse
+import io
+import random
+import sys
+import time
+from datetime import date, datetime, timedelta
+
+from availability import REBUILD_TOURS_QUERY
+from database import get_connection
+from rollup import refresh_tours
+from routers.tour import SEATS_PER_LAYOUT, _insert_tour_inventory
+from segments import MAX_SEGMENTS, segment_mask
+from topology import RouteTopology
+
+# Таблицы в порядке очистки для --reset
+TABLES = (
+    "sales_rollup", "ticket", "passenger", "seat_hold", "tour_availability", "seat", "tour",
+    "prices", "pricelist", "routestop", "route", "stop",
+)
+
+def reset(cur):
+    cur.execute(f"TRUNCATE {', '.join(TABLES)} RESTART IDENTITY;")
+
+
+def reserve_ids(cur, table, count):
+    """count идентификаторов из последовательности столбца id таблицы."""
+    cur.execute(
+        "SELECT nextval(pg_get_serial_sequence(%s, 'id')) FROM generate_series(1, %s);",
+        (table, count)
+    )
+    return [row[0] for row in cur.fetchall()]
+
+
+def copy_rows(cur, table, columns, rows):
+    """Загрузка строк через COPY (значения без табуляций и переводов строк)."""
+    buf = io.StringIO()
+    for row in rows:
+        buf.write("\t".join(r"\N" if v is None else str(v) for v in row))
+        buf.write("\n")
+    buf.seek(0)
+    cur.copy_from(buf, table, columns=columns)
+
+
+def create_stops(cur, count):
+    cur.execute("""
+        INSERT INTO stop (stop_name)
+        SELECT 'Stop ' || lpad(g::text, 4, '0') FROM generate_series(1, %s) AS g
+        RETURNING id;
+    """, (count,))
+    return sorted(row[0] for row in cur.fetchall())
+
+
+def create_route(cur, rnd, n, stop_ids, min_stops, max_stops):
+    """Маршрут со случайными остановками и расписанием; возвращает (route_id, stops, км от начала)."""
+    stops = rnd.sample(stop_ids, rnd.randint(min_stops, max_stops))
+    cur.execute("INSERT INTO route (name) VALUES (%s) RETURNING id;", (f"Route {n:03d}",))
+    route_id = cur.fetchone()[0]
+
+    km = [0]
+    clock = datetime(2000, 1, 1, rnd.randrange(5 * 4, 22 * 4) // 4, rnd.choice((0, 15, 30, 45)))
+    rows = []
+    for order, stop_id in enumerate(stops, start=1):
+        if order > 1:
+            leg = rnd.randint(15, 120)
+            km.append(km[-1] + leg)
+            clock += timedelta(minutes=leg * rnd.randint(55, 80) // 60)
+        arrival = clock.time()
+        if 1 < order < len(stops):
+            clock += timedelta(minutes=5)
+        rows.append((route_id, stop_id, order, arrival, clock.time()))
+    cur.execute("""
+        INSERT INTO routestop (route_id, stop_id, "order", arrival_time, departure_time)
+        SELECT * FROM unnest(%s::int[], %s::int[], %s::int[], %s::time[], %s::time[]);
+    """, tuple(list(col) for col in zip(*rows)))
+    return route_id, stops, km
+
+
+def create_pricelist(cur, n, stops, km):
+    """Прайс с ценой на каждую пару остановок маршрута, пропорциональной расстоянию."""
+    cur.execute("INSERT INTO pricelist (name) VALUES (%s) RETURNING id;", (f"Pricelist {n:03d}",))
+    pricelist_id = cur.fetchone()[0]
+    rows = []
+    for i in range(len(stops) - 1):
+        for j in range(i + 1, len(stops)):
+            # 2.00 посадка + 0.11 за км, с округлением до 0.50
+            price = round((2 + 0.11 * (km[j] - km[i])) * 2) / 2
+            rows.append((pricelist_id, stops[i], stops[j], f"{price:.2f}"))
+    copy_rows(cur, "prices", ("pricelist_id", "departure_stop_id", "arrival_stop_id", "price"), rows)
+    return pricelist_id
+
+
+def sell_tickets(rnd, route, seats, load):
+    """
+    Продажи по одному рейсу: случайные места и участки, пока занятость не
+    достигнет load. Возвращает (маски мест, [(seat_num, dep, arr), ...]).
+    """
+    n = route.num_segments
+    masks = {num: (1 << n) - 1 for num in seats}
+    target = int(load * len(seats) * n)
+    sold = []
+    occupied = 0
+    # Ограничение числа попыток, чтобы почти полные рейсы не зацикливались
+    for _ in range(target * 3):
+        if occupied >= target:
+            break
+        first = rnd.randrange(1, n + 1)
+        last = min(n, first + int(rnd.expovariate(1 / max(1, n / 3))))
+        mask = segment_mask(first, last)
+        seat_num = rnd.choice(seats)
+        if masks[seat_num] & mask != mask:
+            continue
+        masks[seat_num] &= ~mask
+        occupied += last - first + 1
+        sold.append((seat_num, route.stops[first - 1], route.stops[last]))
+    return masks, sold
+
+
+def create_tours(cur, rnd, route, pricelist_id, start, days, load_range, passenger_no):
+    """Ежедневные рейсы маршрута с проданными билетами. Возвращает (рейсы, билеты)."""
+    layout_variant = rnd.choice(sorted(SEATS_PER_LAYOUT))
+    total_seats = SEATS_PER_LAYOUT[layout_variant]
+    # Несколько мест у некоторых маршрутов не продаются (служебные)
+    blocked = set(rnd.sample(range(1, total_seats + 1), rnd.choice((0, 0, 1, 2))))
+    active = [s for s in range(1, total_seats + 1) if s not in blocked]
+
+    tour_ids = reserve_ids(cur, "tour", days)
+    copy_rows(cur, "tour", ("id", "route_id", "pricelist_id", "date", "seats", "layout_variant"), [
+        (tour_id, route.route_id, pricelist_id, start + timedelta(days=d), total_seats, layout_variant)
+        for d, tour_id in enumerate(tour_ids)
+    ])
+    _insert_tour_inventory(cur, tour_ids, route, pricelist_id, total_seats, active)
+
+    cur.execute("SELECT tour_id, seat_num, id FROM seat WHERE tour_id = ANY(%s);", (tour_ids,))
+    seat_ids = {(tour_id, seat_num): seat_id for tour_id, seat_num, seat_id in cur.fetchall()}
+
+    seat_updates = []
+    tickets = []
+    for tour_id in tour_ids:
+        masks, sold = sell_tickets(rnd, route, active, rnd.uniform(*load_range))
+        seat_updates.extend((seat_ids[tour_id, num], mask) for num, mask in masks.items())
+        tickets.extend((tour_id, seat_ids[tour_id, num], dep, arr) for num, dep, arr in sold)
+
+    passenger_ids = reserve_ids(cur, "passenger", len(tickets))
+    copy_rows(cur, "passenger", ("id", "name", "phone", "email"), [
+        (pid, f"Passenger {passenger_no + i}", f"+3598{rnd.randrange(10 ** 7, 10 ** 8)}",
+         f"p{passenger_no + i}@example.com" if rnd.random() < 0.6 else None)
+        for i, pid in enumerate(passenger_ids)
+    ])
+    copy_rows(cur, "ticket", ("tour_id", "seat_id", "passenger_id", "departure_stop_id", "arrival_stop_id"), [
+        (tour_id, seat_id, pid, dep, arr)
+        for (tour_id, seat_id, dep, arr), pid in zip(tickets, passenger_ids)
+    ])
+    cur.execute("""
+        UPDATE seat s SET available = v.mask
+        FROM unnest(%s::int[], %s::bigint[]) AS v(id, mask)
+        WHERE s.id = v.id;
+    """, ([s[0] for s in seat_updates], [s[1] for s in seat_updates]))
+
+    cur.execute(REBUILD_TOURS_QUERY, {"tour_ids": tour_ids})
+    refresh_tours(cur, tour_ids)
+    return tour_ids, len(tickets)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--stops", type=int, default=150, help="число остановок")
+    parser.add_argument("--routes", type=int, default=24, help="число маршрутов (у каждого свой прайс)")
+    parser.add_argument("--route-stops", type=int, nargs=2, default=(5, 14), metavar=("MIN", "MAX"),
+                        help="число остановок маршрута")
+    parser.add_argument("--months", type=int, default=3, help="период рейсов, месяцев (по 30 дней)")
+    parser.add_argument("--start", type=date.fromisoformat, default=date(2026, 1, 1),
+                        help="дата первого рейса, YYYY-MM-DD")
+    parser.add_argument("--load", type=float, nargs=2, default=(0.3, 0.9), metavar=("MIN", "MAX"),
+                        help="доля занятых место-сегментов рейса")
+    parser.add_argument("--reset", action="store_true", help="очистить таблицы перед заполнением")
+    args = parser.parse_args()
+
+    min_stops, max_stops = args.route_stops
+    if not 2 <= min_stops <= max_stops <= min(args.stops, MAX_SEGMENTS + 1):
+        parser.error(f"--route-stops must satisfy 2 <= MIN <= MAX <= min(--stops, {MAX_SEGMENTS + 1})")
+
+    rnd = random.Random(args.seed)
+    started = time.perf_counter()
+    conn = get_connection()
+    cur = conn.cursor()
+    try:
+        if args.reset:
+            reset(cur)
+        stop_ids = create_stops(cur, args.stops)
+        conn.commit()
+
+        tours = tickets = 0
+        for n in range(1, args.routes + 1):
+            route_id, stops, km = create_route(cur, rnd, n, stop_ids, min_stops, max_stops)
+            pricelist_id = create_pricelist(cur, n, stops, km)
+            tour_ids, sold = create_tours(
+                cur, rnd, RouteTopology(route_id, stops), pricelist_id,
+                args.start, args.months * 30, args.load, tickets + 1,
+            )
+            conn.commit()
+            tours += len(tour_ids)
+            tickets += sold
+            print(f"route {n}/{args.routes}: {len(stops)} stops, {len(tour_ids)} tours, {sold} tickets")
+
+        conn.autocommit = True
+        cur.execute("ANALYZE;")
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cur.close()
+        conn.close()
+
+    print(f"{args.stops} stops, {args.routes} routes, {tours} tours, {tickets} tickets "
+          f"in {time.perf_counter() - started:.1f}s")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
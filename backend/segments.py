@@ -0,0 +1,47 @@
+"""
+Битовые маски сегментов маршрута.
+
+Сегмент i (нумерация с 1) — участок между i-й и (i+1)-й остановкой маршрута
+в порядке routestop."order". В seat.available хранится маска свободных
+сегментов места: бит (i - 1) установлен, если сегмент i свободен.
+Тип столбца — bigint, поэтому маршрут может содержать до 63 сегментов.
+"""
+
+MAX_SEGMENTS = 63
+
+
+def full_mask(num_segments):
+    """Маска места, у которого свободны все сегменты маршрута."""
+    if num_segments > MAX_SEGMENTS:
+        raise ValueError(f"Route has {num_segments} segments, maximum is {MAX_SEGMENTS}")
+    return (1 << num_segments) - 1
+
+
+def segment_mask(first, last):
+    """Маска сегментов first..last включительно."""
+    return ((1 << (last - first + 1)) - 1) << (first - 1)
+
+
+class RangeAnd:
+    """
+    Разреженная таблица для AND значений на отрезке сегментов: levels[j][i] —
+    AND значений i+1 .. i+2^j. Запрос — AND двух перекрывающихся блоков,
+    то есть две операции независимо от длины отрезка.
+    """
+
+    __slots__ = ("levels",)
+
+    def __init__(self, values):
+        levels = [list(values)]
+        width = 1
+        while 2 * width <= len(values):
+            prev = levels[-1]
+            levels.append([prev[i] & prev[i + width] for i in range(len(prev) - width)])
+            width *= 2
+        self.levels = levels
+
+    def query(self, first, last):
+        """AND значений сегментов first..last (нумерация с 1)."""
+        level = (last - first + 1).bit_length() - 1
+        row = self.levels[level]
+        return row[first - 1] & row[last - (1 << level)]
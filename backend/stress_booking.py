@@ -0,0 +1,272 @@
+"""
+Нагрузочная проверка конкурентной продажи билетов (POST /tickets).
+
+Создаёт в локальной БД отдельный маршрут и рейс, запускает сотни
+параллельных покупок на случайные места и участки и затем проверяет,
+что ничего не продано дважды:
+  - билеты одного места не пересекаются по сегментам;
+  - маска seat.available совпадает с проданными билетами;
+  - tour_availability и представление available совпадают с масками мест;
+  - агрегаты sales_rollup совпадают с билетами.
+
+Запуск (из каталога backend):
+    python stress_booking.py --bookings 500 --workers 64
+    python stress_booking.py --url http://127.0.0.1:8000   # через HTTP
+
+Код возврата 1, если найдено превышение продаж.
+"""
+import argparse
+import random
+import sys
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from fastapi import HTTPException
+
+import rollup
+from availability import seat_set
+from database import DATABASE_URL, ConnectionPool
+from segments import full_mask, segment_mask
+
+
+def create_fixture(conn, num_stops, seats):
+    """Маршрут из num_stops остановок, полный прайс и рейс со всеми активными местами."""
+    tag = uuid.uuid4().hex[:8]
+    cur = conn.cursor()
+    stop_ids = []
+    for i in range(num_stops):
+        cur.execute("INSERT INTO stop (stop_name) VALUES (%s) RETURNING id;", (f"stress-{tag}-{i + 1}",))
+        stop_ids.append(cur.fetchone()[0])
+    cur.execute("INSERT INTO route (name) VALUES (%s) RETURNING id;", (f"stress-{tag}",))
+    route_id = cur.fetchone()[0]
+    for order, stop_id in enumerate(stop_ids, start=1):
+        cur.execute(
+            'INSERT INTO routestop (route_id, stop_id, "order") VALUES (%s, %s, %s);',
+            (route_id, stop_id, order)
+        )
+    cur.execute("INSERT INTO pricelist (name) VALUES (%s) RETURNING id;", (f"stress-{tag}",))
+    pricelist_id = cur.fetchone()[0]
+    for i in range(num_stops - 1):
+        for j in range(i + 1, num_stops):
+            cur.execute(
+                "INSERT INTO prices (pricelist_id, departure_stop_id, arrival_stop_id, price) "
+                "VALUES (%s, %s, %s, %s);",
+                (pricelist_id, stop_ids[i], stop_ids[j], 10 * (j - i))
+            )
+    conn.commit()
+    cur.close()
+
+    from routers.tour import TourCreate, create_tour
+    layout_variant = {46: 1, 48: 2}[seats]
+    tour = create_tour(TourCreate(
+        route_id=route_id,
+        pricelist_id=pricelist_id,
+        date=time.strftime("%Y-%m-%d"),
+        layout_variant=layout_variant,
+        active_seats=list(range(1, seats + 1)),
+    ), conn)
+    return {
+        "tour_id": tour["id"],
+        "route_id": route_id,
+        "pricelist_id": pricelist_id,
+        "stop_ids": stop_ids,
+        "seats": seats,
+    }
+
+
+def drop_fixture(conn, fixture):
+    cur = conn.cursor()
+    tour_id = fixture["tour_id"]
+    cur.execute("SELECT passenger_id FROM ticket WHERE tour_id = %s;", (tour_id,))
+    passenger_ids = [r[0] for r in cur.fetchall()]
+    cur.execute("DELETE FROM ticket WHERE tour_id = %s;", (tour_id,))
+    cur.execute("DELETE FROM sales_rollup WHERE tour_id = %s;", (tour_id,))
+    cur.execute("DELETE FROM passenger WHERE id = ANY(%s);", (passenger_ids,))
+    cur.execute("DELETE FROM seat WHERE tour_id = %s;", (tour_id,))
+    cur.execute("DELETE FROM tour WHERE id = %s;", (tour_id,))
+    cur.execute("DELETE FROM prices WHERE pricelist_id = %s;", (fixture["pricelist_id"],))
+    cur.execute("DELETE FROM pricelist WHERE id = %s;", (fixture["pricelist_id"],))
+    cur.execute("DELETE FROM routestop WHERE route_id = %s;", (fixture["route_id"],))
+    cur.execute("DELETE FROM route WHERE id = %s;", (fixture["route_id"],))
+    cur.execute("DELETE FROM stop WHERE id = ANY(%s);", (fixture["stop_ids"],))
+    conn.commit()
+    cur.close()
+
+
+def make_requests(fixture, count, seed):
+    """Случайные покупки, сосредоточенные на небольшом числе мест для высокой конкуренции."""
+    rnd = random.Random(seed)
+    stops = fixture["stop_ids"]
+    hot_seats = list(range(1, min(fixture["seats"], 8) + 1))
+    requests = []
+    for n in range(count):
+        i = rnd.randrange(len(stops) - 1)
+        j = rnd.randrange(i + 1, len(stops))
+        requests.append({
+            "tour_id": fixture["tour_id"],
+            "seat_num": rnd.choice(hot_seats),
+            "passenger_name": f"stress passenger {n}",
+            "departure_stop_id": stops[i],
+            "arrival_stop_id": stops[j],
+        })
+    return requests
+
+
+def run_in_process(pool, requests, workers):
+    from routers.ticket import TicketCreate, create_ticket
+
+    def book(body):
+        with pool.connection() as conn:
+            try:
+                create_ticket(TicketCreate(**body), conn)
+                return 200
+            except HTTPException as e:
+                return e.status_code
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(book, requests))
+
+
+def run_over_http(url, requests, workers):
+    import httpx
+
+    with httpx.Client(base_url=url, timeout=30) as client:
+        def book(body):
+            return client.post("/tickets/", json=body).status_code
+
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            return list(executor.map(book, requests))
+
+
+def check_invariants(conn, fixture):
+    """Возвращает список нарушений (пустой, если всё в порядке)."""
+    problems = []
+    position = {stop_id: i + 1 for i, stop_id in enumerate(fixture["stop_ids"])}
+    cur = conn.cursor()
+    cur.execute("""
+        SELECT s.seat_num, s.available, s.blocked, s.held, t.departure_stop_id, t.arrival_stop_id
+        FROM seat s
+        LEFT JOIN ticket t ON t.seat_id = s.id
+        WHERE s.tour_id = %s
+        ORDER BY s.seat_num, t.id
+    """, (fixture["tour_id"],))
+    sold = {}
+    available = {}
+    held = {}
+    blocked = set()
+    for seat_num, available_mask, is_blocked, held_mask, dep, arr in cur.fetchall():
+        available[seat_num] = available_mask
+        held[seat_num] = held_mask
+        if is_blocked:
+            blocked.add(seat_num)
+        sold.setdefault(seat_num, 0)
+        if dep is None:
+            continue
+        mask = segment_mask(position[dep], position[arr] - 1)
+        if sold[seat_num] & mask:
+            problems.append(f"seat {seat_num}: segments sold twice ({dep}->{arr})")
+        sold[seat_num] |= mask
+
+    # Удержания (routers/hold.py): маски не пересекаются с проданными сегментами,
+    # seat.held — их объединение
+    cur.execute("""
+        SELECT seat_num, bit_or(mask) FROM seat_hold
+        WHERE tour_id = %s GROUP BY seat_num
+    """, (fixture["tour_id"],))
+    hold_masks = {}
+    for seat_num, hold_mask in cur.fetchall():
+        hold_masks[seat_num] = hold_mask
+        if sold.get(seat_num, 0) & hold_mask:
+            problems.append(f"seat {seat_num}: held segments {hold_mask:b} are sold")
+    for seat_num, held_mask in held.items():
+        if held_mask != hold_masks.get(seat_num, 0):
+            problems.append(
+                f"seat {seat_num}: held mask {held_mask:b} "
+                f"does not match seat holds {hold_masks.get(seat_num, 0):b}"
+            )
+
+    route_mask = full_mask(len(fixture["stop_ids"]) - 1)
+    for seat_num, sold_mask in sold.items():
+        if available[seat_num] != route_mask & ~sold_mask & ~held[seat_num]:
+            problems.append(
+                f"seat {seat_num}: available mask {available[seat_num]:b} "
+                f"does not match sold tickets {sold_mask:b} and holds {held[seat_num]:b}"
+            )
+
+    cur.execute("SELECT segment_seats FROM tour_availability WHERE tour_id = %s", (fixture["tour_id"],))
+    row = cur.fetchone()
+    segment_seats = row[0] if row else []
+    for k in range(1, len(fixture["stop_ids"])):
+        expected = seat_set(seat_num for seat_num, m in available.items()
+                            if seat_num not in blocked and m >> (k - 1) & 1)
+        actual = segment_seats[k - 1] if k <= len(segment_seats) else None
+        if actual != expected:
+            problems.append(f"tour_availability segment {k}: seats {actual}, masks say {expected}")
+
+    cur.execute("SELECT departure_stop_id, arrival_stop_id, seats FROM available "
+                "WHERE tour_id = %s", (fixture["tour_id"],))
+    for dep, arr, seats in cur.fetchall():
+        mask = segment_mask(position[dep], position[arr] - 1)
+        expected = sum(1 for seat_num, m in available.items()
+                       if seat_num not in blocked and m & mask == mask)
+        if seats != expected:
+            problems.append(f"available {dep}->{arr}: {seats} seats, masks say {expected}")
+
+    for _, dep, arr, expected, actual in rollup.check(cur, fixture["tour_id"]):
+        problems.append(f"sales_rollup {dep}->{arr}: {actual}, tickets say {expected}")
+    cur.close()
+    return problems
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--bookings", type=int, default=500, help="число попыток покупки")
+    parser.add_argument("--workers", type=int, default=64, help="число параллельных покупателей")
+    parser.add_argument("--stops", type=int, default=6, help="число остановок тестового маршрута")
+    parser.add_argument("--seats", type=int, choices=(46, 48), default=46)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--url", help="адрес запущенного API; по умолчанию обработчик вызывается в процессе")
+    parser.add_argument("--keep", action="store_true", help="не удалять тестовые данные")
+    args = parser.parse_args()
+
+    pool = ConnectionPool(DATABASE_URL, min_size=1, max_size=args.workers)
+    try:
+        with pool.connection() as conn:
+            fixture = create_fixture(conn, args.stops, args.seats)
+        requests = make_requests(fixture, args.bookings, args.seed)
+
+        started = time.perf_counter()
+        if args.url:
+            statuses = run_over_http(args.url, requests, args.workers)
+        else:
+            statuses = run_in_process(pool, requests, args.workers)
+        elapsed = time.perf_counter() - started
+
+        ok = statuses.count(200)
+        conflicts = statuses.count(409)
+        errors = len(statuses) - ok - conflicts
+        print(f"tour {fixture['tour_id']}: {len(statuses)} bookings in {elapsed:.2f}s "
+              f"({len(statuses) / elapsed:.0f} req/s)")
+        print(f"  sold: {ok}  conflicts: {conflicts} ({conflicts / len(statuses):.1%})  other errors: {errors}")
+        if errors:
+            print(f"  unexpected statuses: {sorted(set(s for s in statuses if s not in (200, 409)))}")
+
+        with pool.connection() as conn:
+            problems = check_invariants(conn, fixture)
+            if not args.keep:
+                drop_fixture(conn, fixture)
+    finally:
+        pool.close()
+
+    if problems:
+        print("OVERSOLD:")
+        for problem in problems:
+            print("  " + problem)
+        return 1
+    print("  no overselling detected")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,44 @@
+"""Подсчёт свободных мест по tour_availability.segment_seats (availability.py)."""
+from availability import pair_counts, pair_seats, seat_set, sold_out
+from segments import RangeAnd
+from topology import RouteTopology
+
+# ID остановок не идут по порядку маршрута: 30 -> 10 -> 20 -> 5
+ROUTE = RouteTopology(1, [30, 10, 20, 5])
+
+# Места 1..3: сегмент 1 свободен у всех, сегмент 2 продан целиком,
+# сегмент 3 свободен у мест 2 и 3
+SEGMENT_SEATS = [seat_set([1, 2, 3]), 0, seat_set([2, 3])]
+
+
+def test_pair_counts_follow_route_order():
+    assert pair_counts(ROUTE, SEGMENT_SEATS, ROUTE.pairs()) == {
+        (30, 10): 3,
+        (30, 20): 0,
+        (30, 5): 0,
+        (10, 20): 0,
+        (10, 5): 0,
+        (20, 5): 2,
+    }
+
+
+def test_sold_out():
+    assert sold_out(ROUTE, SEGMENT_SEATS, [(30, 10), (10, 20), (20, 5), (30, 5)]) == [(10, 20), (30, 5)]
+    assert sold_out(ROUTE, SEGMENT_SEATS, [(30, 10), (20, 5)]) == []
+    # Рейса нет в tour_availability
+    assert sold_out(ROUTE, None, ROUTE.pairs()) == []
+
+
+def test_pair_seats_matches_range_and():
+    segment_seats = [seat_set([1, 2, 5, 7]), seat_set([2, 5, 7, 9]), seat_set([1, 5, 7]), seat_set([5])]
+    ranges = RangeAnd(segment_seats)
+    for first in range(1, 5):
+        for last in range(first, 5):
+            assert pair_seats(segment_seats, first, last) == ranges.query(first, last).bit_count()
+
+
+def test_pair_seats_edge_cases():
+    # Место 64 — знаковый бит bigint, из БД приходит отрицательным числом
+    assert pair_seats([-(1 << 63) | 1, -(1 << 63)], 1, 2) == 1
+    # Сегмента нет в segment_seats — считается занятым, как coalesce(..., 0) в БД
+    assert pair_seats([seat_set([1])], 1, 2) == 0
@@ -0,0 +1,84 @@
+"""
+TTLCache (cache.py): срок жизни, ограничение размера и отбрасывание
+значений, прочитанных до инвалидации.
+"""
+import pytest
+
+import cache
+from cache import TTLCache
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(cache, "time", clock)
+    return clock
+
+
+def test_value_expires_after_ttl(clock):
+    c = TTLCache(maxsize=10, ttl=5)
+    c.set("k", 1)
+
+    clock.now += 4.9
+    assert c.get("k") == 1
+    clock.now += 0.1
+    assert c.get("k", "missing") == "missing"
+    assert c.stats()["size"] == 0
+    assert (c.hits, c.misses) == (1, 1)
+
+
+def test_size_is_bounded_by_lru(clock):
+    c = TTLCache(maxsize=2, ttl=60)
+    c.set("a", 1)
+    c.set("b", 2)
+    c.get("a")  # b становится давно не использованным
+    c.set("c", 3)
+
+    assert c.get("b") is None
+    assert (c.get("a"), c.get("c")) == (1, 3)
+    assert c.stats()["size"] == 2
+    assert c.evictions == 1
+
+
+def test_set_after_invalidate_is_dropped(clock):
+    c = TTLCache(maxsize=10, ttl=60)
+    generation = c.generation  # читатель запомнил поколение до запроса к БД
+
+    c.invalidate("other")  # конкурентная запись закоммитилась
+    c.set("k", "stale", generation)
+    assert c.get("k") is None
+
+    c.set("k", "fresh", c.generation)
+    assert c.get("k") == "fresh"
+
+
+def test_set_after_clear_is_dropped(clock):
+    c = TTLCache(maxsize=10, ttl=60)
+    c.set("k", 1)
+    generation = c.generation
+
+    c.clear()
+    c.set("k", "stale", generation)
+
+    assert c.get("k") is None
+    assert c.invalidations == 1
+
+
+def test_invalidate_search_keys(monkeypatch):
+    monkeypatch.setattr(cache, "search_cache", TTLCache(maxsize=10, ttl=60))
+    generation = cache.search_cache.generation
+    cache.search_cache.set(("dates", 1, 2), ["2026-01-01"], generation)
+    cache.search_cache.set(("dates", 1, 3), ["2026-01-02"], generation)
+
+    cache.invalidate_search([(1, 2)])
+
+    assert cache.search_cache.get(("dates", 1, 2)) is None
+    assert cache.search_cache.get(("dates", 1, 3)) == ["2026-01-02"]
@@ -0,0 +1,174 @@
+"""
+Кэш занятости мест (inventory.py) без БД: соединение подменяется
+объектом, который отвечает на запросы загрузки рейса из словарей.
+"""
+from datetime import date, timedelta
+
+from inventory import LOAD_SEATS_QUERY, LOAD_TOUR_QUERY, InventoryEngine
+from topology import ROUTE_STOPS_QUERY
+
+TODAY = date.today()
+YESTERDAY = TODAY - timedelta(days=1)
+
+# ID остановок не идут по порядку маршрута; 2 сегмента
+ROUTE_ID = 9001
+STOPS = [30, 10, 20]
+
+# seat_num, available, blocked, held
+SEATS = [
+    (1, 0b11, False, 0),
+    (2, 0b11, True, 0),
+    (3, 0b10, False, 0),     # сегмент 1 продан
+    (4, 0b10, False, 0b01),  # сегмент 1 удержан
+]
+
+
+class FakeCursor:
+    def __init__(self, conn):
+        self.conn = conn
+        self.rows = []
+
+    def execute(self, query, params):
+        key = params[0]
+        if query == LOAD_TOUR_QUERY:
+            tour = self.conn.tours.get(key)
+            self.rows = [tour] if tour else []
+        elif query == ROUTE_STOPS_QUERY:
+            self.rows = [(stop_id,) for stop_id in self.conn.routes[key]]
+        elif query == LOAD_SEATS_QUERY:
+            self.rows = list(self.conn.seats[key])
+            if self.conn.on_load_seats:
+                self.conn.on_load_seats(key)
+        else:
+            raise AssertionError(f"unexpected query: {query}")
+
+    def fetchone(self):
+        return self.rows[0] if self.rows else None
+
+    def fetchall(self):
+        return self.rows
+
+    def close(self):
+        pass
+
+
+class FakeConnection:
+    """Рейсы tour_id -> (date, route_id), все на маршруте ROUTE_ID."""
+
+    def __init__(self, tours):
+        self.tours = tours
+        self.routes = {ROUTE_ID: STOPS}
+        self.seats = {tour_id: SEATS for tour_id in tours}
+        # Вызывается после чтения мест рейса — «параллельная» запись во время загрузки
+        self.on_load_seats = None
+
+    def cursor(self):
+        return FakeCursor(self)
+
+
+def statuses(inv, first, last):
+    return {seat["seat_num"]: seat["status"] for seat in inv.seat_map(first, last)}
+
+
+def test_seat_map_and_free_count():
+    conn = FakeConnection({1: (TODAY, ROUTE_ID)})
+    engine = InventoryEngine(max_age=0)
+    inv = engine.get(conn, 1)
+
+    assert inv.segment_range(30, 20) == (1, 2)
+    assert statuses(inv, 1, 1) == {1: "available", 2: "blocked", 3: "occupied", 4: "held"}
+    assert statuses(inv, 2, 2) == {1: "available", 2: "blocked", 3: "available", 4: "available"}
+    assert (inv.free_count(1, 1), inv.free_count(2, 2), inv.free_count(1, 2)) == (1, 3, 1)
+
+
+def test_update_seats_applies_to_loaded_tour():
+    conn = FakeConnection({1: (TODAY, ROUTE_ID)})
+    engine = InventoryEngine(max_age=0)
+    inv = engine.get(conn, 1)
+    inv.free_count(1, 2)  # строит RangeAnd, update_seats должен его сбросить
+
+    engine.update_seats(1, [(1, 0b01, False, 0), (2, 0b11, False, 0), (4, 0b11, False, 0)])
+
+    assert engine.peek(1) is inv
+    assert statuses(inv, 1, 2) == {1: "occupied", 2: "available", 3: "occupied", 4: "available"}
+    assert statuses(inv, 2, 2) == {1: "occupied", 2: "available", 3: "available", 4: "available"}
+    assert (inv.free_count(1, 1), inv.free_count(2, 2), inv.free_count(1, 2)) == (3, 3, 2)
+    assert inv.seat_states()[0] == (1, 0b01, False, 0)
+
+
+def test_update_during_load_is_applied_to_snapshot():
+    conn = FakeConnection({1: (TODAY, ROUTE_ID)})
+    engine = InventoryEngine(max_age=0)
+    # Продажа закоммичена после того, как загрузка прочитала места
+    conn.on_load_seats = lambda tour_id: engine.update_seats(tour_id, [(1, 0b00, False, 0)])
+
+    inv = engine.get(conn, 1)
+
+    assert engine.peek(1) is inv
+    assert statuses(inv, 1, 2)[1] == "occupied"
+
+
+def test_invalidate_during_load_drops_snapshot():
+    conn = FakeConnection({1: (TODAY, ROUTE_ID)})
+    engine = InventoryEngine(max_age=0)
+    conn.on_load_seats = engine.invalidate
+
+    assert engine.get(conn, 1) is not None
+    assert engine.peek(1) is None
+    assert engine.stats()["tours"] == 0
+
+    # Следующая загрузка без помех попадает в кэш
+    conn.on_load_seats = None
+    inv = engine.get(conn, 1)
+    assert engine.peek(1) is inv
+
+
+def test_clear_during_load_drops_snapshot():
+    conn = FakeConnection({1: (TODAY, ROUTE_ID)})
+    engine = InventoryEngine(max_age=0)
+    conn.on_load_seats = lambda tour_id: engine.clear()
+
+    engine.get(conn, 1)
+
+    assert engine.peek(1) is None
+
+
+def test_missing_tour_is_not_cached():
+    engine = InventoryEngine(max_age=0)
+    assert engine.get(FakeConnection({}), 1) is None
+    assert engine.stats()["tours"] == 0
+
+
+def test_eviction_drops_past_tours_first():
+    conn = FakeConnection({
+        1: (TODAY, ROUTE_ID),
+        2: (YESTERDAY, ROUTE_ID),
+        3: (TODAY, ROUTE_ID),
+        4: (TODAY, ROUTE_ID),
+    })
+    engine = InventoryEngine(max_tours=2, max_age=0)
+    engine.get(conn, 1)
+    engine.get(conn, 2)
+
+    # Переполнение: уходит прошедший рейс 2, хотя дольше не использовался 1
+    engine.get(conn, 3)
+    assert engine.peek(2) is None
+    assert engine.peek(1) is not None and engine.peek(3) is not None
+
+    # Прошедших рейсов нет — уходит давно не использованный 1
+    engine.get(conn, 4)
+    assert engine.peek(1) is None
+    assert engine.peek(3) is not None and engine.peek(4) is not None
+    assert engine.stats()["evictions"] == 2
+
+
+def test_evict_past():
+    conn = FakeConnection({1: (YESTERDAY, ROUTE_ID), 2: (TODAY, ROUTE_ID)})
+    engine = InventoryEngine(max_age=0)
+    engine.get(conn, 1)
+    engine.get(conn, 2)
+
+    engine.evict_past()
+
+    assert engine.peek(1) is None
+    assert engine.peek(2) is not None
@@ -0,0 +1,208 @@
+"""
+Планировщик поездок (journeys.py) без БД: расписания и рейсы дня
+строятся в памяти, индекс дат загружается через подменённый курсор.
+"""
+import threading
+from datetime import date, time, timedelta
+
+from journeys import (
+    DAY_TOURS_QUERY, ROUTE_TIMES_QUERY, TOUR_PAIRS_QUERY, TOUR_SEATS_QUERY, TOURS_QUERY,
+    DayIndex, DayTour, JourneyIndex, Timetable,
+)
+from inventory import TourInventory
+from segments import full_mask
+
+DAY = date(2026, 6, 1)
+
+# ID остановок не идут по порядку маршрутов
+A, B, C, D = 40, 10, 30, 20
+
+# route_id -> [(stop_id, прибытие, отправление), ...]
+ROUTES = {
+    # A 08:00 -> B 09:00 -> C 10:00
+    1: [(A, None, time(8, 0)), (B, time(9, 0), time(9, 5)), (C, time(10, 0), None)],
+    # B 09:30 -> D 10:30
+    2: [(B, None, time(9, 30)), (D, time(10, 30), None)],
+    # A 07:00 -> D 12:00, без пересадок, но медленнее
+    3: [(A, None, time(7, 0)), (D, time(12, 0), None)],
+}
+
+
+def minutes(h, m=0):
+    return h * 60 + m
+
+
+def seats(num_segments, free=True):
+    return [(1, full_mask(num_segments) if free else 0, False, 0)]
+
+
+def day_index(routes=ROUTES, sold_out=()):
+    """DayIndex с одним рейсом (id = route_id) на каждый маршрут."""
+    idx = DayIndex(DAY)
+    for route_id, rows in routes.items():
+        timetable = Timetable(route_id, rows)
+        idx.timetables[route_id] = timetable
+        topology = timetable.topology
+        inventory = TourInventory(route_id, DAY, topology,
+                                  seats(topology.num_segments, route_id not in sold_out))
+        idx.tours[route_id] = DayTour(route_id, inventory, set(topology.pairs()))
+    idx.finish()
+    return idx
+
+
+def legs(journey):
+    """Поездка как [(tour_id, dep, arr), ...]."""
+    return [(tour_id, dep, arr) for tour_id, _, dep, arr, _, _ in journey[2]]
+
+
+def test_timetable_crosses_midnight():
+    timetable = Timetable(9, [(A, None, time(23, 30)), (B, time(0, 30), time(0, 40)), (C, time(2, 0), None)])
+    assert timetable.departures[0] == minutes(23, 30)
+    assert timetable.arrivals[1:] == [minutes(24, 30), minutes(26)]
+
+
+def test_direct_and_one_transfer():
+    journeys = day_index().plan(A, D, min_transfer=10)
+
+    assert [(j[0], j[1]) for j in journeys] == [(minutes(7), minutes(12)), (minutes(8), minutes(10, 30))]
+    assert legs(journeys[0]) == [(3, A, D)]
+    assert legs(journeys[1]) == [(1, A, B), (2, B, D)]
+
+
+def test_transfer_needs_min_transfer_time():
+    # 09:00 + 40 минут позже отправления 09:30 — пересадка невозможна
+    journeys = day_index().plan(A, D, min_transfer=40)
+    assert [legs(j) for j in journeys] == [[(3, A, D)]]
+
+
+def test_max_transfers():
+    journeys = day_index().plan(A, D, max_transfers=0)
+    assert [legs(j) for j in journeys] == [[(3, A, D)]]
+
+
+def test_earliest_departure():
+    journeys = day_index().plan(A, D, earliest=minutes(7, 30))
+    assert [legs(j) for j in journeys] == [[(1, A, B), (2, B, D)]]
+
+
+def test_sold_out_leg_is_skipped():
+    journeys = day_index(sold_out={2}).plan(A, D)
+    assert [legs(j) for j in journeys] == [[(3, A, D)]]
+
+
+def test_fewer_transfers_dominate():
+    # Прямой рейс с теми же отправлением и прибытием вытесняет поездку с
+    # пересадкой, а более ранний и медленный прямой рейс 3 — тем более
+    routes = dict(ROUTES)
+    routes[4] = [(A, None, time(8, 0)), (D, time(10, 30), None)]
+    journeys = day_index(routes).plan(A, D)
+    assert [legs(j) for j in journeys] == [[(4, A, D)]]
+
+
+def test_later_departure_dominates_with_same_arrival():
+    # Пересадка на B с рейса, отправляющегося позже, при том же прибытии
+    routes = dict(ROUTES)
+    routes[5] = [(A, None, time(8, 30)), (B, time(9, 10), None)]
+    journeys = day_index(routes).plan(A, D)
+    assert [legs(j) for j in journeys] == [[(3, A, D)], [(5, A, B), (2, B, D)]]
+
+
+def test_unknown_or_same_stop():
+    idx = day_index()
+    assert idx.plan(A, A) == []
+    assert idx.plan(A, 999) == []
+    assert idx.plan(D, A) == []
+
+
+class FakeCursor:
+    """Отвечает на запросы JourneyIndex по ROUTES; рейс route_id — на маршруте route_id."""
+
+    def __init__(self, tours, on_seats=None):
+        self.tours = tours  # tour_id -> дата
+        self.on_seats = on_seats
+        self.rows = []
+
+    def execute(self, query, params):
+        ids = params[0]
+        if query == DAY_TOURS_QUERY:
+            self.rows = [(t, t) for t, day in sorted(self.tours.items()) if day == ids]
+        elif query == TOURS_QUERY:
+            self.rows = [(t, t, self.tours[t]) for t in ids if t in self.tours]
+        elif query == ROUTE_TIMES_QUERY:
+            self.rows = [(route_id, *row) for route_id in sorted(ids) for row in ROUTES[route_id]]
+        elif query == TOUR_PAIRS_QUERY:
+            self.rows = [(t, dep, arr) for t in ids
+                         for dep, arr in Timetable(t, ROUTES[t]).topology.pairs()]
+        elif query == TOUR_SEATS_QUERY:
+            self.rows = [(t, *seat) for t in sorted(ids) for seat in seats(len(ROUTES[t]) - 1)]
+            if self.on_seats:
+                self.on_seats()
+        else:
+            raise AssertionError(f"unexpected query: {query}")
+
+    def fetchall(self):
+        return self.rows
+
+
+def test_index_loads_and_refreshes_tours():
+    index = JourneyIndex(max_age=0)
+    cur = FakeCursor({1: DAY, 2: DAY})
+    idx = index.get(cur, DAY)
+    assert [legs(j) for j in idx.plan(A, D)] == [[(1, A, B), (2, B, D)]]
+    assert index.get(cur, DAY) is idx
+
+    # Новый рейс даты перечитывается отдельно, остальные рейсы не трогаются
+    cur.tours[3] = DAY
+    index.invalidate_tours([3])
+    refreshed = index.get(cur, DAY)
+    assert refreshed is not idx and refreshed.tours[1] is idx.tours[1]
+    assert [legs(j) for j in refreshed.plan(A, D)] == [[(3, A, D)], [(1, A, B), (2, B, D)]]
+    assert index.stats()["loads"] == 1 and index.stats()["updates"] == 1
+
+
+def test_seats_changed_during_load_are_applied():
+    index = JourneyIndex(max_age=0)
+    # Место рейса 2 продано после того, как загрузка прочитала места
+    cur = FakeCursor({1: DAY, 2: DAY}, on_seats=lambda: index.seats_changed(2, [(1, 0, False, 0)]))
+    idx = index.get(cur, DAY)
+    assert idx.plan(A, D) == []
+    assert index.get(cur, DAY) is idx
+
+
+def test_invalidation_during_load_is_not_cached():
+    index = JourneyIndex(max_age=0)
+    cur = FakeCursor({1: DAY, 2: DAY}, on_seats=lambda: index.invalidate_tours([3]))
+    idx = index.get(cur, DAY)
+    assert index.stats()["dates"] == 0
+
+    cur.on_seats = None
+    cur.tours[3] = DAY
+    assert index.get(cur, DAY) is not idx
+    assert index.stats()["dates"] == 1
+
+
+def test_loaded_date_does_not_wait_for_another_load():
+    index = JourneyIndex(max_age=0)
+    other_day = DAY + timedelta(days=1)
+    loading, release = threading.Event(), threading.Event()
+
+    def block():
+        loading.set()
+        release.wait(5)
+
+    idx = index.get(FakeCursor({1: DAY}), DAY)
+    loader = threading.Thread(target=index.get, args=(FakeCursor({2: other_day}, on_seats=block), other_day))
+    found = []
+    reader = threading.Thread(target=lambda: found.append(index.get(FakeCursor({}), DAY)))
+    loader.start()
+    try:
+        assert loading.wait(5)
+        # Загрузка другой даты ещё идёт, а загруженная дата отдаётся сразу
+        reader.start()
+        reader.join(2)
+        assert found == [idx]
+    finally:
+        release.set()
+        loader.join()
+        reader.join()
+    assert index.stats()["dates"] == 2
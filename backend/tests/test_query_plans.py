@@ -0,0 +1,56 @@
+"""
+Планы горячих запросов API (check_plans.py): ни один не читает таблицу
+целиком, наличие мест (tour_availability, route_pair) читается по индексам.
+
+Нужна БД с применёнными миграциями (DATABASE_URL); без неё тест
+пропускается. Тестовые данные создаются в транзакции и откатываются.
+"""
+from datetime import date
+
+import psycopg2
+import pytest
+
+import check_plans
+from database import get_connection
+from migrate import applied_migrations, available_migrations
+
+SEED_TOURS = 200
+
+# Названия запросов не зависят от данных: строим список по пустому образцу
+QUERY_NAMES = [name for name, _, _ in check_plans.hot_queries((0, 0, date.today(), 0, 0, 0))]
+
+
+@pytest.fixture(scope="module")
+def plan_db():
+    """(курсор, запросы по названию) в транзакции с тестовыми данными."""
+    try:
+        conn = get_connection()
+    except psycopg2.OperationalError as e:
+        pytest.skip(f"no database: {e}")
+    cur = conn.cursor()
+    try:
+        try:
+            applied = applied_migrations(cur)
+        except psycopg2.errors.UndefinedTable:
+            applied = {}
+        pending = [version for version, _, _ in available_migrations() if version not in applied]
+        conn.rollback()
+        if pending:
+            pytest.fail(f"pending migrations, run python migrate.py: {', '.join(pending)}")
+        sample = check_plans.prepare(cur, SEED_TOURS)
+        yield cur, {name: (query, params) for name, query, params in check_plans.hot_queries(sample)}
+    finally:
+        conn.rollback()
+        cur.close()
+        conn.close()
+
+
+@pytest.mark.parametrize("name", QUERY_NAMES)
+def test_query_plan(plan_db, name):
+    cur, queries = plan_db
+    query, params = queries[name]
+    assert check_plans.plan_problems(name, check_plans.explain(cur, query, params)) == []
+
+
+def test_expectations_name_hot_queries():
+    assert set(check_plans.EXPECTED_ACCESS) <= set(QUERY_NAMES)
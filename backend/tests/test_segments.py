@@ -0,0 +1,43 @@
+"""Маски сегментов и RangeAnd (segments.py)."""
+import random
+
+import pytest
+
+from segments import MAX_SEGMENTS, RangeAnd, full_mask, segment_mask
+
+
+def linear_and(values, first, last):
+    result = -1
+    for value in values[first - 1:last]:
+        result &= value
+    return result
+
+
+@pytest.mark.parametrize("size", [1, 2, 3, 4, 5, 7, 8, 9, 16, 17, MAX_SEGMENTS])
+def test_range_and_matches_linear_and(size):
+    rnd = random.Random(size)
+    # Плотные значения: AND длинных отрезков не сразу обнуляется
+    values = [rnd.getrandbits(48) | rnd.getrandbits(48) | rnd.getrandbits(48) for _ in range(size)]
+    ranges = RangeAnd(values)
+    for first in range(1, size + 1):
+        for last in range(first, size + 1):
+            assert ranges.query(first, last) == linear_and(values, first, last), (first, last)
+
+
+def test_range_and_single_segment_and_full_route():
+    values = [0b1111, 0b0111, 0b1011, 0b1101]
+    ranges = RangeAnd(values)
+    assert [ranges.query(k, k) for k in range(1, 5)] == values
+    assert ranges.query(1, 4) == 0b0001
+
+
+def test_segment_mask():
+    assert segment_mask(1, 1) == 0b1
+    assert segment_mask(2, 4) == 0b1110
+    assert segment_mask(1, 3) == full_mask(3)
+
+
+def test_full_mask_limit():
+    assert full_mask(MAX_SEGMENTS) == (1 << MAX_SEGMENTS) - 1
+    with pytest.raises(ValueError):
+        full_mask(MAX_SEGMENTS + 1)
@@ -0,0 +1,162 @@
+"""
+Кэш топологии маршрутов: позиция каждой остановки на маршруте и диапазон
+сегментов для каждой пары (отправление, прибытие).
+
+ID остановок не обязаны идти по порядку маршрута, поэтому все расчёты
+сегментов (бронирование, схема мест, наличие мест) выполняются
+через позиции из routestop."order", а не через сравнение ID.
+
+Маршрут загружается при первом обращении; обработчики routes сбрасывают
+его при изменении остановок. Для нескольких воркеров действует
+TOPOLOGY_MAX_AGE — время, через которое маршрут перечитывается.
+"""
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from segments import segment_mask
+
+TOPOLOGY_MAX_AGE = float(os.getenv("TOPOLOGY_MAX_AGE", "60"))
+TOUR_ROUTES_MAX = int(os.getenv("TOPOLOGY_TOUR_ROUTES_MAX", "100000"))
+
+ROUTE_STOPS_QUERY = 'SELECT stop_id FROM routestop WHERE route_id = %s ORDER BY "order"'
+TOUR_ROUTE_QUERY = "SELECT route_id FROM tour WHERE id = %s"
+
+
+class RouteTopology:
+    """Порядок остановок одного маршрута."""
+
+    __slots__ = ("route_id", "stops", "positions", "spans", "masks", "loaded_at")
+
+    def __init__(self, route_id, stops):
+        self.route_id = route_id
+        self.stops = list(stops)
+        # stop_id -> позиция на маршруте (с 1)
+        self.positions = {stop_id: i + 1 for i, stop_id in enumerate(self.stops)}
+        # (dep, arr) -> (первый сегмент, последний сегмент)
+        self.spans = {
+            (self.stops[i], self.stops[j]): (i + 1, j)
+            for i in range(len(self.stops) - 1)
+            for j in range(i + 1, len(self.stops))
+        }
+        # (dep, arr) -> маска сегментов поездки
+        self.masks = {pair: segment_mask(*span) for pair, span in self.spans.items()}
+        self.loaded_at = time.monotonic()
+
+    @property
+    def num_segments(self):
+        return max(len(self.stops) - 1, 0)
+
+    def segment_range(self, departure_stop_id, arrival_stop_id):
+        """(первый, последний) сегменты поездки или None, если участок не на маршруте."""
+        return self.spans.get((departure_stop_id, arrival_stop_id))
+
+    def mask(self, departure_stop_id, arrival_stop_id):
+        """Маска сегментов поездки или None, если участок не на маршруте."""
+        return self.masks.get((departure_stop_id, arrival_stop_id))
+
+    def pairs(self):
+        """Все пары остановок маршрута в порядке следования."""
+        return list(self.spans)
+
+    def pairs_losing_seat(self, old_mask, booked_mask):
+        """
+        Пары, у которых число свободных мест уменьшается на 1, если у места
+        с маской old_mask продать сегменты booked_mask: место было свободно
+        на всём участке пары и участок пересекается с проданными сегментами.
+        """
+        return [
+            pair for pair, mask in self.masks.items()
+            if mask & booked_mask and old_mask & mask == mask
+        ]
+
+
+class TopologyCache:
+    def __init__(self, max_age=TOPOLOGY_MAX_AGE):
+        self.max_age = max_age
+        self._routes = {}
+        self._tour_routes = OrderedDict()  # tour_id -> route_id
+        self._generation = 0
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+
+    def peek_route(self, route_id):
+        with self._lock:
+            topo = self._routes.get(route_id)
+            if topo is not None and (self.max_age <= 0 or time.monotonic() - topo.loaded_at < self.max_age):
+                self.hits += 1
+                return topo
+            self.misses += 1
+            return None
+
+    def put_route(self, route_id, stops, generation=None):
+        """Кладёт маршрут в кэш (если с generation не было инвалидаций) и возвращает его."""
+        topo = RouteTopology(route_id, stops)
+        with self._lock:
+            if generation is None or generation == self._generation:
+                self._routes[route_id] = topo
+        return topo
+
+    @property
+    def generation(self):
+        return self._generation
+
+    def route(self, cur, route_id):
+        """Топология маршрута; при промахе читается через курсор cur."""
+        topo = self.peek_route(route_id)
+        if topo is not None:
+            return topo
+        generation = self._generation
+        cur.execute(ROUTE_STOPS_QUERY, (route_id,))
+        return self.put_route(route_id, [row[0] for row in cur.fetchall()], generation)
+
+    def tour_route_id(self, cur, tour_id):
+        with self._lock:
+            route_id = self._tour_routes.get(tour_id)
+            if route_id is not None:
+                self._tour_routes.move_to_end(tour_id)
+                return route_id
+        cur.execute(TOUR_ROUTE_QUERY, (tour_id,))
+        row = cur.fetchone()
+        if row is None:
+            return None
+        self.set_tour_route(tour_id, row[0])
+        return row[0]
+
+    def for_tour(self, cur, tour_id):
+        """Топология маршрута рейса или None, если рейса нет."""
+        route_id = self.tour_route_id(cur, tour_id)
+        if route_id is None:
+            return None
+        return self.route(cur, route_id)
+
+    def set_tour_route(self, tour_id, route_id):
+        with self._lock:
+            self._tour_routes[tour_id] = route_id
+            self._tour_routes.move_to_end(tour_id)
+            while len(self._tour_routes) > TOUR_ROUTES_MAX:
+                self._tour_routes.popitem(last=False)
+
+    def forget_tour(self, tour_id):
+        with self._lock:
+            self._tour_routes.pop(tour_id, None)
+
+    def invalidate_route(self, route_id):
+        with self._lock:
+            self._generation += 1
+            self._routes.pop(route_id, None)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "routes": len(self._routes),
+                "tours": len(self._tour_routes),
+                "hits": self.hits,
+                "misses": self.misses,
+            }
+
+
+topology = TopologyCache()
@@ -0,0 +1,56 @@
+"""
+Условные GET-запросы (ETag / If-None-Match) для справочных списков.
+
+ETag ответа складывается из версий таблиц, из которых он построен
+(таблица table_version, миграция 0007). Версию увеличивает триггер при
+любой записи в таблицу, поэтому проверка «изменились ли данные» — один
+запрос по первичному ключу table_version, а полный запрос списка
+выполняется только если ETag клиента устарел. Иначе ответ 304 без тела.
+
+Ответ отдаётся с Cache-Control: no-cache — браузер хранит его и при
+следующем обращении сам отправляет If-None-Match.
+
+Версии читаются до данных: если запись зафиксирована между двумя
+запросами, клиент получит новые данные со старым ETag и просто
+перезапросит их в следующий раз; старые данные с новым ETag невозможны.
+"""
+from fastapi import Request
+from fastapi.responses import Response
+
+from responses import rows_response
+
+VERSIONS_QUERY = "SELECT table_name, version FROM table_version WHERE table_name = ANY(%s)"
+
+CACHE_CONTROL = "no-cache"
+
+
+def table_etag(cur, tables):
+    """Сильный ETag из версий таблиц tables (порядок имеет значение)."""
+    cur.execute(VERSIONS_QUERY, (list(tables),))
+    versions = dict(cur.fetchall())
+    return '"' + "-".join(str(versions.get(table, 0)) for table in tables) + '"'
+
+
+def etag_matches(request: Request, etag):
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    if header.strip() == "*":
+        return True
+    # Сравнение для If-None-Match слабое: W/"x" совпадает с "x"
+    return any(tag.strip().removeprefix("W/") == etag for tag in header.split(","))
+
+
+def versioned_rows_response(request: Request, cur, tables, query, params=None):
+    """
+    Ответ списком строк query с ETag из версий tables или 304, если
+    у клиента актуальная версия.
+    """
+    etag = table_etag(cur, tables)
+    headers = {"ETag": etag, "Cache-Control": CACHE_CONTROL}
+    if etag_matches(request, etag):
+        return Response(status_code=304, headers=headers)
+    cur.execute(query, params)
+    response = rows_response(cur)
+    response.headers.update(headers)
+    return response
@@ -53,6 +53,22 @@ function PricelistPage() {
     setEditingPriceData({ price: priceObj.price.toString() });
   };
 
+  // Целият ценоразпис като CSV: експорт и зареждане с една заявка (/prices/bulk)
+  const reloadPrices = () => {
+    axios.get(`http://127.0.0.1:8000/prices?pricelist_id=${selectedPricelist.id}`)
+      .then(res => setPrices(res.data));
+  };
+
+  const handleImportCsv = (e) => {
+    const file = e.target.files[0];
+    e.target.value = "";
+    if (!file) return;
+    axios.post(`http://127.0.0.1:8000/prices/bulk/csv?pricelist_id=${selectedPricelist.id}`, file, {
+      headers: { "Content-Type": "text/csv" }
+    }).then(reloadPrices)
+      .catch(err => alert(err.response?.data?.detail || "Ошибка импорта"));
+  };
+
   const handleUpdatePrice = (e) => {
     e.preventDefault();
     axios.put(`http://127.0.0.1:8000/prices/${editingPriceId}`, {
@@ -84,6 +100,14 @@ function PricelistPage() {
         <>
           <h3>Цены для: {selectedPricelist.name}</h3>
 
+          <div className="bulk-prices">
+            <a href={`http://127.0.0.1:8000/prices/bulk?pricelist_id=${selectedPricelist.id}`}>Экспорт CSV</a>
+            <label>
+              Импорт CSV:
+              <input type="file" accept=".csv,text/csv" onChange={handleImportCsv} />
+            </label>
+          </div>
+
           <table className="styled-table">
             <thead>
               <tr>
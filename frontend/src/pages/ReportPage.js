@@ -15,8 +15,10 @@ function ReportPage() {
   const [tours, setTours] = useState([]);
   const [stops, setStops] = useState([]);
 
-  // Результат отчёта
+  // Результат отчёта: сводка и загруженные страницы деталей
   const [reportData, setReportData] = useState(null);
+  const [nextCursor, setNextCursor] = useState(null);
+  const [filters, setFilters] = useState(null);
   const [message, setMessage] = useState("");
 
   // Загружаем маршруты
@@ -45,24 +47,35 @@ function ReportPage() {
       .catch(err => console.error("Ошибка загрузки остановок:", err));
   }, []);
 
+  // Следующая страница деталей (keyset-пагинация по next_cursor)
+  const loadTickets = (body, cursor) => {
+    const params = cursor ? { cursor } : {};
+    return axios.post("http://127.0.0.1:8000/report/tickets", body, { params });
+  };
+
   const handleSearch = (e) => {
     e.preventDefault();
     setMessage("Загрузка отчёта...");
 
     // На бэкенд отправляем ID остановок
-    const departureStopId = departureStop || null;
-    const arrivalStopId = arrivalStop || null;
-
-    axios.post("http://127.0.0.1:8000/report/", {
+    const body = {
       start_date: startDate || null,
       end_date: endDate || null,
       route_id: routeId || null,
       tour_id: tourId || null,
-      departure_stop_id: departureStopId,
-      arrival_stop_id: arrivalStopId
-    })
-    .then(res => {
-      setReportData(res.data);
+      departure_stop_id: departureStop || null,
+      arrival_stop_id: arrivalStop || null
+    };
+
+    // Сводка запрашивается один раз, детали — первой страницей
+    Promise.all([
+      axios.post("http://127.0.0.1:8000/report/summary", body),
+      loadTickets(body, null)
+    ])
+    .then(([summaryRes, ticketsRes]) => {
+      setFilters(body);
+      setReportData({ summary: summaryRes.data, tickets: ticketsRes.data.tickets });
+      setNextCursor(ticketsRes.data.next_cursor);
       setMessage("");
     })
     .catch(err => {
@@ -71,6 +84,18 @@ function ReportPage() {
     });
   };
 
+  const handleLoadMore = () => {
+    loadTickets(filters, nextCursor)
+      .then(res => {
+        setReportData(prev => ({ ...prev, tickets: [...prev.tickets, ...res.data.tickets] }));
+        setNextCursor(res.data.next_cursor);
+      })
+      .catch(err => {
+        console.error("Ошибка получения отчёта:", err);
+        setMessage("Ошибка получения отчёта");
+      });
+  };
+
   return (
     <div className="container report-container">
       <h2>Отчёт по проданным билетам</h2>
@@ -197,6 +222,9 @@ function ReportPage() {
           ) : (
             <p>Нет проданных билетов по заданным параметрам.</p>
           )}
+          {nextCursor && (
+            <button type="button" onClick={handleLoadMore}>Показать ещё</button>
+          )}
         </div>
       )}
     </div>
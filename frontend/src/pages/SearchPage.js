@@ -89,23 +89,36 @@ function SearchPage() {
     setSelectedTour(tour);
     setSelectedSeat(null);
     setSeats([]);
-    // Получаем раскладку мест для выбранного тура
-    axios.get("http://127.0.0.1:8000/seat", {
-      params: {
-        tour_id: tour.id,
-        departure_stop_id: selectedDeparture,
-        arrival_stop_id: selectedArrival
-      },
-    })
-    .then(res => {
-      setSeats(res.data.seats);
-      setSelectedLayout(res.data.layout_variant);
-    })
-    .catch(err => {
+  };
+
+  // Раскладка мест выбранного тура: снимок и изменения по WebSocket,
+  // места, проданные другими покупателями, обновляются без перезапроса
+  useEffect(() => {
+    if (!selectedTour) {
+      return;
+    }
+    const params = new URLSearchParams({
+      tour_id: selectedTour.id,
+      departure_stop_id: selectedDeparture,
+      arrival_stop_id: selectedArrival
+    });
+    const ws = new WebSocket(`ws://127.0.0.1:8000/seat/ws?${params}`);
+    ws.onmessage = (event) => {
+      const data = JSON.parse(event.data);
+      if (data.type === "snapshot") {
+        setSeats(data.seats);
+        setSelectedLayout(data.layout_variant);
+      } else if (data.type === "seats") {
+        const changed = new Map(data.seats.map(s => [s.seat_num, s.status]));
+        setSeats(prev => prev.map(s => changed.has(s.seat_num) ? { ...s, status: changed.get(s.seat_num) } : s));
+      }
+    };
+    ws.onerror = (err) => {
       console.error("Ошибка загрузки мест:", err);
       setSeats([]);
-    });
-  };
+    };
+    return () => ws.close();
+  }, [selectedTour, selectedDeparture, selectedArrival]);
 
   const handleBooking = (e) => {
     e.preventDefault();
@@ -167,7 +180,7 @@ function SearchPage() {
           <h3>Выберите рейс</h3>
           {tours.map(tour => (
             <div key={tour.id} style={{ marginBottom: "10px" }}>
-              <p>Рейс #{tour.id}, Дата: {tour.date}, Доступно мест: {tour.seats}</p>
+              <p>Рейс #{tour.id}, Дата: {tour.date}, Доступно мест: {tour.seats}{tour.price != null && `, Цена: ${tour.price}`}</p>
               <button onClick={() => handleTourSelect(tour)}>Выбрать</button>
             </div>
           ))}